@@ -1,21 +1,61 @@
 import pickle
+import sys
+from os.path import isdir
 
 import numpy as np
-from matplotlib import pyplot as plt
 
+import itemset_store
+import plots
+from data_access import pop_string_option
 
-def load_frequent_itemsets():
-    with open('C:\\Yash Karia\\Homework\\Fall 2020\\BDA\\Group project\\Output\\frequent_itemsets.pkl', 'rb') as file:
-        return pickle.load(file)
 
+def parse_argv(argv):
+    argv = list(argv)
+    levels = pop_string_option(argv, '--levels', None)
 
-def plot_graphs(frequent_itemsets):
-    num_itemsets = np.arange(len(frequent_itemsets)) + 1
+    if len(argv) != 2:
+        print("Usage: python3 analyze_frequent_itemsets.py <directory written by frequent_itemset_mining.py --save>"
+              " [--levels <comma separated itemset sizes>]")
+        sys.exit(1)
+
+    if levels is None:
+        return argv[1], None
+
+    if not all(size.isdigit() and int(size) > 0 for size in levels.split(',')):
+        print("The value of --levels has to be a comma separated list of positive integers")
+        sys.exit(1)
+
+    return argv[1], [int(size) for size in levels.split(',')]
+
+
+def load_frequent_itemsets(path, sizes=None):
+    # Returns the sizes of the levels and their itemsets. The levels saved by frequent_itemset_mining.py --save are
+    # memory-mapped, and only those asked for; a file is read as the pickled list of levels of older runs.
+    if isdir(path):
+        sizes = itemset_store.get_level_sizes(path) if sizes is None else \
+            [size for size in sorted(sizes) if size in itemset_store.get_level_sizes(path)]
+        return sizes, [itemsets for itemsets, _ in itemset_store.load_levels(path, sizes)]
+
+    with open(path, 'rb') as file:
+        frequent_itemsets = pickle.load(file)
+
+    if sizes is None:
+        sizes = range(1, len(frequent_itemsets) + 1)
+
+    sizes = [size for size in sorted(sizes) if size <= len(frequent_itemsets)]
+
+    return sizes, [frequent_itemsets[size - 1] for size in sizes]
+
+
+def plot_graphs(level_sizes, frequent_itemsets):
+    plt = plots.get_pyplot()
+    num_itemsets = np.array(level_sizes)
     fig, axes = plt.subplots(1, 2)
     ax = axes.ravel()
     ax[0] = plot_num_frequent_itemsets(frequent_itemsets, num_itemsets, ax[0])
     ax[1] = plot_num_unique_actors(frequent_itemsets, num_itemsets, ax[1])
-    plt.show()
+    plots.show('frequent_itemsets', {'levels': num_itemsets,
+                                     'numFrequentItemsets': [len(level) for level in frequent_itemsets]})
 
 
 def plot_num_frequent_itemsets(frequent_itemsets, num_itemsets, ax):
@@ -30,18 +70,7 @@ def plot_num_frequent_itemsets(frequent_itemsets, num_itemsets, ax):
 
 
 def plot_num_unique_actors(frequent_itemsets, num_itemsets, ax):
-    unique_actors = []
-
-    for level in frequent_itemsets:
-        level_list = []
-
-        for frequent_itemset in level:
-            level_list.extend(frequent_itemset)
-
-        unique_actors.append(level_list)
-
-    unique_actors = [list(set(level)) for level in unique_actors]
-    num_unique_actors = [len(level) for level in unique_actors]
+    num_unique_actors = [len(np.unique(np.asarray(level))) for level in frequent_itemsets]
 
     ax.bar(num_itemsets, num_unique_actors)
     ax.set_title('Number of unique actors per level')
@@ -52,8 +81,14 @@ def plot_num_unique_actors(frequent_itemsets, num_itemsets, ax):
 
 
 def main():
-    frequent_itemsets = load_frequent_itemsets()
-    plot_graphs(frequent_itemsets)
+    path, sizes = parse_argv(sys.argv)
+    level_sizes, frequent_itemsets = load_frequent_itemsets(path, sizes)
+
+    if len(level_sizes) == 0:
+        print("No saved levels to plot in {}".format(path))
+        sys.exit(1)
+
+    plot_graphs(level_sizes, frequent_itemsets)
 
 
 if __name__ == '__main__':
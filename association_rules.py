@@ -0,0 +1,150 @@
+# Association rules between actors, X => Y, from the frequent itemsets and the supports found while mining them
+#
+# Every rule splits a frequent itemset I into an antecedent X and a consequent Y = I - X, with confidence
+# supp(I) / supp(X) and lift confidence / (supp(Y) / number of movies). Every subset of a frequent itemset is
+# frequent, so its support is looked up among the levels already mined instead of being counted again: the itemsets
+# of every level are sorted once by their rows of actor IDs and a whole batch of subsets is binary searched at once.
+# Consequents grow one actor at a time as in Apriori's rule generation. Moving an actor from the antecedent to the
+# consequent can only lower the confidence, so only consequents that passed are extended, and only into consequents
+# all of whose subsets passed. Rules are written to a CSV file one batch at a time, so they never all sit in memory.
+
+import sys
+
+import numpy as np
+
+import itemset_store
+from data_access import pop_non_negative_float_option, pop_positive_int_option
+
+default_min_confidence = 0.5
+default_min_lift = 0.0
+# Itemsets of a level whose rules are generated together
+default_rule_batch_size = 50000
+
+
+def parse_argv(argv):
+    argv = list(argv)
+    options = {
+        'min_confidence': pop_non_negative_float_option(argv, '--min-confidence', default_min_confidence),
+        'min_lift': pop_non_negative_float_option(argv, '--min-lift', default_min_lift),
+        'batch_size': pop_positive_int_option(argv, '--batch-size', default_rule_batch_size)
+    }
+
+    if len(argv) != 3:
+        print("Usage: python3 association_rules.py <directory written by frequent_itemset_mining.py --save>"
+              " <rules file> [--min-confidence <confidence>] [--min-lift <lift>] [--batch-size <itemsets>]")
+        sys.exit(1)
+
+    return argv[1], argv[2], options
+
+
+def get_row_keys(itemsets):
+    # One opaque key per row, so that rows can be sorted and searched as a whole
+    itemsets = np.ascontiguousarray(itemsets, dtype=np.int64)
+    return itemsets.view(np.dtype((np.void, itemsets.dtype.itemsize * itemsets.shape[1]))).ravel()
+
+
+def get_support_lookup(itemsets, supports):
+    keys = get_row_keys(itemsets)
+    order = np.argsort(keys)
+
+    return {'keys': keys[order], 'supports': np.asarray(supports)[order]}
+
+
+def lookup_supports(lookup, itemsets):
+    return lookup['supports'][np.searchsorted(lookup['keys'], get_row_keys(itemsets))]
+
+
+def extend_consequents(rows, masks, size, consequent_size):
+    # The consequents are bitmasks of positions within the itemset of their row. Every consequent that passed is
+    # extended with each position above its highest one, and the extension is kept if all its subsets passed.
+    passed_keys = rows * (1 << size) + masks
+    highest = np.log2(masks).astype(np.int64)
+    candidate_rows = np.concatenate([rows[highest < position] for position in range(size)])
+    candidate_masks = np.concatenate([masks[highest < position] | (1 << position) for position in range(size)])
+    is_kept = np.ones(len(candidate_rows), dtype=bool)
+
+    for position in range(size):
+        has_position = (candidate_masks >> position) & 1 == 1
+        subset_keys = candidate_rows * (1 << size) + (candidate_masks & ~(1 << position))
+        is_kept &= ~has_position | np.isin(subset_keys, passed_keys)
+
+    return candidate_rows[is_kept], candidate_masks[is_kept]
+
+
+def get_itemset_rules(itemsets, supports, lookups, num_movies, min_confidence, min_lift):
+    # Yields (antecedents, consequents, supports, confidences, lifts) for every consequent size
+    size = itemsets.shape[1]
+    positions = np.arange(size)
+    rows = np.repeat(np.arange(len(itemsets)), size)
+    masks = np.tile(1 << positions, len(itemsets))
+
+    for consequent_size in range(1, size):
+        if len(rows) == 0:
+            return
+
+        rule_itemsets = itemsets[rows]
+        in_consequent = (masks[:, None] >> positions) & 1 == 1
+        # Boolean indexing keeps the order of every row, so antecedents and consequents stay sorted
+        antecedents = rule_itemsets[~in_consequent].reshape(-1, size - consequent_size)
+        consequents = rule_itemsets[in_consequent].reshape(-1, consequent_size)
+        rule_supports = supports[rows]
+        confidences = rule_supports / lookup_supports(lookups[size - consequent_size], antecedents)
+        lifts = confidences * num_movies / lookup_supports(lookups[consequent_size], consequents)
+        is_confident = confidences >= min_confidence
+        is_rule = is_confident & (lifts >= min_lift)
+
+        yield antecedents[is_rule], consequents[is_rule], rule_supports[is_rule], confidences[is_rule], lifts[is_rule]
+
+        rows, masks = extend_consequents(rows[is_confident], masks[is_confident], size, consequent_size)
+
+
+def generate_rules(levels, num_movies, min_confidence=default_min_confidence, min_lift=default_min_lift,
+                   batch_size=default_rule_batch_size):
+    # levels is the list of (itemsets, supports) of sizes 1, 2, ... returned by the miner or by itemset_store
+    lookups = dict((size, get_support_lookup(itemsets, supports))
+                   for size, (itemsets, supports) in enumerate(levels[:-1], start=1))
+
+    for itemsets, supports in levels[1:]:
+        for start in range(0, len(itemsets), batch_size):
+            yield from get_itemset_rules(np.asarray(itemsets[start:start + batch_size], dtype=np.int64),
+                                         np.asarray(supports[start:start + batch_size], dtype=np.int64), lookups,
+                                         num_movies, min_confidence, min_lift)
+
+
+def write_rules(path, rule_batches):
+    # One rule per line: the actor IDs of the antecedent and of the consequent separated by spaces, the support of
+    # the itemset, the confidence and the lift
+    num_rules = 0
+
+    with open(path, 'w') as file:
+        file.write("antecedent,consequent,support,confidence,lift\n")
+
+        for antecedents, consequents, supports, confidences, lifts in rule_batches:
+            if len(supports) == 0:
+                continue
+
+            row_format = ' '.join(['%d'] * antecedents.shape[1]) + ',' + ' '.join(['%d'] * consequents.shape[1]) + \
+                ',%d,%.6f,%.6f'
+            np.savetxt(file, np.column_stack([antecedents, consequents, supports, confidences, lifts]),
+                       fmt=row_format)
+            num_rules += len(supports)
+
+    return num_rules
+
+
+def main():
+    itemsets_dir, rules_path, options = parse_argv(sys.argv)
+    levels = itemset_store.load_levels(itemsets_dir)
+
+    if len(levels) == 0:
+        print("No saved levels in {}".format(itemsets_dir))
+        sys.exit(1)
+
+    num_movies = itemset_store.load_metadata(itemsets_dir)['numMovies']
+    num_rules = write_rules(rules_path, generate_rules(levels, num_movies, options['min_confidence'],
+                                                       options['min_lift'], options['batch_size']))
+    print("Wrote {} rules to {}".format(num_rules, rules_path))
+
+
+if __name__ == '__main__':
+    main()
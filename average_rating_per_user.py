@@ -1,19 +1,93 @@
-# This program plots a scatter plot showing the average rating of each user
+# This program plots a scatter plot showing the average rating of each user, or a histogram of them with --sketch
 
-import matplotlib.pyplot as matplot
-from pymongo import MongoClient
+import sys
+
+import plots
+import rating_stats
+import sketches
+from data_access import default_batch_size, get_database, iter_parquet_parts, pop_flag, pop_parquet_dir, \
+    read_parquet_columns
+
+# Ratings go from 0.5 to 5 stars; bins of a twentieth of a star
+rating_histogram_bins = 90
+
+
+def parse_argv(argv):
+    argv = list(argv)
+    options = {
+        'parquet_dir': pop_parquet_dir(argv),
+        'sketch': pop_flag(argv, '--sketch')
+    }
+
+    if len(argv) > 2:
+        print("Usage: python3 average_rating_per_user.py [MongoDB connection string] [--parquet <directory>]"
+              " [--sketch]")
+        sys.exit(1)
+
+    return None if len(argv) == 1 else argv[1], options
 
 
 def main():
-    query = [
-        {"$group": {"_id": "$userId", "avgRating": {"$avg": "$rating"}}}
-    ]
+    mongodb_connection_string, options = parse_argv(sys.argv)
+    parquet_dir = options['parquet_dir']
+    db = None if parquet_dir is not None else get_database(mongodb_connection_string)
+
+    if options['sketch']:
+        histogram_plot(get_histogram(db, parquet_dir))
+        return
+
+    if parquet_dir is None:
+        result = rating_stats.get_average_ratings(db, 'userId')
+    else:
+        result = get_result_from_parquet(parquet_dir)
 
-    result = list(movies.aggregate(query))
     time_series_plot(result)
 
 
+def get_result_from_parquet(parquet_dir):
+    ratings_df = read_parquet_columns(parquet_dir, 'Ratings', ['userId', 'rating'])
+    avg_ratings = ratings_df.groupby('userId')['rating'].mean()
+
+    return [{'_id': user_id, 'avgRating': avg_rating} for user_id, avg_rating in avg_ratings.items()]
+
+
+def get_histogram(db, parquet_dir):
+    # Histogram of the average rating of every user, built without holding every user's average at once
+    histogram = sketches.new_histogram(0.5, 5, rating_histogram_bins)
+
+    if parquet_dir is None:
+        for averages in rating_stats.iter_average_ratings(db, 'userId', default_batch_size):
+            sketches.update_histogram(histogram, averages)
+
+        return histogram
+
+    import pandas as pd
+
+    # The ratings of a user can be spread over several parts, so the parts are reduced to sums and counts first
+    partial_sums = [ratings_df.groupby('userId')['rating'].agg(['sum', 'count'])
+                    for ratings_df in iter_parquet_parts(parquet_dir, 'Ratings', ['userId', 'rating'])]
+    sums = pd.concat(partial_sums).groupby(level=0).sum()
+
+    return sketches.update_histogram(histogram, sums['sum'] / sums['count'])
+
+
+def histogram_plot(histogram):
+    matplot = plots.get_pyplot()
+    edges = sketches.get_bin_edges(histogram)
+    median = sketches.get_histogram_quantile(histogram, 0.5)
+
+    matplot.title('Distribution of the average rating given by each user')
+    matplot.bar(edges[:-1], histogram['counts'], width=edges[1:] - edges[:-1], align='edge')
+    matplot.axvline(median, color='orange', label='Median ({:.2f})'.format(median))
+    matplot.xlabel("Average Rating")
+    matplot.ylabel("Number of users")
+    matplot.legend()
+    plots.show('average_rating_per_user_histogram', {'edges': edges, 'counts': histogram['counts'], 'median': median})
+    print("Finished plotting histogram")
+
+
 def time_series_plot(result):
+    matplot = plots.get_pyplot()
     x = []
     y = []
     new_list = sorted(result, key=lambda k: k['_id'])
@@ -25,12 +99,9 @@ def time_series_plot(result):
     matplot.scatter(x, y, s=1)
     matplot.xlabel("User ID")
     matplot.ylabel("Average Rating")
-    matplot.show()
+    plots.show('average_rating_per_user', {'userId': x, 'avgRating': y})
     print("Finished plotting time series graph")
 
 
 if __name__ == '__main__':
-    client = MongoClient()
-    db = client['MapReduce']
-    movies = db['Ratings']
     main()
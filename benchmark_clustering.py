@@ -0,0 +1,63 @@
+# Compares the SSE sweep of the iterative k-means engine with the exact dynamic program of kmeans_engine.py
+
+import sys
+import time
+
+import clustering
+from data_access import pop_parquet_dir
+
+
+def parse_argv(argv):
+    argv = list(argv)
+    parquet_dir = pop_parquet_dir(argv)
+
+    if len(argv) > 4:
+        print("Usage: python3 benchmark_clustering.py [maximum k] [number of repeats] [MongoDB connection string]"
+              " [--parquet <directory>]")
+        sys.exit(1)
+
+    max_k = 10 if len(argv) < 2 else int(argv[1])
+    repeats = 3 if len(argv) < 3 else int(argv[2])
+
+    if max_k <= 0:
+        print("Maximum k has to be a positive integer")
+        sys.exit(1)
+
+    if repeats <= 0:
+        print("Number of repeats has to be a positive integer")
+        sys.exit(1)
+
+    return max_k, repeats, None if len(argv) < 4 else argv[3], parquet_dir
+
+
+def time_sweep(ratings, max_k, exact, repeats):
+    timings = []
+    sse_list = None
+
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        sse_list = clustering.get_sse_list(ratings, max_k, exact)
+        timings.append(time.perf_counter() - start_time)
+
+    return min(timings), sse_list
+
+
+def main():
+    max_k, repeats, mongodb_connection_string, parquet_dir = parse_argv(sys.argv)
+    ratings = clustering.normalize(clustering.get_average_ratings(mongodb_connection_string, parquet_dir))
+    iterative_time, iterative_sse_list = time_sweep(ratings, max_k, False, repeats)
+    exact_time, exact_sse_list = time_sweep(ratings, max_k, True, repeats)
+
+    print("Movies: {}".format(len(ratings)))
+    print("Iterative k-means, k = 1 to {}: {:.3f} s".format(max_k, iterative_time))
+    print("Exact dynamic program, k = 1 to {}: {:.3f} s".format(max_k, exact_time))
+
+    for k, (iterative_sse, exact_sse) in enumerate(zip(iterative_sse_list, exact_sse_list), start=1):
+        print("k = {}: iterative SSE {:.6f}, exact SSE {:.6f}".format(k, iterative_sse, exact_sse))
+
+    print("Exact SSE never higher: {}".format(all(exact_sse <= iterative_sse + 1e-9 for iterative_sse, exact_sse in
+                                                  zip(iterative_sse_list, exact_sse_list))))
+
+
+if __name__ == '__main__':
+    main()
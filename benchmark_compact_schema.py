@@ -0,0 +1,190 @@
+# Measures what the layout of compact_schema.py saves: the size of every collection and the time of the genre count
+# of movies_per_genre.py and of the actor baskets of frequent_itemset_mining.py, before and after
+#
+# The dataset is read and cleaned once, as merge_datasets.py does, and the size of every document is measured in BSON
+# in both layouts, which needs no server. Unless --bson-only is given, both layouts are then loaded into two scratch
+# databases of the server, with the indexes of create_indexes.py, and compared by the storage statistics of
+# $collStats and by the time of the queries, which are run on the original collections, through the decoding views
+# and as the compact versions of compact_schema.py. The scratch databases are dropped at the end.
+
+import sys
+import time
+
+import bson
+
+import compact_schema
+import merge_datasets
+from bulk_writer import load_collections, split_into_batches
+from create_indexes import create_indexes
+from data_access import pop_flag, pop_positive_int_option
+from frequent_itemset_mining import get_movies_by_actors_query
+from movies_per_genre import movies_per_genre_query
+
+original_database_name = 'MapReduce_Benchmark_Original'
+compact_database_name = 'MapReduce_Benchmark_Compact'
+default_min_support = 5
+
+
+def parse_argv(argv):
+    argv = list(argv)
+    options = {
+        'repeats': pop_positive_int_option(argv, '--repeats', 3),
+        'min_support': pop_positive_int_option(argv, '--min-support', default_min_support),
+        'bson_only': pop_flag(argv, '--bson-only')
+    }
+
+    if len(argv) != 3 and len(argv) != 4:
+        print("Usage: python3 benchmark_compact_schema.py <directory containing the IMDb dataset>"
+              " <directory containing the MovieLens dataset> [MongoDB connection string] [--repeats <runs>]"
+              " [--min-support <support>] [--bson-only]")
+        sys.exit(1)
+
+    return argv[1], argv[2], None if len(argv) == 3 else argv[3], options
+
+
+def get_collection_dfs(imdb_dir, ml_dir):
+    name_basics_df, title_basics_df, title_principals_df = merge_datasets.get_imdb_dfs(imdb_dir)
+
+    # The documents are built the way merge_datasets.py builds them
+    return [
+        ('Person', name_basics_df, merge_datasets.df_to_documents),
+        ('Movie', title_basics_df, merge_datasets.df_to_documents),
+        ('Person_Roles', title_principals_df, lambda df: df.to_dict('records')),
+        ('Ratings', merge_datasets.get_ml_dfs(ml_dir), lambda df: df.to_dict('records'))
+    ]
+
+
+def get_bson_size(documents):
+    return sum(len(bson.encode(document)) for document in documents)
+
+
+def get_storage_stats(collection):
+    storage_stats = next(collection.aggregate([{'$collStats': {'storageStats': {}}}]))['storageStats']
+    return storage_stats['size'], storage_stats['storageSize'], storage_stats['totalIndexSize']
+
+
+def load_layouts(original_database, compact_database, collection_dfs, encoder):
+    # Returns the BSON sizes of every collection in both layouts, and loads them unless there is no server
+    bson_sizes = {}
+
+    for collection_name, df, to_documents in collection_dfs:
+        original_documents = to_documents(df)
+        compact_documents = to_documents(compact_schema.encode_df(encoder, collection_name, df))
+        bson_sizes[collection_name] = (len(original_documents), get_bson_size(original_documents),
+                                       get_bson_size(compact_documents))
+
+        if original_database is not None:
+            load_collections(original_database,
+                             {collection_name: split_into_batches(original_documents,
+                                                                  merge_datasets.default_batch_size)}, verbose=False)
+            load_collections(compact_database,
+                             {compact_schema.compact_collections[collection_name]:
+                              split_into_batches(compact_documents, merge_datasets.default_batch_size)}, verbose=False)
+
+    return bson_sizes
+
+
+def print_bson_sizes(bson_sizes):
+    print("BSON size per collection (documents: original -> compact, average per document):")
+
+    for collection_name, (num_documents, original_size, compact_size) in bson_sizes.items():
+        print("{}: {} documents, {:.1f} MB -> {:.1f} MB ({:.0%}), {:.1f} -> {:.1f} bytes".format(
+            collection_name, num_documents, original_size / 1e6, compact_size / 1e6, compact_size / original_size,
+            original_size / max(1, num_documents), compact_size / max(1, num_documents)))
+
+
+def print_storage_stats(original_database, compact_database):
+    print("Storage per collection (data, on disk, indexes), original -> compact:")
+
+    for collection_name, compact_collection_name in compact_schema.compact_collections.items():
+        original_stats = get_storage_stats(original_database[collection_name])
+        compact_stats = get_storage_stats(compact_database[compact_collection_name])
+        print("{}: {}".format(collection_name, ', '.join(
+            "{:.1f} MB -> {:.1f} MB".format(original / 1e6, compact / 1e6)
+            for original, compact in zip(original_stats, compact_stats))))
+
+
+def time_query(run_query, repeats):
+    # The fastest run, and the results sorted so that the layouts can be compared
+    timings = []
+    results = None
+
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        results = run_query()
+        timings.append(time.perf_counter() - start_time)
+
+    return min(timings), sorted((document['_id'], sorted(document['movies']) if 'movies' in document
+                                 else document['count']) for document in results)
+
+
+def get_query_runs(original_database, compact_database, encoder, min_support):
+    # (script, [(layout, function running the query)])
+    movies_by_actors_query = get_movies_by_actors_query(min_support)
+
+    return [
+        ('movies_per_genre.py', [
+            ('original', lambda: list(original_database['Movie'].aggregate(movies_per_genre_query))),
+            ('view', lambda: list(compact_database['Movie'].aggregate(movies_per_genre_query))),
+            ('compact', lambda: compact_schema.count_movies_per_genre(encoder, compact_database[
+                compact_schema.compact_collections['Movie']].aggregate(compact_schema.movies_per_mask_query)))
+        ]),
+        ('frequent_itemset_mining.py', [
+            ('original', lambda: list(original_database['Person_Roles'].aggregate(movies_by_actors_query,
+                                                                                   allowDiskUse=True))),
+            ('view', lambda: list(compact_database['Person_Roles'].aggregate(movies_by_actors_query,
+                                                                              allowDiskUse=True))),
+            ('compact', lambda: list(compact_database[compact_schema.compact_collections['Person_Roles']].aggregate(
+                compact_schema.get_movies_by_actors_query(encoder, min_support), allowDiskUse=True)))
+        ])
+    ]
+
+
+def print_query_times(original_database, compact_database, encoder, options):
+    print("Query times (fastest of {} runs):".format(options['repeats']))
+
+    for script, runs in get_query_runs(original_database, compact_database, encoder, options['min_support']):
+        timings = []
+        original_results = None
+
+        for layout, run_query in runs:
+            seconds, results = time_query(run_query, options['repeats'])
+            original_results = results if original_results is None else original_results
+            timings.append("{} {:.3f} s{}".format(layout, seconds,
+                                                  "" if results == original_results else " (different results)"))
+
+        print("{}: {}".format(script, ', '.join(timings)))
+
+
+def main():
+    imdb_dir, ml_dir, mongodb_connection_string, options = parse_argv(sys.argv)
+    collection_dfs = get_collection_dfs(imdb_dir, ml_dir)
+    encoder = {'genres': [], 'categories': []}
+
+    if options['bson_only']:
+        print_bson_sizes(load_layouts(None, None, collection_dfs, encoder))
+        return
+
+    client = merge_datasets.get_client(mongodb_connection_string, merge_datasets.default_workers)
+    original_database, compact_database = client[original_database_name], client[compact_database_name]
+
+    try:
+        for database in [original_database, compact_database]:
+            client.drop_database(database.name)
+
+        bson_sizes = load_layouts(original_database, compact_database, collection_dfs, encoder)
+        compact_schema.create_views(compact_database, encoder)
+
+        for database in [original_database, compact_database]:
+            create_indexes(database)
+
+        print_bson_sizes(bson_sizes)
+        print_storage_stats(original_database, compact_database)
+        print_query_times(original_database, compact_database, encoder, options)
+    finally:
+        for database in [original_database, compact_database]:
+            client.drop_database(database.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# Compares the list comprehension transforms merge_datasets.py used to run on title.principals with the vectorized ones
+
+import sys
+import time
+from os.path import isfile
+
+import pandas as pd
+
+import merge_datasets
+
+default_title_principals_path = "dataset/IMDb dataset/title.principals.tsv.gz"
+
+
+def parse_argv(argv):
+    if len(argv) > 3:
+        print("Usage: python3 benchmark_merge_datasets.py [path to title.principals.tsv.gz] [number of repeats]")
+        sys.exit(1)
+
+    title_principals_path = default_title_principals_path if len(argv) < 2 else argv[1]
+    repeats = 3 if len(argv) < 3 else int(argv[2])
+
+    if not isfile(title_principals_path):
+        print("Invalid file")
+        sys.exit(1)
+
+    if repeats <= 0:
+        print("Number of repeats has to be a positive integer")
+        sys.exit(1)
+
+    return title_principals_path, repeats
+
+
+def read_and_clean_before(title_principals_path):
+    title_principals_df = pd.read_csv(title_principals_path, sep="\t", usecols=merge_datasets.title_principals_columns,
+                                      low_memory=False, compression='gzip')
+    nconst_list = [int(nconst[2:]) for nconst in title_principals_df['nconst']]
+    tconst_list = [int(tconst[2:]) for tconst in title_principals_df['tconst']]
+    title_principals_df['nconst'] = nconst_list
+    title_principals_df['tconst'] = tconst_list
+    title_principals_df.rename(columns={'tconst': 'movieId', 'nconst': 'personId'}, inplace=True)
+
+    return title_principals_df.to_dict('records')
+
+
+def read_and_clean_after(title_principals_path):
+    title_principals_df = pd.read_csv(title_principals_path, sep="\t", usecols=merge_datasets.title_principals_columns,
+                                      low_memory=False, compression='gzip', na_values=merge_datasets.imdb_na_values,
+                                      dtype=merge_datasets.imdb_dtypes)
+
+    return merge_datasets.clean_title_principals_df(title_principals_df).to_dict('records')
+
+
+def time_function(function, title_principals_path, repeats):
+    timings = []
+    documents = None
+
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        documents = function(title_principals_path)
+        timings.append(time.perf_counter() - start_time)
+
+    return min(timings), documents
+
+
+def main():
+    title_principals_path, repeats = parse_argv(sys.argv)
+    before_time, before_documents = time_function(read_and_clean_before, title_principals_path, repeats)
+    after_time, after_documents = time_function(read_and_clean_after, title_principals_path, repeats)
+
+    print("Rows: {}".format(len(after_documents)))
+    print("Before (list comprehensions): {:.3f} s".format(before_time))
+    print("After (vectorized): {:.3f} s".format(after_time))
+    print("Speedup: {:.2f}x".format(before_time / after_time))
+    print("Identical documents: {}".format(before_documents == after_documents))
+
+
+if __name__ == '__main__':
+    main()
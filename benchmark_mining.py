@@ -0,0 +1,82 @@
+# Compares the Apriori, Eclat and FP-Growth miners of mining_engine.py over a range of minimum supports
+
+import sys
+import time
+
+import numpy as np
+
+import frequent_itemset_mining
+import mining_engine
+from data_access import pop_parquet_dir
+
+default_min_supports = [20, 10, 5]
+
+
+def parse_argv(argv):
+    argv = list(argv)
+    parquet_dir = pop_parquet_dir(argv)
+
+    if len(argv) > 4:
+        print("Usage: python3 benchmark_mining.py [comma separated minimum supports] [number of repeats]"
+              " [MongoDB connection string] [--parquet <directory>]")
+        sys.exit(1)
+
+    min_supports = default_min_supports if len(argv) < 2 else [int(value) for value in argv[1].split(',')]
+    repeats = 3 if len(argv) < 3 else int(argv[2])
+
+    if any(min_support <= 0 for min_support in min_supports):
+        print("Minimum supports have to be positive integers")
+        sys.exit(1)
+
+    if repeats <= 0:
+        print("Number of repeats has to be a positive integer")
+        sys.exit(1)
+
+    return min_supports, repeats, None if len(argv) < 4 else argv[3], parquet_dir
+
+
+def mine(baskets, min_support, algorithm):
+    return [(itemsets, supports) for itemsets, supports in
+            mining_engine.mine_baskets(baskets, min_support, float('inf'), algorithm)]
+
+
+def same_levels(levels, other_levels):
+    return len(levels) == len(other_levels) and \
+        all(np.array_equal(itemsets, other_itemsets) and np.array_equal(supports, other_supports)
+            for (itemsets, supports), (other_itemsets, other_supports) in zip(levels, other_levels))
+
+
+def time_algorithm(baskets, min_support, algorithm, repeats):
+    timings = []
+    levels = None
+
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        levels = mine(baskets, min_support, algorithm)
+        timings.append(time.perf_counter() - start_time)
+
+    return min(timings), levels
+
+
+def main():
+    min_supports, repeats, mongodb_connection_string, parquet_dir = parse_argv(sys.argv)
+
+    for min_support in min_supports:
+        baskets = frequent_itemset_mining.get_actor_baskets(mongodb_connection_string, min_support, parquet_dir)
+        reference_levels = None
+
+        print("Minimum support {}: {} actors".format(min_support, len(baskets[0])))
+
+        for algorithm in mining_engine.algorithms:
+            seconds, levels = time_algorithm(baskets, min_support, algorithm, repeats)
+
+            if reference_levels is None:
+                reference_levels = levels
+
+            print("Minimum support {}, {}: {:.3f} s, {} itemsets in {} levels, identical itemsets: {}"
+                  .format(min_support, algorithm, seconds, sum(len(itemsets) for itemsets, _ in levels),
+                          len(levels), same_levels(reference_levels, levels)))
+
+
+if __name__ == '__main__':
+    main()
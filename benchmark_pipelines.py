@@ -0,0 +1,384 @@
+# Times every pipeline on a synthetic dataset written by generate_datasets.py and saves the timings as JSON, so that
+# two versions of the scripts can be compared on exactly the same data
+#
+# The pipelines run either on the Parquet cache, or on the MongoDB code paths against mongomock's in-memory server,
+# so neither needs the real dumps nor a running MongoDB. Every benchmark calls the functions a script runs, without
+# plotting, and is repeated; the fastest run is the one compared, as in the other benchmark scripts. mongomock does
+# not implement the $merge of rating_stats.py, which is emulated on top of it. A benchmark that fails is recorded with
+# its error and the others still run.
+
+import contextlib
+import io
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from os.path import isfile, join
+
+import numpy as np
+import pandas as pd
+
+import average_rating_per_user
+import clustering
+import data_access
+import frequent_itemset_mining
+import generate_datasets
+import merge_datasets
+import mining_engine
+import movie_overview
+import movies_per_genre
+import movies_per_year
+import pairwise_comparison
+import rating_stats
+from data_access import pop_non_negative_int_option, pop_positive_int_option, pop_string_option
+
+backends = ['parquet', 'mongomock']
+default_min_support = 5
+default_k = 5
+default_max_k = 10
+
+
+def parse_argv(argv):
+    argv = list(argv)
+
+    if len(argv) == 4 and argv[1] == '--compare':
+        return 'compare', argv[2:], None
+
+    options = {
+        'rows': pop_positive_int_option(argv, '--rows', generate_datasets.default_rows),
+        'seed': pop_non_negative_int_option(argv, '--seed', generate_datasets.default_seed),
+        'repeats': pop_positive_int_option(argv, '--repeats', 3),
+        'min_support': pop_positive_int_option(argv, '--min-support', default_min_support),
+        'data_dir': pop_string_option(argv, '--data', None),
+        'backend': pop_string_option(argv, '--backend', 'parquet'),
+        'only': pop_string_option(argv, '--only', None)
+    }
+
+    if len(argv) != 2:
+        print_usage()
+        sys.exit(1)
+
+    if options['backend'] not in backends:
+        print("The backend has to be one of: {}".format(', '.join(backends)))
+        sys.exit(1)
+
+    if options['only'] is not None:
+        options['only'] = options['only'].split(',')
+        unknown = [name for name in options['only'] if name not in benchmarks]
+
+        if len(unknown) > 0:
+            print("Unknown benchmarks: {}. The benchmarks are: {}".format(', '.join(unknown), ', '.join(benchmarks)))
+            sys.exit(1)
+
+    return 'run', argv[1], options
+
+
+def print_usage():
+    print("Usages:\n1. To run the benchmarks: python3 benchmark_pipelines.py <results file> [--rows <rows>]"
+          " [--seed <seed>] [--repeats <runs>] [--min-support <support>] [--data <directory>]"
+          " [--backend <{}>] [--only <comma separated benchmarks>]".format('|'.join(backends)))
+    print("2. To compare two results files: python3 benchmark_pipelines.py --compare <old results> <new results>")
+
+
+def prepare_dataset(data_dir, rows, seed):
+    # The files are only generated again when the directory holds a dataset of another size, seed or version of the
+    # generator
+    parameters = {'rows': rows, 'seed': seed, 'version': generate_datasets.generator_version}
+    dataset_path = join(data_dir, 'dataset.json')
+
+    if isfile(dataset_path):
+        with open(dataset_path) as file:
+            dataset = json.load(file)
+
+        if dataset['parameters'] == parameters:
+            return dataset
+
+    files = generate_datasets.generate_datasets(join(data_dir, 'imdb'), join(data_dir, 'movielens'), rows, seed)
+    dataset = {'parameters': parameters, 'files': files}
+
+    with open(dataset_path, 'w') as file:
+        json.dump(dataset, file)
+
+    return dataset
+
+
+def substitute_new_fields(expression, document):
+    # The $$new.<field> variables of a $merge pipeline replaced by the values of the document to merge
+    if isinstance(expression, dict):
+        return dict((key, substitute_new_fields(value, document)) for key, value in expression.items())
+
+    if isinstance(expression, list):
+        return [substitute_new_fields(value, document) for value in expression]
+
+    if isinstance(expression, str) and expression.startswith('$$new.'):
+        return {'$literal': document[expression[len('$$new.'):]]}
+
+    return expression
+
+
+def with_merge_emulation(aggregate):
+    # A pipeline ending in a $merge on _id is run without it, and its documents are merged into the target here:
+    # inserted when new, and otherwise replaced by the result of the whenMatched pipeline on the stored document
+    def aggregate_and_merge(collection, pipeline, *args, **kwargs):
+        if len(pipeline) == 0 or '$merge' not in pipeline[-1]:
+            return aggregate(collection, pipeline, *args, **kwargs)
+
+        merge = pipeline[-1]['$merge']
+        target = collection.database[merge['into']]
+        documents = list(aggregate(collection, pipeline[:-1], *args, **kwargs))
+        stored_ids = set(document['_id'] for document in target.find(
+            {'_id': {'$in': [document['_id'] for document in documents]}}, {'_id': 1}))
+        new_documents = [document for document in documents if document['_id'] not in stored_ids]
+
+        if len(new_documents) > 0:
+            target.insert_many(new_documents)
+
+        for document in documents:
+            if document['_id'] in stored_ids:
+                merged = next(target.aggregate([{'$match': {'_id': document['_id']}}] +
+                                               substitute_new_fields(merge['whenMatched'], document)))
+                target.replace_one({'_id': document['_id']}, merged)
+
+        return iter([])
+
+    return aggregate_and_merge
+
+
+def use_mongomock():
+    # Every client the scripts open, the writers' of merge_datasets.py included, is the same in-memory server
+    import mongomock
+
+    if not hasattr(mongomock.collection.Collection.aggregate, 'emulates_merge'):
+        mongomock.collection.Collection.aggregate = with_merge_emulation(mongomock.collection.Collection.aggregate)
+        mongomock.collection.Collection.aggregate.emulates_merge = True
+
+    server = mongomock.MongoClient()
+    data_access.client_settings['client_factory'] = lambda *args, **kwargs: server
+    data_access.clients.clear()
+
+
+def drop_database(run):
+    if run['parquet_dir'] is None:
+        data_access.get_client().drop_database('MapReduce')
+
+
+def ingest(run):
+    if run['parquet_dir'] is None:
+        metrics_by_collection = merge_datasets.create_collections(run['imdb_dir'], run['ml_dir'], None)
+        return sum(metrics['rows'] for metrics in metrics_by_collection.values())
+
+    return sum(merge_datasets.create_parquet_cache(run['imdb_dir'], run['ml_dir'], run['parquet_dir'],
+                                                   merge_datasets.default_batch_size).values())
+
+
+def read_actor_baskets(run):
+    run['baskets'] = frequent_itemset_mining.get_actor_baskets(None, run['min_support'], run['parquet_dir'])
+    return len(run['baskets'][0])
+
+
+def ensure_actor_baskets(run):
+    if 'baskets' not in run:
+        read_actor_baskets(run)
+
+
+def get_mining_benchmark(algorithm):
+    def mine(run):
+        return sum(len(level) for level in frequent_itemset_mining.get_frequent_itemsets(
+            run['baskets'], run['min_support'], float('inf'), algorithm))
+
+    return mine
+
+
+def read_average_ratings(run):
+    run['ratings'] = clustering.normalize(clustering.get_average_ratings(None, run['parquet_dir']))
+    return len(run['ratings'])
+
+
+def ensure_average_ratings(run):
+    if 'ratings' not in run:
+        read_average_ratings(run)
+
+
+def cluster_ratings(run):
+    clustering.k_means(run['ratings'], default_k, seed=run['seed'])
+    return len(run['ratings'])
+
+
+def sweep_ratings(run):
+    clustering.get_sse_list(run['ratings'], default_max_k, seed=run['seed'])
+    return len(run['ratings'])
+
+
+def rebuild_rating_stats(run):
+    database = data_access.get_database()
+    rating_stats.refresh_rating_stats(database, rebuild=True)
+
+    return sum(database[collection_name].count_documents({})
+               for collection_name in rating_stats.stats_collections.values())
+
+
+def count_movies_per_genre(run):
+    if run['parquet_dir'] is None:
+        return len(movies_per_genre.get_result_from_mongodb(None))
+
+    return len(movies_per_genre.get_result_from_parquet(run['parquet_dir']))
+
+
+def count_movies_per_year(run):
+    if run['parquet_dir'] is None:
+        return len(list(data_access.get_database()['Movie'].aggregate(movies_per_year.movies_per_year_query,
+                                                                      allowDiskUse=True)))
+
+    return len(movies_per_year.get_result_from_parquet(run['parquet_dir']))
+
+
+def average_user_ratings(run):
+    if run['parquet_dir'] is None:
+        return len(rating_stats.get_average_ratings(data_access.get_database(), 'userId'))
+
+    return len(average_rating_per_user.get_result_from_parquet(run['parquet_dir']))
+
+
+def count_grids(run):
+    runtime_bin_width = pairwise_comparison.default_runtime_bin_width
+
+    return len(pairwise_comparison.get_grid('Movie', 'startYear', 'runtimeMinutes', 1, runtime_bin_width,
+                                            run['parquet_dir'])) + \
+        len(pairwise_comparison.get_grid('Person', 'birthYear', 'deathYear', 1, 1, run['parquet_dir']))
+
+
+def get_overview(run):
+    runtime_bin_width = movie_overview.default_runtime_bin_width
+
+    if run['parquet_dir'] is None:
+        overview = movie_overview.get_movie_overview(None, runtime_bin_width)
+    else:
+        overview = movie_overview.get_movie_overview_from_parquet(run['parquet_dir'], runtime_bin_width)
+
+    return sum(len(documents) for documents in overview.values())
+
+
+# Run in this order; the mining and the clustering reuse the baskets and the ratings read by the benchmarks before
+# them, or read them in their untimed setup when run alone. Every benchmark returns the number of rows or results it
+# produced, which is compared too.
+benchmarks = dict([
+    ('ingest', {'run': ingest, 'setup': drop_database}),
+    ('actor_baskets', {'run': read_actor_baskets})
+] + [
+    ('mining_' + algorithm, {'run': get_mining_benchmark(algorithm), 'setup': ensure_actor_baskets})
+    for algorithm in mining_engine.algorithms
+] + [
+    ('average_ratings', {'run': read_average_ratings}),
+    ('k_means', {'run': cluster_ratings, 'setup': ensure_average_ratings}),
+    ('sse_list', {'run': sweep_ratings, 'setup': ensure_average_ratings}),
+    # The rating aggregates only exist in MongoDB
+    ('rating_stats', {'run': rebuild_rating_stats, 'backends': ['mongomock']}),
+    ('movies_per_genre', {'run': count_movies_per_genre}),
+    ('movies_per_year', {'run': count_movies_per_year}),
+    ('average_rating_per_user', {'run': average_user_ratings}),
+    ('pairwise_comparison', {'run': count_grids}),
+    ('movie_overview', {'run': get_overview})
+])
+
+
+def time_benchmark(benchmark, run, repeats):
+    timings = []
+    rows = None
+
+    for _ in range(repeats):
+        if 'setup' in benchmark:
+            benchmark['setup'](run)
+
+        # The scripts report their progress; only the timings are wanted here
+        with contextlib.redirect_stdout(io.StringIO()):
+            start_time = time.perf_counter()
+            rows = benchmark['run'](run)
+            timings.append(time.perf_counter() - start_time)
+
+    return {'seconds': min(timings), 'timings': timings, 'rows': int(rows)}
+
+
+def get_environment():
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'platform': platform.platform(), 'processor': platform.processor()}
+
+
+def run_benchmarks(results_path, options):
+    data_dir = tempfile.mkdtemp() if options['data_dir'] is None else options['data_dir']
+
+    try:
+        dataset = prepare_dataset(data_dir, options['rows'], options['seed'])
+
+        if options['backend'] == 'mongomock':
+            use_mongomock()
+
+        run = {
+            'imdb_dir': join(data_dir, 'imdb'),
+            'ml_dir': join(data_dir, 'movielens'),
+            'parquet_dir': join(data_dir, 'parquet') if options['backend'] == 'parquet' else None,
+            'min_support': options['min_support'],
+            'seed': options['seed']
+        }
+        results = {}
+
+        # ingest fills the backend every other benchmark reads
+        for name in benchmarks if options['only'] is None else ['ingest'] + options['only']:
+            if name in results or options['backend'] not in benchmarks[name].get('backends', backends):
+                continue
+
+            try:
+                results[name] = time_benchmark(benchmarks[name], run, options['repeats'])
+                print("{}: {:.3f} s, {} rows".format(name, results[name]['seconds'], results[name]['rows']))
+            except Exception as error:
+                results[name] = {'error': '{}: {}'.format(type(error).__name__, error)}
+                print("{}: failed, {}".format(name, results[name]['error']))
+    finally:
+        if options['data_dir'] is None:
+            shutil.rmtree(data_dir)
+
+    report = {'dataset': dataset, 'backend': options['backend'], 'repeats': options['repeats'],
+              'minSupport': options['min_support'], 'environment': get_environment(), 'benchmarks': results}
+
+    with open(results_path, 'w') as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+
+    print("Saved the results to {}".format(results_path))
+
+
+def compare_results(old_path, new_path):
+    with open(old_path) as file:
+        old_report = json.load(file)
+
+    with open(new_path) as file:
+        new_report = json.load(file)
+
+    for key in ['dataset', 'backend', 'minSupport']:
+        if old_report[key] != new_report[key]:
+            print("Warning: the {} differs, so the timings are not comparable".format(key))
+
+    for name, new_result in new_report['benchmarks'].items():
+        old_result = old_report['benchmarks'].get(name)
+
+        if old_result is None or 'error' in old_result or 'error' in new_result:
+            print("{}: {}".format(name, "new" if old_result is None else "failed in one of the runs"))
+            continue
+
+        print("{}: {:.3f} s -> {:.3f} s, {:.2f}x{}".format(
+            name, old_result['seconds'], new_result['seconds'], old_result['seconds'] / new_result['seconds'],
+            "" if old_result['rows'] == new_result['rows'] else ", rows changed from {} to {}".format(
+                old_result['rows'], new_result['rows'])))
+
+
+def main():
+    mode, arguments, options = parse_argv(sys.argv)
+
+    if mode == 'compare':
+        compare_results(*arguments)
+    else:
+        run_benchmarks(arguments, options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+# Loads batches of documents into several MongoDB collections concurrently through a shared thread pool
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import ReplaceOne
+from pymongo.errors import AutoReconnect, BulkWriteError, WTimeoutError
+
+import profiling
+
+transient_errors = (AutoReconnect, WTimeoutError)
+duplicate_key_error_code = 11000
+
+
+def split_into_batches(documents, batch_size):
+    for start in range(0, len(documents), batch_size):
+        yield documents[start:start + batch_size]
+
+
+def new_metrics():
+    return {'rows': 0, 'skipped': 0, 'batches': 0, 'retries': 0, 'start_time': time.perf_counter(), 'seconds': 0.0,
+            'lock': threading.Lock()}
+
+
+def record_batch(collection_name, metrics, num_rows, num_skipped, verbose):
+    with metrics['lock']:
+        metrics['rows'] += num_rows
+        metrics['skipped'] += num_skipped
+        metrics['batches'] += 1
+        metrics['seconds'] = time.perf_counter() - metrics['start_time']
+
+        if verbose:
+            print("{}: {} rows written, {} skipped ({:.0f} rows/s)".format(collection_name, metrics['rows'],
+                                                                          metrics['skipped'],
+                                                                          get_rows_per_second(metrics)))
+
+
+def record_retry(metrics):
+    with metrics['lock']:
+        metrics['retries'] += 1
+
+
+def get_rows_per_second(metrics):
+    return metrics['rows'] / metrics['seconds'] if metrics['seconds'] > 0 else 0
+
+
+def only_duplicate_key_errors(bulk_write_error):
+    details = bulk_write_error.details
+    return len(details.get('writeConcernErrors', [])) == 0 and \
+        all(error['code'] == duplicate_key_error_code for error in details.get('writeErrors', []))
+
+
+def get_changed_documents(collection, documents):
+    # Documents whose content hash is already stored are unchanged since the last run
+    existing_hashes = set(document['_hash'] for document in
+                          collection.find({'_hash': {'$in': [document['_hash'] for document in documents]}},
+                                          {'_id': 0, '_hash': 1}))
+    return [document for document in documents if document['_hash'] not in existing_hashes]
+
+
+def upsert_documents(collection, documents, upsert_key):
+    requests = [ReplaceOne(dict((key, document[key]) for key in upsert_key), document, upsert=True)
+                for document in documents]
+    collection.bulk_write(requests, ordered=False)
+
+
+def write_batch(collection, documents, upsert_key):
+    with profiling.stage('insert ' + collection.name, 'insert') as record:
+        record['rows'] = len(documents)
+
+        if upsert_key is None:
+            collection.insert_many(documents, ordered=False)
+            return len(documents)
+
+        changed_documents = get_changed_documents(collection, documents)
+
+        if len(changed_documents) > 0:
+            upsert_documents(collection, changed_documents, upsert_key)
+
+        return len(changed_documents)
+
+
+def insert_batch(collection, documents, upsert_key, metrics, max_retries, retry_delay, verbose):
+    attempt = 0
+
+    while True:
+        try:
+            num_written = write_batch(collection, documents, upsert_key)
+            break
+        except BulkWriteError as error:
+            # insert_many assigns an _id to every document before sending it, so after a transient error the
+            # documents that did reach the server come back as duplicate keys and the rest are inserted
+            if attempt > 0 and upsert_key is None and only_duplicate_key_errors(error):
+                num_written = len(documents)
+                break
+
+            # Two threads upserting the same new key can both try to insert it, and the unique index of the key
+            # rejects one of them; written again, the batch replaces the document the other one inserted
+            if upsert_key is not None and attempt < max_retries and only_duplicate_key_errors(error):
+                record_retry(metrics)
+                attempt += 1
+                continue
+
+            raise
+        except transient_errors:
+            if attempt == max_retries:
+                raise
+
+            record_retry(metrics)
+            time.sleep(retry_delay * 2 ** attempt)
+            attempt += 1
+
+    record_batch(collection.name, metrics, num_written, len(documents) - num_written, verbose)
+
+
+def submit_batches(executor, collection, batches, upsert_key, metrics, in_flight, max_retries, retry_delay,
+                   verbose):
+    # The whole load of a collection is one stage, which records the time the server spent on the collection
+    with profiling.stage('load ' + collection.name, 'load', collection) as record:
+        futures = []
+
+        for documents in batches:
+            if len(documents) == 0:
+                continue
+
+            in_flight.acquire()
+            future = executor.submit(insert_batch, collection, documents, upsert_key, metrics, max_retries,
+                                     retry_delay, verbose)
+            future.add_done_callback(lambda _: in_flight.release())
+            futures.append(future)
+
+        for future in futures:
+            future.result()
+
+        record['rows'] = metrics['rows']
+
+
+def load_collections(database, batches_by_collection, workers=8, max_retries=3, retry_delay=0.5, verbose=True,
+                     upsert_keys=None):
+    # With upsert_keys (collection name -> key fields), every document must carry a '_hash' of its content;
+    # documents whose hash is already stored are skipped and the rest replace the document with the same key
+    upsert_keys = {} if upsert_keys is None else upsert_keys
+    metrics_by_collection = dict((collection_name, new_metrics()) for collection_name in batches_by_collection)
+    # Bounds the number of batches that have been read but not yet written
+    in_flight = threading.BoundedSemaphore(2 * workers)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            ThreadPoolExecutor(max_workers=len(batches_by_collection)) as producers:
+        producer_futures = [producers.submit(submit_batches, executor, database[collection_name], batches,
+                                             upsert_keys.get(collection_name),
+                                             metrics_by_collection[collection_name], in_flight, max_retries,
+                                             retry_delay, verbose)
+                            for collection_name, batches in batches_by_collection.items()]
+
+        for future in producer_futures:
+            future.result()
+
+    for metrics in metrics_by_collection.values():
+        del metrics['start_time'], metrics['lock']
+        metrics['rowsPerSecond'] = get_rows_per_second(metrics)
+
+    return metrics_by_collection
+
+
+def print_metrics(metrics_by_collection):
+    for collection_name, metrics in metrics_by_collection.items():
+        print("{}: {} rows written and {} unchanged rows skipped in {} batches, {} retries, {:.1f} s ({:.0f} rows/s)"
+              .format(collection_name, metrics['rows'], metrics['skipped'], metrics['batches'], metrics['retries'],
+                      metrics['seconds'], metrics['rowsPerSecond']))
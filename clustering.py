@@ -1,189 +1,277 @@
 import sys
-from math import sqrt, pow
-from random import random
 
-from matplotlib import pyplot as plt
-from matplotlib import colors as mcolors
-from pymongo import MongoClient
+import numpy as np
+
+import kmeans_engine
+import minibatch_kmeans
+import plots
+import rating_stats
+from data_access import get_database, iter_parquet_parts, pop_flag, pop_non_negative_int_option, pop_parquet_dir, \
+    pop_positive_int_option, read_parquet_columns
+
+# Reads the per-movie aggregates maintained by rating_stats.py and looks up the movie of each of them
+movie_features_query = [
+    {"$addFields": {"avgRating": {"$divide": ["$sum", "$count"]}}},
+    {"$lookup": {"from": "Movie", "localField": "_id", "foreignField": "id", "as": "movie"}},
+    {"$unwind": "$movie"},
+    {"$project": {"_id": 0, "avgRating": 1, "numRatings": "$count",
+                  "ratingVariance": {"$max": [0, {"$subtract": [{"$divide": ["$sumSquares", "$count"]},
+                                                                {"$multiply": ["$avgRating", "$avgRating"]}]}]},
+                  "startYear": "$movie.startYear", "runtimeMinutes": "$movie.runtimeMinutes",
+                  "genres": "$movie.genres"}}
+]
+
+numeric_features = ['avgRating', 'numRatings', 'ratingVariance', 'startYear', 'runtimeMinutes']
+default_feature_batch_size = 10000
 
 
 def parse_argv(argv):
+    argv = list(argv)
+    options = {
+        'parquet_dir': pop_parquet_dir(argv),
+        'exact': pop_flag(argv, '--exact'),
+        'seed': pop_non_negative_int_option(argv, '--seed', None),
+        'max_k': pop_positive_int_option(argv, '--max-k', 10),
+        'restarts': pop_positive_int_option(argv, '--restarts', 1),
+        'warm_start': pop_flag(argv, '--warm-start'),
+        'workers': pop_positive_int_option(argv, '--workers', 1),
+        'batch_size': pop_positive_int_option(argv, '--batch-size', default_feature_batch_size),
+        'epochs': pop_positive_int_option(argv, '--epochs', 1)
+    }
+
     if not 2 <= len(argv) <= 4:
         print_usage()
         sys.exit(1)
 
     mode = argv[1]
 
-    if mode == '--k':
+    if mode == '--k' or mode == '--features':
+        if len(argv) < 3:
+            print_usage()
+            sys.exit(1)
+
         k = int(argv[2])
 
         if k < 1:
             print("Invalid k")
             sys.exit(1)
 
-        return k, None if len(argv) == 3 else argv[3]
+        return mode[2:], k, None if len(argv) == 3 else argv[3], options
     elif mode == '--sse':
-        return -1, None if len(argv) == 2 else argv[2]
+        return 'sse', None, None if len(argv) == 2 else argv[2], options
     else:
         print_usage()
         sys.exit(1)
 
 
 def print_usage():
-    print("Usages:\n1. To run k-means for single k: python3 clustering.py --k <value of k> [MongoDB connection string]")
-    print("2. To see the SSE curve for k = 1 to k = 10: python3 clustering.py --sse [MongoDB connection string]")
+    print("Usages:\n1. To run k-means for single k: python3 clustering.py --k <value of k> [MongoDB connection string]"
+          " [--parquet <directory>] [--exact]")
+    print("2. To see the SSE curve for k = 1 to max k (10 by default): python3 clustering.py --sse"
+          " [MongoDB connection string] [--parquet <directory>] [--exact] [--max-k <k>]"
+          " [--restarts <restarts per k>] [--warm-start] [--workers <number of processes>]")
+    print("3. To cluster movies on rating, year, runtime and genre features with mini-batch k-means:"
+          " python3 clustering.py --features <value of k> [MongoDB connection string] [--parquet <directory>]"
+          " [--batch-size <movies>] [--epochs <passes>]")
+    print("Every mode takes [--seed <seed>] to make the random initialization reproducible")
 
 
-def get_result(mongodb_connection_string):
-    client = MongoClient() if mongodb_connection_string is None else MongoClient(mongodb_connection_string)
-    db = client['MapReduce']
-    ratings = db['Ratings']
+def get_average_ratings(mongodb_connection_string, parquet_dir=None):
+    if parquet_dir is not None:
+        return get_average_ratings_from_parquet(parquet_dir)
 
-    query = [
-        {"$group": {"_id": {"movieId": "$movieId"}, "avgRating": {"$avg": "$rating"}}}
-    ]
+    db = get_database(mongodb_connection_string)
 
-    return list(ratings.aggregate(query))
+    return np.fromiter((rating_document['avgRating'] for rating_document in
+                        rating_stats.get_average_ratings(db, 'movieId')), dtype=np.float64)
 
 
-def k_means(ratings, k):
-    ratings = create_normalized_field(ratings)
-    centroids = create_centroids(k)
-    return run_k_means(ratings, centroids, k)
+def get_average_ratings_from_parquet(parquet_dir):
+    ratings_df = read_parquet_columns(parquet_dir, 'Ratings', ['movieId', 'rating'])
+    return ratings_df.groupby('movieId')['rating'].mean().to_numpy(dtype=np.float64)
 
 
-def create_normalized_field(ratings):
-    minimum = min([rating_document['avgRating'] for rating_document in ratings])
-    maximum = max([rating_document['avgRating'] for rating_document in ratings])
+def normalize(ratings):
+    minimum, maximum = ratings.min(), ratings.max()
 
-    for rating_document in ratings:
-        normalized_avg_rating = ((rating_document['avgRating'] - minimum) / (maximum - minimum))
-        rating_document['normalizedAvgRating'] = normalized_avg_rating
+    if maximum == minimum:
+        return np.zeros_like(ratings)
 
-    return ratings
+    return (ratings - minimum) / (maximum - minimum)
 
 
-def create_centroids(k):
-    return [random() for _ in range(k)]
+def k_means(ratings, k, exact=False, seed=None):
+    if exact:
+        return kmeans_engine.optimal_k_means(ratings, k)
 
+    return kmeans_engine.k_means(ratings, k, seed=seed)
 
-def find_centroid(rating_document, centroids):
-    normalized_rating = rating_document['normalizedAvgRating']
-    min_distance = sqrt(pow(normalized_rating - centroids[0], 2))
-    closest_centroid = centroids[0]
 
-    for centroid in centroids:
-        distance = sqrt(pow(normalized_rating - centroid, 2))
-        if distance < min_distance:
-            min_distance = distance
-            closest_centroid = centroid
+def print_capped_k(k, centroids):
+    # k-means forms at most one cluster per distinct point, and mini-batch k-means at most one per movie of its
+    # first batch
+    if len(centroids) < k:
+        print("Only {} clusters could be formed, not enough distinct points for k = {}".format(len(centroids), k))
 
-    return closest_centroid
 
+def plot_clusters(ratings, labels, centroids):
+    from matplotlib import colors as mcolors
 
-def find_average_centroid(cluster):
-    total, count = 0, 0
+    k = len(centroids)
 
-    for point in cluster:
-        total += point['normalizedAvgRating']
-        count += 1
+    plt = plots.get_pyplot()
+    color_list = np.array([mcolors.TABLEAU_COLORS[color] for color in mcolors.TABLEAU_COLORS])
 
-    return total / count
+    plt.scatter(ratings, ratings, color=color_list[labels % len(color_list)])
+    plt.ylabel('Average Ratings')
+    plt.xlabel('Average Ratings')
+    plt.title('k = {} clusters based on average ratings'.format(k))
+    plots.show('clusters', {'k': k, 'centroids': centroids, 'counts': np.bincount(labels, minlength=len(centroids))})
 
 
-def run_k_means(ratings, centroids, k):
-    clusters = {}
-    new_centroids = []
-    run_again = False
+def get_feature_matrix(features_df, genres):
+    # One row per movie: the numeric features (the rating count on a log scale) followed by one column per genre
+    numeric_values = np.column_stack([features_df[feature].to_numpy(dtype=np.float64, na_value=np.nan)
+                                      for feature in numeric_features])
+    numeric_values[:, 1] = np.log1p(numeric_values[:, 1])
 
-    for rating_document in ratings:
-        centroid = find_centroid(rating_document, centroids)
-        if centroid not in clusters:
-            clusters[centroid] = [rating_document]
-        else:
-            clusters[centroid].append(rating_document)
+    genre_columns = dict((genre, column) for column, genre in enumerate(genres))
+    movie_genres = features_df['genres'].reset_index(drop=True).explode().map(genre_columns).dropna()
+    genre_values = np.zeros((len(features_df), len(genres)))
+    genre_values[movie_genres.index.to_numpy(), movie_genres.to_numpy(dtype=np.int64)] = 1
 
-    for centroid in clusters:
-        if len(clusters[centroid]) == 0:
-            new_centroids.append(random())
-        else:
-            new_centroids.append(find_average_centroid(clusters[centroid]))
+    return np.hstack([numeric_values, genre_values])
 
-    if len(centroids) != len(new_centroids) or len(centroids) != k or len(new_centroids) != k:
-        run_again = True
 
-    for centroid in centroids:
-        if centroid not in new_centroids:
-            run_again = True
-            break
+def get_feature_batches(mongodb_connection_string, parquet_dir=None, batch_size=default_feature_batch_size):
+    # Returns the list of genres and a function that starts a new pass over the feature matrices of the movies
+    if parquet_dir is not None:
+        return get_feature_batches_from_parquet(parquet_dir, batch_size)
 
-    if run_again:
-        return run_k_means(ratings, new_centroids, k)
-    else:
-        return clusters
+    import pandas as pd
 
+    db = get_database(mongodb_connection_string)
+    genres = sorted(genre for genre in db['Movie'].distinct('genres') if genre != '\\N')
+    stats_collection = rating_stats.get_stats_collection(db, 'movieId')
 
-def plot_clusters(clusters, k):
-    ratings = []
-    colors = []
-    color_list = [mcolors.TABLEAU_COLORS[color] for color in mcolors.TABLEAU_COLORS]
-    cluster_counter = 1
+    def get_batches():
+        documents = []
 
-    for centroid in clusters:
-        for point in clusters[centroid]:
-            ratings.append(point['normalizedAvgRating'])
-            colors.append(color_list[(cluster_counter - 1) % 10])
+        for document in stats_collection.aggregate(movie_features_query, allowDiskUse=True, batchSize=batch_size):
+            documents.append(document)
 
-        cluster_counter += 1
+            if len(documents) == batch_size:
+                yield get_feature_matrix(pd.DataFrame(documents, columns=numeric_features + ['genres']), genres)
+                documents = []
 
-    plt.scatter(ratings, ratings, color=colors)
-    plt.ylabel('Average Ratings')
-    plt.xlabel('Average Ratings')
-    plt.title('k = {} clusters based on average ratings'.format(k))
-    plt.show()
+        if len(documents) > 0:
+            yield get_feature_matrix(pd.DataFrame(documents, columns=numeric_features + ['genres']), genres)
+
+    return genres, get_batches
+
+
+def get_feature_batches_from_parquet(parquet_dir, batch_size):
+    import pandas as pd
+
+    # The ratings of a movie are spread over every part of the cache, so their count, sum and sum of squares are
+    # accumulated one part at a time first: these few numbers per movie are all that is kept in memory for every
+    # movie. The movies are then read one part at a time and joined with them, so the features never all are.
+    stats_df = None
 
+    for ratings_df in iter_parquet_parts(parquet_dir, 'Ratings', ['movieId', 'rating']):
+        part_stats_df = ratings_df.assign(squares=ratings_df['rating'] ** 2).groupby('movieId').agg(
+            numRatings=('rating', 'size'), sums=('rating', 'sum'), squares=('squares', 'sum'))
+        stats_df = part_stats_df if stats_df is None else stats_df.add(part_stats_df, fill_value=0)
 
-def plot_sse_curve(ratings, max_k):
-    sse_list = get_sse_list(ratings, max_k)
-    k_list = [i for i in range(1, max_k + 1)]
+    stats_df['avgRating'] = stats_df['sums'] / stats_df['numRatings']
+    stats_df['ratingVariance'] = (stats_df['squares'] / stats_df['numRatings'] - stats_df['avgRating'] ** 2).clip(0)
+    stats_df = stats_df[['avgRating', 'numRatings', 'ratingVariance']]
+
+    # The genres of every movie, rated or not, as MongoDB's distinct finds them
+    genres = sorted(set().union(*(set(movies_df['genres'].explode().dropna())
+                                  for movies_df in iter_parquet_parts(parquet_dir, 'Movie', ['genres']))) - {'\\N'})
+
+    def get_batches():
+        pending_dfs = []
+        num_pending = 0
+
+        for movies_df in iter_parquet_parts(parquet_dir, 'Movie', ['id', 'startYear', 'runtimeMinutes', 'genres']):
+            features_df = movies_df.join(stats_df, on='id', how='inner')
+            pending_dfs.append(features_df)
+            num_pending += len(features_df)
+
+            while num_pending >= batch_size:
+                pending_df = pd.concat(pending_dfs)
+                yield get_feature_matrix(pending_df.iloc[:batch_size], genres)
+                pending_dfs = [pending_df.iloc[batch_size:]]
+                num_pending -= batch_size
+
+        if num_pending > 0:
+            yield get_feature_matrix(pd.concat(pending_dfs), genres)
+
+    return genres, get_batches
+
+
+def print_feature_clusters(centroids, counts, genres, sse):
+    print("SSE (standardized features): {:.3f}".format(sse))
+
+    for cluster, (centroid, count) in enumerate(zip(centroids, counts), start=1):
+        values = dict(zip(numeric_features, centroid))
+        genre_shares = sorted(zip(centroid[len(numeric_features):], genres), reverse=True)[:3]
+
+        print("Cluster {}: {} movies, average rating {:.2f}, {:.0f} ratings, rating variance {:.2f}, year {:.0f},"
+              " runtime {:.0f} min, genres {}".format(cluster, count, values['avgRating'],
+                                                      np.expm1(values['numRatings']), values['ratingVariance'],
+                                                      values['startYear'], values['runtimeMinutes'],
+                                                      ', '.join('{} {:.0%}'.format(genre, share)
+                                                                for share, genre in genre_shares if share >= 0.005)))
+
+
+def plot_sse_curve(sse_list):
+    plt = plots.get_pyplot()
+    k_list = [i for i in range(1, len(sse_list) + 1)]
 
     plt.title("Plot of number of clusters (k) against its Sum of Squared Errors (SSE)")
     plt.plot(k_list, sse_list)
     plt.xticks(k_list)
     plt.xlabel('k')
     plt.ylabel('SSE')
-    plt.show()
+    plots.show('sse_curve', {'k': k_list, 'sse': sse_list})
 
 
-def get_sse_list(ratings, max_k):
-    sse_list = []
+def get_sse_list(ratings, max_k, exact=False, restarts=1, seed=None, warm_start=False, workers=1):
+    if exact:
+        return kmeans_engine.optimal_sse_curve(ratings, max_k)
 
-    for k in range(1, max_k + 1):
-        clusters = k_means(ratings, k)
-        sse_list.append(compute_sse(clusters))
+    return kmeans_engine.sse_sweep(ratings, max_k, restarts, seed, warm_start, workers)
 
-    return sse_list
 
-
-def compute_sse(clusters):
-    sse = 0
-
-    for centroid in clusters:
-        for point in clusters[centroid]:
-            sse += pow(point['normalizedAvgRating'] - centroid, 2)
-
-    return sse
+def compute_sse(ratings, labels, centroids):
+    return kmeans_engine.compute_sse(ratings, labels, centroids)
 
 
 def main():
-    k, mongodb_connection_string = parse_argv(sys.argv)
-    ratings = get_result(mongodb_connection_string)
-
-    if k == -1:
-        plot_sse_curve(ratings, 10)
+    mode, k, mongodb_connection_string, options = parse_argv(sys.argv)
+
+    if mode == 'features':
+        genres, get_batches = get_feature_batches(mongodb_connection_string, options['parquet_dir'],
+                                                  options['batch_size'])
+        centroids, counts, means, stds = minibatch_kmeans.mini_batch_k_means(get_batches, k, options['epochs'],
+                                                                             options['seed'])
+        print_capped_k(k, centroids)
+        print_feature_clusters(centroids, counts, genres,
+                               minibatch_kmeans.compute_sse(get_batches, centroids, means, stds))
+        return
+
+    ratings = normalize(get_average_ratings(mongodb_connection_string, options['parquet_dir']))
+
+    if mode == 'sse':
+        plot_sse_curve(get_sse_list(ratings, options['max_k'], options['exact'], options['restarts'], options['seed'],
+                                    options['warm_start'], options['workers']))
     else:
-        clusters = k_means(ratings, k)
-        plot_clusters(clusters, k)
+        labels, centroids = k_means(ratings, k, options['exact'], options['seed'])
+        print_capped_k(k, centroids)
+        plot_clusters(ratings, labels, centroids)
 
 
 if __name__ == '__main__':
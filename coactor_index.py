@@ -0,0 +1,270 @@
+# Index of how many movies every pair of actors appeared in together, built once from Person_Roles and queried in
+# milliseconds for the pairs above a support or the top co-stars of an actor
+#
+# The roles are the sparse actor x movie incidence matrix A (the baskets of frequent_itemset_mining.py are already
+# its CSR arrays), and A A^T is the actor x actor matrix of shared movies, with the number of movies of every actor
+# on its diagonal. It is computed with scipy.sparse and saved as .npy arrays that the queries memory-map: the CSR
+# arrays of both matrices, and the pairs sorted by support, so that the pairs above a support are one binary search
+# away. A refresh reads the roles again and recomputes the counts of the pairs that share a movie whose cast changed.
+
+import sys
+import time
+from os import makedirs
+from os.path import isfile, join
+
+import numpy as np
+
+import itemset_store
+from data_access import pop_non_negative_int_option, pop_parquet_dir, pop_positive_int_option
+from frequent_itemset_mining import get_actor_baskets
+
+index_arrays = ['actor_ids', 'movie_ids', 'incidence_indptr', 'incidence_indices', 'coactor_indptr',
+                'coactor_indices', 'coactor_data', 'actor_movies', 'pair_first', 'pair_second', 'pair_supports']
+default_top_k = 10
+default_pairs_limit = 20
+
+
+def parse_argv(argv):
+    argv = list(argv)
+    options = {
+        'parquet_dir': pop_parquet_dir(argv),
+        'min_support': pop_positive_int_option(argv, '--min-support', 1),
+        'limit': pop_non_negative_int_option(argv, '--limit', None)
+    }
+
+    if len(argv) < 3 or argv[1] not in ['--build', '--refresh', '--pairs', '--top']:
+        print_usage()
+        sys.exit(1)
+
+    mode, index_dir = argv[1][2:], argv[2]
+
+    if mode in ['build', 'refresh']:
+        if len(argv) > 4:
+            print_usage()
+            sys.exit(1)
+
+        return mode, index_dir, None if len(argv) == 3 else argv[3], options
+
+    if len(argv) != 4 or not argv[3].isdigit():
+        print_usage()
+        sys.exit(1)
+
+    return mode, index_dir, int(argv[3]), options
+
+
+def print_usage():
+    print("Usages:\n1. To build the index: python3 coactor_index.py --build <index directory>"
+          " [MongoDB connection string] [--parquet <directory>] [--min-support <shared movies kept>]")
+    print("2. To update it with the current roles: python3 coactor_index.py --refresh <index directory>"
+          " [MongoDB connection string] [--parquet <directory>]")
+    print("3. To list the pairs of actors with at least a number of shared movies: python3 coactor_index.py --pairs"
+          " <index directory> <minimum support> [--limit <pairs>]")
+    print("4. To list the co-stars of an actor: python3 coactor_index.py --top <index directory> <actor ID>"
+          " [--limit <co-stars>]")
+
+
+def get_incidence(actor_ids, movie_ids, tids, tid_offsets):
+    from scipy import sparse
+
+    return sparse.csr_matrix((np.ones(len(tids), dtype=np.int32), tids, tid_offsets),
+                             shape=(len(actor_ids), len(movie_ids)))
+
+
+def reindex(matrix, row_positions, column_positions, shape):
+    # Moves the rows and columns of matrix to the given positions of a larger matrix. The positions are those of
+    # sorted IDs within a sorted union of IDs, so when no ID was added nothing moves.
+    from scipy import sparse
+
+    if matrix.shape == shape:
+        return matrix.tocsr()
+
+    coo = matrix.tocoo()
+    return sparse.csr_matrix((coo.data, (row_positions[coo.row], column_positions[coo.col])), shape=shape)
+
+
+def remove_diagonal(matrix):
+    from scipy import sparse
+
+    return (matrix - sparse.diags(matrix.diagonal(), format='csr', dtype=matrix.dtype)).tocsr()
+
+
+def prune(coactors, min_support):
+    coactors.data[coactors.data < min_support] = 0
+    coactors.eliminate_zeros()
+    coactors.sort_indices()
+
+    return coactors
+
+
+def build_index(baskets, min_support):
+    actor_ids, movie_ids, tids, tid_offsets = baskets
+    incidence = get_incidence(actor_ids, movie_ids, tids, tid_offsets)
+    coactors = prune(remove_diagonal(incidence @ incidence.T), min_support)
+
+    return actor_ids, movie_ids, incidence, coactors
+
+
+def refresh_index(index, baskets, min_support):
+    # Only the movies whose cast changed can change a count. The change of the counts is their A A^T after minus
+    # before; it is exact for the pairs in the index, and for pairs that were not because they shared no movie. With
+    # a minimum support, a pair may also be missing because its count was pruned, so the counts of such pairs are
+    # recomputed from the rows of the incidence matrix.
+    from scipy import sparse
+
+    new_actor_ids, new_movie_ids, tids, tid_offsets = baskets
+    actor_ids = np.union1d(index['actor_ids'], new_actor_ids)
+    movie_ids = np.union1d(index['movie_ids'], new_movie_ids)
+    old_actor_positions = np.searchsorted(actor_ids, index['actor_ids'])
+    shape = (len(actor_ids), len(movie_ids))
+
+    old_incidence = reindex(get_incidence(index['actor_ids'], index['movie_ids'], index['incidence_indices'],
+                                          index['incidence_indptr']),
+                            old_actor_positions, np.searchsorted(movie_ids, index['movie_ids']), shape)
+    incidence = reindex(get_incidence(new_actor_ids, new_movie_ids, tids, tid_offsets),
+                        np.searchsorted(actor_ids, new_actor_ids), np.searchsorted(movie_ids, new_movie_ids), shape)
+    coactors = reindex(sparse.csr_matrix((index['coactor_data'], index['coactor_indices'], index['coactor_indptr']),
+                                         shape=(len(index['actor_ids']), len(index['actor_ids']))),
+                       old_actor_positions, old_actor_positions, (len(actor_ids), len(actor_ids)))
+
+    changed_movies = np.unique((incidence != old_incidence).tocoo().col)
+
+    if len(changed_movies) > 0:
+        old_cast, new_cast = old_incidence[:, changed_movies], incidence[:, changed_movies]
+        delta = remove_diagonal(new_cast @ new_cast.T - old_cast @ old_cast.T)
+        delta.eliminate_zeros()
+        updated = coactors + delta
+
+        if min_support > 1:
+            changed_pattern = abs(delta).sign()
+            unknown = (changed_pattern - changed_pattern.multiply(coactors.sign())).tocoo()
+            unknown_counts = np.asarray(incidence[unknown.row].multiply(incidence[unknown.col]).sum(axis=1)).ravel()
+            updated = updated - updated.multiply(unknown.tocsr()) + \
+                sparse.csr_matrix((unknown_counts, (unknown.row, unknown.col)), shape=updated.shape)
+
+        coactors = prune(updated.tocsr(), min_support)
+
+    return actor_ids, movie_ids, incidence, coactors, len(changed_movies)
+
+
+def save_index(index_dir, actor_ids, movie_ids, incidence, coactors, min_support):
+    from scipy import sparse
+
+    # Every pair once, sorted by ascending support
+    upper = sparse.triu(coactors, k=1).tocoo()
+    order = np.lexsort((upper.col, upper.row, upper.data))
+    arrays = {
+        'actor_ids': actor_ids,
+        'movie_ids': movie_ids,
+        'incidence_indptr': incidence.indptr,
+        'incidence_indices': incidence.indices,
+        'coactor_indptr': coactors.indptr,
+        'coactor_indices': coactors.indices,
+        'coactor_data': coactors.data,
+        'actor_movies': np.diff(incidence.indptr),
+        'pair_first': upper.row[order],
+        'pair_second': upper.col[order],
+        'pair_supports': upper.data[order]
+    }
+
+    makedirs(index_dir, exist_ok=True)
+
+    for name, values in arrays.items():
+        values = np.asarray(values)
+        np.save(join(index_dir, name + '.npy'), values.astype(itemset_store.get_int_dtype(values), copy=False))
+
+    itemset_store.save_metadata(index_dir, {'minSupport': min_support, 'numActors': len(actor_ids),
+                                            'numMovies': len(movie_ids), 'numPairs': len(order)})
+
+
+def load_index(index_dir):
+    if not isfile(join(index_dir, 'actor_ids.npy')):
+        print("No co-actor index in {}".format(index_dir))
+        sys.exit(1)
+
+    index = dict((name, np.load(join(index_dir, name + '.npy'), mmap_mode='r')) for name in index_arrays)
+    index.update(itemset_store.load_metadata(index_dir))
+
+    return index
+
+
+def get_pairs(index, min_support, limit=None):
+    # (first actor ID, second actor ID, shared movies) of the pairs with at least min_support shared movies, most
+    # shared first
+    start = int(np.searchsorted(index['pair_supports'], min_support, side='left'))
+    end = len(index['pair_supports'])
+
+    if limit is not None:
+        start = max(start, end - limit)
+
+    selected = slice(start, end)
+    return index['actor_ids'][index['pair_first'][selected]][::-1], \
+        index['actor_ids'][index['pair_second'][selected]][::-1], np.array(index['pair_supports'][selected][::-1])
+
+
+def get_top_coactors(index, actor_id, k=default_top_k):
+    # (co-star IDs, shared movies) of the k actors who share the most movies with actor_id
+    row = int(np.searchsorted(index['actor_ids'], actor_id))
+
+    if row == len(index['actor_ids']) or index['actor_ids'][row] != actor_id:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    start, end = int(index['coactor_indptr'][row]), int(index['coactor_indptr'][row + 1])
+    supports = np.asarray(index['coactor_data'][start:end])
+    top = np.argsort(-supports, kind='stable')[:k]
+
+    return np.asarray(index['actor_ids'])[index['coactor_indices'][start:end][top]], supports[top]
+
+
+def main():
+    mode, index_dir, argument, options = parse_argv(sys.argv)
+
+    if mode in ['build', 'refresh']:
+        baskets = get_actor_baskets(argument, 1, options['parquet_dir'])
+        start_time = time.perf_counter()
+
+        # Refreshing an index that does not exist yet builds it
+        if mode == 'build' or not isfile(join(index_dir, 'actor_ids.npy')):
+            actor_ids, movie_ids, incidence, coactors = build_index(baskets, options['min_support'])
+            min_support = options['min_support']
+            print("Built the index of {} actors and {} movies".format(len(actor_ids), len(movie_ids)))
+        else:
+            index = load_index(index_dir)
+            min_support = index['minSupport']
+            actor_ids, movie_ids, incidence, coactors, num_changed = refresh_index(index, baskets, min_support)
+            print("Refreshed the index: {} movies with a changed cast".format(num_changed))
+
+        save_index(index_dir, actor_ids, movie_ids, incidence, coactors, min_support)
+        print("{} pairs with at least {} shared movies, in {:.3f} s".format(coactors.nnz // 2, min_support,
+                                                                           time.perf_counter() - start_time))
+        return
+
+    index = load_index(index_dir)
+    start_time = time.perf_counter()
+
+    if mode == 'pairs':
+        if argument < index['minSupport']:
+            print("The index only keeps the pairs with at least {} shared movies".format(index['minSupport']))
+
+        limit = default_pairs_limit if options['limit'] is None else options['limit']
+        first, second, supports = get_pairs(index, argument, limit)
+        elapsed = time.perf_counter() - start_time
+
+        for first_id, second_id, support in zip(first, second, supports):
+            print("{} {}: {} movies".format(first_id, second_id, support))
+
+        total = len(index['pair_supports']) - int(np.searchsorted(index['pair_supports'], argument, side='left'))
+        print("{} pairs with at least {} shared movies, {} listed, in {:.2f} ms".format(total, argument, len(first),
+                                                                                       elapsed * 1000))
+    else:
+        limit = default_top_k if options['limit'] is None else options['limit']
+        coactor_ids, supports = get_top_coactors(index, argument, limit)
+        elapsed = time.perf_counter() - start_time
+
+        for coactor_id, support in zip(coactor_ids, supports):
+            print("{}: {} movies".format(coactor_id, support))
+
+        print("{} co-stars of actor {} listed in {:.2f} ms".format(len(coactor_ids), argument, elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
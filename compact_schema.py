@@ -0,0 +1,209 @@
+# Compact layout of the collections: integer codes instead of repeated strings, and one-letter field names
+#
+# With merge_datasets.py --compact the documents of Person, Movie, Person_Roles and Ratings are stored in the
+# collections of compact_collections instead. The genres of a movie become a bitmask with one bit per genre, the
+# category of a role a small integer, a rating the integer number of half stars, and the IDs of people and movies
+# their _id. The names behind the codes are kept in the Genres and Categories collections; codes are assigned in the
+# order the names are first met, so that the batches of a streaming ingest all agree on them, and a compact load
+# replaces the previous compact load.
+#
+# Person, Movie, Person_Roles and Ratings become read-only views that decode the documents back into the original
+# fields, with the names of the codes written into the view pipeline, so every script reads them unchanged. The
+# decoding runs for every document a query reads and a view cannot use an index on a decoded field, so the queries
+# that read the most have compact versions below that go straight to the compact collections, with their indexes:
+# frequent_itemset_mining.py, movies_per_genre.py, movies_per_year.py and movie_overview.py run them whenever the
+# database holds a compact load.
+
+import sys
+
+import numpy as np
+
+compact_fields = {
+    'Person': {'id': '_id', 'primaryName': 'n', 'birthYear': 'b', 'deathYear': 'd'},
+    'Movie': {'id': '_id', 'primaryTitle': 't', 'startYear': 'y', 'runtimeMinutes': 'r', 'genres': 'g'},
+    'Person_Roles': {'movieId': 'm', 'personId': 'p', 'category': 'c'},
+    'Ratings': {'userId': 'u', 'movieId': 'm', 'rating': 'r', 'timestamp': 't'}
+}
+compact_collections = dict((collection_name, collection_name + '_Compact') for collection_name in compact_fields)
+dictionary_collections = {'genres': 'Genres', 'categories': 'Categories'}
+
+# A bitmask is a signed 64-bit integer in BSON, but the views decode a bit by dividing the mask in doubles, which
+# only hold the integers below 2^53 exactly
+max_genres = 52
+# Ratings are in half stars
+rating_scale = 2
+
+compact_indexes = {
+    compact_collections['Person_Roles']: [
+        [('c', 1), ('p', 1), ('m', 1)]
+    ],
+    compact_collections['Ratings']: [
+        [('t', 1), ('m', 1), ('u', 1), ('r', 1)]
+    ],
+    compact_collections['Movie']: [
+        [('y', 1)]
+    ]
+}
+
+
+def is_compact(database):
+    return compact_collections['Movie'] in database.list_collection_names()
+
+
+def new_encoder(database):
+    # Drops the previous compact load, views included, and returns the empty names of the codes. A load in the
+    # original layout is never dropped: its collections stand where the views would go.
+    existing_names = set(database.list_collection_names())
+
+    if not is_compact(database) and any(collection_name in existing_names for collection_name in compact_fields):
+        print("The database holds a load in the original layout; drop it first, or load into another database")
+        sys.exit(1)
+
+    for collection_name in list(compact_fields) + list(compact_collections.values()) + \
+            list(dictionary_collections.values()):
+        database.drop_collection(collection_name)
+
+    return dict((key, []) for key in dictionary_collections)
+
+
+def load_encoder(database):
+    # The names of the codes of the compact load, by code
+    return dict((key, [document['name'] for document in database[collection_name].find({}, sort=[('_id', 1)])])
+                for key, collection_name in dictionary_collections.items())
+
+
+def get_codes(names, values):
+    # The code of every value; values never met before are appended to names. pandas is only imported here, so that
+    # create_indexes.py and the scripts reading a compact load do not load it.
+    import pandas as pd
+
+    known_names = set(names)
+    names.extend(value for value in pd.unique(values) if value not in known_names)
+
+    return values.map(dict((name, code) for code, name in enumerate(names)))
+
+
+def get_genre_masks(encoder, genres):
+    exploded_genres = genres.explode()
+    bits = np.left_shift(np.int64(1), get_codes(encoder['genres'], exploded_genres).to_numpy(dtype=np.int64))
+
+    if len(encoder['genres']) > max_genres:
+        print("The compact schema holds at most {} genres".format(max_genres))
+        sys.exit(1)
+
+    # The genres of every movie are consecutive rows of the exploded series
+    row_numbers = np.repeat(np.arange(len(genres)), genres.str.len().to_numpy())
+    masks = np.zeros(len(genres), dtype=np.int64)
+    np.bitwise_or.at(masks, row_numbers, bits)
+
+    return masks
+
+
+def encode_df(encoder, collection_name, df):
+    # A clean df of merge_datasets.py with the codes and the field names of the compact collection
+    if collection_name == 'Movie':
+        df = df.assign(genres=get_genre_masks(encoder, df['genres']))
+    elif collection_name == 'Person_Roles':
+        df = df.assign(category=get_codes(encoder['categories'], df['category']).astype('int8'))
+    elif collection_name == 'Ratings':
+        df = df.assign(rating=(df['rating'] * rating_scale).round().astype('int8'))
+
+    return df.rename(columns=compact_fields[collection_name])
+
+
+def get_genres_expression(genre_names):
+    # The names of the bits set in the mask, sorted like the genres of the IMDb dataset
+    genres = sorted([{'name': name, 'bit': 1 << code} for code, name in enumerate(genre_names)],
+                    key=lambda genre: genre['name'])
+
+    return {
+        '$map': {
+            'input': {
+                '$filter': {
+                    'input': {'$literal': genres},
+                    'as': 'genre',
+                    'cond': {'$eq': [{'$mod': [{'$floor': {'$divide': ['$g', '$$genre.bit']}}, 2]}, 1]}
+                }
+            },
+            'as': 'genre',
+            'in': '$$genre.name'
+        }
+    }
+
+
+def get_decode_pipeline(encoder, collection_name):
+    fields = compact_fields[collection_name]
+    decoded_fields = {
+        'genres': get_genres_expression(encoder['genres']),
+        'category': {'$arrayElemAt': [{'$literal': encoder['categories']}, '$' + fields.get('category', '')]},
+        'rating': {'$divide': ['$' + fields.get('rating', ''), rating_scale]}
+    }
+    projection = {'_id': 1}
+
+    for field, compact_field in fields.items():
+        projection[field] = decoded_fields[field] if field in decoded_fields else '$' + compact_field
+
+    return [{'$project': projection}]
+
+
+def save_encoder(database, encoder):
+    for key, collection_name in dictionary_collections.items():
+        if len(encoder[key]) > 0:
+            database[collection_name].insert_many([{'_id': code, 'name': name}
+                                                   for code, name in enumerate(encoder[key])])
+
+
+def create_views(database, encoder):
+    # The views embed the names of the codes, so they are created once every document has been encoded
+    save_encoder(database, encoder)
+
+    for collection_name in compact_fields:
+        database.create_collection(collection_name, viewOn=compact_collections[collection_name],
+                                   pipeline=get_decode_pipeline(encoder, collection_name))
+
+
+def get_actor_codes(encoder):
+    return [code for code, name in enumerate(encoder['categories']) if name in ['self', 'actor', 'actress']]
+
+
+def get_movies_by_actors_query(encoder, min_support):
+    # frequent_itemset_mining.get_movies_by_actors_query on the codes; returns the same documents
+    return [
+        {'$match': {'c': {'$in': get_actor_codes(encoder)}}},
+        {'$group': {'_id': '$p', 'movies': {'$addToSet': '$m'}}},
+        {'$match': {'$expr': {'$gte': [{'$size': '$movies'}, min_support]}}}
+    ]
+
+
+def get_actor_movies_query(encoder):
+    # frequent_itemset_mining.actor_movies_query on the codes
+    return [
+        {'$match': {'c': {'$in': get_actor_codes(encoder)}}},
+        {'$group': {'_id': '$m'}},
+        {'$count': 'numMovies'}
+    ]
+
+
+# movies_per_genre.py on the masks: the movies are counted per combination of genres on the server, and the handful
+# of combinations is split into genres here
+movies_per_mask_query = [
+    {'$group': {'_id': '$g', 'count': {'$sum': 1}}}
+]
+
+
+# movies_per_year.py on the year field, which the index of the compact collection serves
+movies_per_year_query = [
+    {'$sort': {'y': 1}},
+    {'$group': {'_id': '$y', 'count': {'$sum': 1}}}
+]
+
+
+def count_movies_per_genre(encoder, mask_counts):
+    genre_counts = {}
+
+    for document in mask_counts:
+        for code, name in enumerate(encoder['genres']):
+            if document['_id'] >> code & 1:
+                genre_counts[name] = genre_counts.get(name, 0) + document['count']
+
+    return [{'_id': genre, 'count': count} for genre, count in genre_counts.items()]
@@ -0,0 +1,125 @@
+# Creates the indexes used by the analysis queries and optionally prints the explain() plan of every query
+
+import sys
+
+import compact_schema
+from clustering import movie_features_query
+from data_access import get_database
+from frequent_itemset_mining import actor_movies_query, movies_by_actors_query
+from movie_overview import default_runtime_bin_width, get_movie_overview_query
+from movies_per_genre import movies_per_genre_query
+from movies_per_year import movies_per_year_query
+from rating_stats import get_rating_stats_query, stats_collections
+
+# The Person_Roles and Ratings indexes hold every field their pipelines read, so the queries are covered by
+# the index; the Ratings one also finds the newest rating and the ratings past the watermark of rating_stats.py.
+# Genres are not indexed because a multikey index can neither cover nor speed up an $unwind. Movie.id serves
+# the $lookup of the movie features.
+analysis_indexes = {
+    'Person_Roles': [
+        [('category', 1), ('personId', 1), ('movieId', 1)]
+    ],
+    'Ratings': [
+        [('timestamp', 1), ('movieId', 1), ('userId', 1), ('rating', 1)]
+    ],
+    'Movie': [
+        [('startYear', 1)],
+        [('id', 1)]
+    ]
+}
+
+# The $merge stage of the rating aggregates is left out: explaining it is only allowed on recent servers
+analysis_queries = [
+    ('frequent_itemset_mining.py', 'Person_Roles', movies_by_actors_query),
+    ('frequent_itemset_mining.py (movies of the rules)', 'Person_Roles', actor_movies_query),
+    ('rating_stats.py (per movie)', 'Ratings',
+     get_rating_stats_query('movieId', stats_collections['movieId'], 0, 0)[:-1]),
+    ('rating_stats.py (per user)', 'Ratings', get_rating_stats_query('userId', stats_collections['userId'], 0, 0)[:-1]),
+    ('clustering.py --features', stats_collections['movieId'], movie_features_query),
+    ('movies_per_year.py', 'Movie', movies_per_year_query),
+    ('movies_per_genre.py', 'Movie', movies_per_genre_query),
+    ('movie_overview.py', 'Movie', get_movie_overview_query(default_runtime_bin_width))
+]
+
+
+def parse_argv(argv):
+    argv = list(argv)
+    explain = '--explain' in argv
+
+    if explain:
+        argv.remove('--explain')
+
+    if len(argv) > 2:
+        print("Usage: python3 create_indexes.py [MongoDB connection string] [--explain]")
+        sys.exit(1)
+
+    return None if len(argv) == 1 else argv[1], explain
+
+
+def create_indexes(database):
+    # Views cannot be indexed, so after a compact load the compact collections are, on their short field names
+    indexes_by_collection = compact_schema.compact_indexes if compact_schema.is_compact(database) else analysis_indexes
+
+    for collection_name, indexes in indexes_by_collection.items():
+        # An index on the same fields, such as the unique key of merge_datasets.py --incremental, serves the queries
+        # as well, and a second one on the same fields would be refused
+        existing_keys = [list(index['key']) for index in database[collection_name].index_information().values()]
+
+        for index in indexes:
+            if index in existing_keys:
+                print("{}: an index on {} already exists".format(collection_name, ', '.join(key for key, _ in index)))
+                continue
+
+            index_name = database[collection_name].create_index(index)
+            print("{}: {}".format(collection_name, index_name))
+
+
+def explain_query(database, collection_name, query):
+    return database.command('explain', {'aggregate': collection_name, 'pipeline': query, 'cursor': {},
+                                        'allowDiskUse': True}, verbosity='queryPlanner')
+
+
+def get_winning_plan(explain_output):
+    if 'queryPlanner' in explain_output:
+        return explain_output['queryPlanner']['winningPlan']
+
+    # Pipelines that are not pushed down entirely into the query layer report the plan in their first stage
+    first_stage = explain_output['stages'][0]
+    return first_stage['$cursor']['queryPlanner']['winningPlan']
+
+
+def get_plan_stages(plan):
+    stages = []
+
+    while plan is not None:
+        # Newer servers wrap the classic plan under queryPlan when the slot based engine runs it
+        plan = plan.get('queryPlan', plan)
+        stage = plan['stage']
+
+        if 'indexName' in plan:
+            stage += ' ' + plan['indexName']
+
+        stages.append(stage)
+        plan = plan.get('inputStage')
+
+    return stages
+
+
+def print_explain_plans(database):
+    for script, collection_name, query in analysis_queries:
+        plan = get_winning_plan(explain_query(database, collection_name, query))
+        print("{} ({}): {}".format(script, collection_name, ' <- '.join(get_plan_stages(plan))))
+
+
+def main():
+    mongodb_connection_string, explain = parse_argv(sys.argv)
+    database = get_database(mongodb_connection_string)
+
+    create_indexes(database)
+
+    if explain:
+        print_explain_plans(database)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+# Command-line options shared by the scripts, the MongoDB client they share, and reading only the columns a script
+# needs, either from MongoDB or from the Parquet cache written by merge_datasets.py
+#
+# pandas and pyarrow are imported by the functions that use them, so that scripts that never build a DataFrame do not
+# pay for importing them.
+
+import sys
+from glob import glob
+from os import makedirs, remove
+from os.path import isdir, join
+
+from pymongo import MongoClient
+
+import profiling
+
+default_batch_size = 10000
+# The columns of every collection in the Parquet cache and their types, so that every part of a collection has the
+# same schema whatever dtypes pandas inferred for its chunk
+parquet_columns = {
+    'Person': [('id', 'int32'), ('primaryName', 'string'), ('birthYear', 'int32'), ('deathYear', 'int32')],
+    'Movie': [('id', 'int32'), ('primaryTitle', 'string'), ('startYear', 'int32'), ('runtimeMinutes', 'int32'),
+              ('genres', 'strings')],
+    'Person_Roles': [('movieId', 'int32'), ('personId', 'int32'), ('category', 'string')],
+    'Ratings': [('userId', 'int64'), ('movieId', 'int32'), ('rating', 'float64'), ('timestamp', 'int64')]
+}
+# A MongoClient is a pool of connections that threads can share, so the scripts of one process read through a single
+# client per connection string instead of each opening their own. movie_analysis.py sets the defaults once, and
+# benchmark_pipelines.py swaps in a mongomock client to run the MongoDB code paths without a server.
+clients = {}
+client_settings = {'connection_string': None, 'max_pool_size': None, 'client_factory': MongoClient}
+
+
+def pop_parquet_dir(argv):
+    if '--parquet' not in argv:
+        return None
+
+    index = argv.index('--parquet')
+
+    if index + 1 >= len(argv):
+        print("The value of --parquet has to be the directory of the Parquet cache")
+        sys.exit(1)
+
+    parquet_dir = argv[index + 1]
+    del argv[index:index + 2]
+
+    return parquet_dir
+
+
+def pop_string_option(argv, option, default):
+    if option not in argv:
+        return default
+
+    index = argv.index(option)
+
+    if index + 1 >= len(argv):
+        print("The value of {} is missing".format(option))
+        sys.exit(1)
+
+    value = argv[index + 1]
+    del argv[index:index + 2]
+
+    return value
+
+
+def pop_positive_int_option(argv, option, default):
+    if option not in argv:
+        return default
+
+    index = argv.index(option)
+
+    if index + 1 >= len(argv) or not argv[index + 1].isdigit() or int(argv[index + 1]) <= 0:
+        print("The value of {} has to be a positive integer".format(option))
+        sys.exit(1)
+
+    value = int(argv[index + 1])
+    del argv[index:index + 2]
+
+    return value
+
+
+def pop_non_negative_int_option(argv, option, default):
+    if option not in argv:
+        return default
+
+    index = argv.index(option)
+
+    if index + 1 >= len(argv) or not argv[index + 1].isdigit():
+        print("The value of {} has to be a non-negative integer".format(option))
+        sys.exit(1)
+
+    value = int(argv[index + 1])
+    del argv[index:index + 2]
+
+    return value
+
+
+def pop_non_negative_float_option(argv, option, default):
+    if option not in argv:
+        return default
+
+    index = argv.index(option)
+
+    try:
+        value = float(argv[index + 1]) if index + 1 < len(argv) else None
+    except ValueError:
+        value = None
+
+    if value is None or not value >= 0:
+        print("The value of {} has to be a non-negative number".format(option))
+        sys.exit(1)
+
+    del argv[index:index + 2]
+
+    return value
+
+
+def pop_flag(argv, option):
+    if option not in argv:
+        return False
+
+    argv.remove(option)
+
+    return True
+
+
+def get_client(mongodb_connection_string=None):
+    if mongodb_connection_string is None:
+        mongodb_connection_string = client_settings['connection_string']
+
+    if mongodb_connection_string not in clients:
+        options = {} if client_settings['max_pool_size'] is None else {'maxPoolSize': client_settings['max_pool_size']}
+        clients[mongodb_connection_string] = client_settings['client_factory'](mongodb_connection_string, **options)
+
+    return clients[mongodb_connection_string]
+
+
+def get_database(mongodb_connection_string=None):
+    return get_client(mongodb_connection_string)['MapReduce']
+
+
+def run_aggregation(collection, pipeline, **options):
+    # The documents of an aggregation, recorded as a stage of the run
+    with profiling.stage('aggregate ' + collection.name, 'aggregate', collection, pipeline) as record:
+        documents = list(collection.aggregate(pipeline, **options))
+        record['rows'] = len(documents)
+
+    return documents
+
+
+def get_parquet_parts(parquet_dir, collection_name):
+    return sorted(glob(join(parquet_dir, collection_name, 'part-*.parquet')))
+
+
+def clear_parquet_collection(parquet_dir, collection_name):
+    makedirs(join(parquet_dir, collection_name), exist_ok=True)
+
+    for part in get_parquet_parts(parquet_dir, collection_name):
+        remove(part)
+
+
+def get_parquet_schema(collection_name):
+    import pyarrow as pa
+
+    types = {'int32': pa.int32(), 'int64': pa.int64(), 'float64': pa.float64(), 'string': pa.string(),
+             'strings': pa.list_(pa.string())}
+    return pa.schema([(column, types[type_name]) for column, type_name in parquet_columns[collection_name]])
+
+
+def write_parquet_part(parquet_dir, collection_name, part_number, df):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(df, schema=get_parquet_schema(collection_name), preserve_index=False)
+    pq.write_table(table, join(parquet_dir, collection_name, 'part-{:05d}.parquet'.format(part_number)))
+
+
+def read_parquet_columns(parquet_dir, collection_name, columns):
+    import pyarrow.parquet as pq
+
+    if not isdir(join(parquet_dir, collection_name)):
+        print("No Parquet cache for {} in {}".format(collection_name, parquet_dir))
+        sys.exit(1)
+
+    # Memory mapping lets Arrow hand out column buffers straight from the page cache instead of copying them.
+    # The pandas metadata is ignored so that missing integers come back as NaN, as they do from MongoDB.
+    with profiling.stage('read ' + collection_name, 'read') as record:
+        table = pq.read_table(join(parquet_dir, collection_name), columns=columns, memory_map=True)
+        df = table.to_pandas(self_destruct=True, split_blocks=True, ignore_metadata=True)
+        record['rows'] = len(df)
+
+    return df
+
+
+def iter_parquet_parts(parquet_dir, collection_name, columns):
+    # Reads the cache one part at a time, so memory is bounded by the size of a part
+    import pyarrow.parquet as pq
+
+    parts = get_parquet_parts(parquet_dir, collection_name)
+
+    if len(parts) == 0:
+        print("No Parquet cache for {} in {}".format(collection_name, parquet_dir))
+        sys.exit(1)
+
+    return profiling.iter_stages((pq.read_table(part, columns=columns, memory_map=True).to_pandas(ignore_metadata=True)
+                                  for part in parts), 'read ' + collection_name + ' part {}', 'read')
+
+
+def read_mongodb_columns(mongodb_connection_string, collection_name, columns):
+    import pandas as pd
+
+    collection = get_database(mongodb_connection_string)[collection_name]
+    projection = dict([('_id', 0)] + [(column, 1) for column in columns])
+
+    with profiling.stage('read ' + collection_name, 'read', collection) as record:
+        df = pd.DataFrame(list(collection.find({}, projection)), columns=columns)
+        record['rows'] = len(df)
+
+    return df
+
+
+def iter_mongodb_columns(mongodb_connection_string, collection_name, columns, batch_size):
+    import pandas as pd
+
+    collection = get_database(mongodb_connection_string)[collection_name]
+    projection = dict([('_id', 0)] + [(column, 1) for column in columns])
+    documents = []
+
+    for document in collection.find({}, projection, batch_size=batch_size):
+        documents.append(document)
+
+        if len(documents) == batch_size:
+            yield pd.DataFrame(documents, columns=columns)
+            documents = []
+
+    if len(documents) > 0:
+        yield pd.DataFrame(documents, columns=columns)
+
+
+def sample_mongodb_columns(mongodb_connection_string, collection_name, columns, size):
+    # $sample picks the documents on the server, so only the sample is sent
+    import pandas as pd
+
+    collection = get_database(mongodb_connection_string)[collection_name]
+    projection = dict([('_id', 0)] + [(column, 1) for column in columns])
+
+    return pd.DataFrame(list(collection.aggregate([{'$sample': {'size': size}}, {'$project': projection}])),
+                        columns=columns)
+
+
+def read_columns(collection_name, columns, parquet_dir=None, mongodb_connection_string=None):
+    if parquet_dir is not None:
+        return read_parquet_columns(parquet_dir, collection_name, columns)
+
+    return read_mongodb_columns(mongodb_connection_string, collection_name, columns)
+
+
+def iter_columns(collection_name, columns, parquet_dir=None, mongodb_connection_string=None,
+                 batch_size=default_batch_size):
+    # Yields the columns in batches: one part of the cache at a time, or batch_size documents at a time
+    if parquet_dir is not None:
+        return iter_parquet_parts(parquet_dir, collection_name, columns)
+
+    return profiling.iter_stages(iter_mongodb_columns(mongodb_connection_string, collection_name, columns, batch_size),
+                                 'read ' + collection_name + ' batch {}', 'read')
+
+
+def sample_columns(collection_name, columns, size, parquet_dir=None, mongodb_connection_string=None, seed=None):
+    # A uniform sample of at most size rows, drawn on the server or by reservoir sampling over the cache
+    if parquet_dir is None:
+        return sample_mongodb_columns(mongodb_connection_string, collection_name, columns, size)
+
+    import sketches
+
+    reservoir = sketches.new_reservoir(size, seed)
+
+    for df in iter_parquet_parts(parquet_dir, collection_name, columns):
+        sketches.update_reservoir(reservoir, df)
+
+    return sketches.get_reservoir_sample(reservoir)
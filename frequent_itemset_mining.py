@@ -1,15 +1,73 @@
 import sys
-from itertools import combinations
+from array import array
 
 import numpy as np
-from matplotlib import pyplot as plt
-from pymongo import MongoClient
+
+import analyze_frequent_itemsets
+import association_rules
+import compact_schema
+import itemset_store
+import mining_engine
+import profiling
+from data_access import get_database, pop_non_negative_float_option, pop_parquet_dir, pop_positive_int_option, \
+    pop_string_option, read_parquet_columns
+
+movies_by_actors_query = [
+    {
+        '$match': {
+            'category': {
+                '$in': ['self', 'actor', 'actress']
+            }
+        }
+    }, {
+        '$project': {
+            '_id': '$personId',
+            'movieId': '$movieId'
+        }
+    }, {
+        '$group': {
+            '_id': '$_id',
+            'movies': {
+                '$addToSet': '$movieId'
+            }
+        }
+    }
+]
+
+# The movies with at least one actor, whatever the minimum support: the transactions the lift of a rule is relative to
+actor_movies_query = [
+    {'$match': {'category': {'$in': ['self', 'actor', 'actress']}}},
+    {'$group': {'_id': '$movieId'}},
+    {'$count': 'numMovies'}
+]
+
+# Baskets are read in batches of this many actors and appended to flat arrays as they arrive
+basket_batch_size = 10000
 
 
 def parse_argv(argv):
+    argv = list(argv)
+    options = {
+        'parquet_dir': pop_parquet_dir(argv),
+        'algorithm': pop_algorithm(argv),
+        'workers': pop_positive_int_option(argv, '--workers', 1),
+        'save_dir': pop_string_option(argv, '--save', None),
+        'rules_path': pop_string_option(argv, '--rules', None),
+        'min_confidence': pop_non_negative_float_option(argv, '--min-confidence',
+                                                        association_rules.default_min_confidence),
+        'min_lift': pop_non_negative_float_option(argv, '--min-lift', association_rules.default_min_lift)
+    }
+
     if len(argv) != 3 and len(argv) != 4:
         print("Usage: python3 frequent_itemset_mining.py <value of minimum support>"
-              " <maximum allowed size of itemset (0 for no limit)> [MongoDB connection string]")
+              " <maximum allowed size of itemset (0 for no limit)> [MongoDB connection string]"
+              " [--parquet <directory>] [--algorithm <{}>] [--workers <number of processes>] [--save <directory>]"
+              " [--rules <rules file> [--min-confidence <confidence>] [--min-lift <lift>]]"
+              .format('|'.join(mining_engine.algorithms)))
+        sys.exit(1)
+
+    if options['workers'] > 1 and options['algorithm'] not in mining_engine.parallel_algorithms:
+        print("--workers is only supported by: {}".format(', '.join(sorted(mining_engine.parallel_algorithms))))
         sys.exit(1)
 
     min_support, max_itemset_size = int(argv[1]), int(argv[2])
@@ -24,155 +82,137 @@ def parse_argv(argv):
     elif max_itemset_size == 0:
         max_itemset_size = float('inf')
 
-    return min_support, max_itemset_size, None if len(argv) == 3 else argv[3]
-
-
-def get_movies_by_actors(mongodb_connection_string):
-    client = MongoClient() if mongodb_connection_string is None else MongoClient(mongodb_connection_string)
-    database = client['MapReduce']
-    person_roles_collection = database['Person_Roles']
-
-    query = [
-        {
-            '$match': {
-                '$or': [
-                    {
-                        'category': 'self'
-                    }, {
-                        'category': 'actor'
-                    }, {
-                        'category': 'actress'
-                    }
-                ]
-            }
-        }, {
-            '$limit': 15000
-        }, {
-            '$project': {
-                '_id': '$personId',
-                'movieId': '$movieId'
-            }
-        }, {
-            '$group': {
-                '_id': '$_id',
-                'movies': {
-                    '$push': '$movieId'
-                }
-            }
-        }, {
-            '$sort': {
-                '_id': 1
-            }
-        }
-    ]
-
-    return list(person_roles_collection.aggregate(query, allowDiskUse=True))
-
-
-def get_first_itemset(movies_by_actors, min_support):
-    first_itemset = []
+    return min_support, max_itemset_size, None if len(argv) == 3 else argv[3], options
 
-    for actor in movies_by_actors:
-        if len(actor['movies']) >= min_support:
-            first_itemset.append(actor)
 
-    return first_itemset
+def pop_algorithm(argv):
+    if '--algorithm' not in argv:
+        return 'apriori'
 
+    index = argv.index('--algorithm')
 
-def get_frequent_itemsets(first_itemset, min_support, max_itemset_size):
-    frequent_itemsets = [[[item['_id']] for item in first_itemset]]
-    item_list = first_itemset.copy()
-    subset_size = 2
-
-    while len(item_list) != 0 and subset_size <= max_itemset_size:
-        subsets = list(combinations(item_list, subset_size))
-        new_itemset = []
-        item_list = []
-
-        for subset in subsets:
-            movies_intersection = set(subset[0]['movies'])
+    if index + 1 >= len(argv) or argv[index + 1] not in mining_engine.algorithms:
+        print("The algorithm has to be one of: {}".format(', '.join(mining_engine.algorithms)))
+        sys.exit(1)
 
-            for index in range(1, subset_size):
-                movies_intersection = movies_intersection & set(subset[index]['movies'])
+    algorithm = argv[index + 1]
+    del argv[index:index + 2]
 
-            if len(movies_intersection) >= min_support:
-                new_itemset.append([entry['_id'] for entry in subset])
+    return algorithm
 
-                for entry in subset:
-                    if not entry_in_item_list(entry, item_list):
-                        item_list.append(entry)
 
-        if len(new_itemset) > 0:
-            frequent_itemsets.append(new_itemset)
-            subset_size += 1
+def get_movies_by_actors_query(min_support):
+    # Actors with fewer movies than the minimum support cannot be in a frequent itemset, so they are dropped on the
+    # server and never sent over the wire
+    return movies_by_actors_query + [{
+        '$match': {
+            '$expr': {
+                '$gte': [{'$size': '$movies'}, min_support]
+            }
+        }
+    }]
 
-    return frequent_itemsets
 
+def get_actor_baskets(mongodb_connection_string, min_support, parquet_dir=None):
+    if parquet_dir is not None:
+        return get_actor_baskets_from_parquet(parquet_dir, min_support)
 
-def entry_in_item_list(entry, item_list):
-    entry_in_list = False
+    database = get_database(mongodb_connection_string)
 
-    for item in item_list:
-        if item['_id'] == entry['_id']:
-            entry_in_list = True
+    # A compact load is read on its codes, with the index of the compact collection, rather than through the view
+    if compact_schema.is_compact(database):
+        person_roles_collection = database[compact_schema.compact_collections['Person_Roles']]
+        query = compact_schema.get_movies_by_actors_query(compact_schema.load_encoder(database), min_support)
+    else:
+        person_roles_collection = database['Person_Roles']
+        query = get_movies_by_actors_query(min_support)
 
-    return entry_in_list
+    role_actor_ids = array('q')
+    role_movie_ids = array('q')
 
+    with profiling.stage('aggregate Person_Roles', 'aggregate', person_roles_collection, query) as record:
+        for basket in person_roles_collection.aggregate(query, allowDiskUse=True, batchSize=basket_batch_size):
+            role_actor_ids.extend([basket['_id']] * len(basket['movies']))
+            role_movie_ids.extend(basket['movies'])
 
-def plot_graphs(frequent_itemsets):
-    num_itemsets = np.arange(len(frequent_itemsets)) + 1
-    fig, axes = plt.subplots(1, 2)
-    ax = axes.ravel()
-    ax[0] = plot_num_frequent_itemsets(frequent_itemsets, num_itemsets, ax[0])
-    ax[1] = plot_num_unique_actors(frequent_itemsets, num_itemsets, ax[1])
-    plt.show()
+        record['rows'] = len(role_actor_ids)
 
+    return profiling.run_stage('transform baskets', 'transform', mining_engine.encode_roles,
+                               np.frombuffer(role_actor_ids, dtype=np.int64),
+                               np.frombuffer(role_movie_ids, dtype=np.int64), min_support,
+                               count_rows=lambda baskets: len(baskets[0]))
 
-def plot_num_frequent_itemsets(frequent_itemsets, num_itemsets, ax):
-    num_frequent_itemsets = [len(level) for level in frequent_itemsets]
 
-    ax.bar(num_itemsets, num_frequent_itemsets)
-    ax.set_title('Number of frequent itemsets per level')
-    ax.set_xlabel('Level')
-    ax.set_ylabel('Number of frequent itemsets')
+def get_actor_baskets_from_parquet(parquet_dir, min_support):
+    person_roles_df = read_parquet_columns(parquet_dir, 'Person_Roles', ['personId', 'movieId', 'category'])
+    actor_roles_df = person_roles_df[person_roles_df['category'].isin(['self', 'actor', 'actress'])]
 
-    return ax
+    return profiling.run_stage('transform baskets', 'transform', mining_engine.encode_roles,
+                               actor_roles_df['personId'].to_numpy(), actor_roles_df['movieId'].to_numpy(), min_support,
+                               count_rows=lambda baskets: len(baskets[0]))
 
 
-def plot_num_unique_actors(frequent_itemsets, num_itemsets, ax):
-    unique_actors = []
+def count_actor_movies(mongodb_connection_string, parquet_dir=None):
+    if parquet_dir is not None:
+        person_roles_df = read_parquet_columns(parquet_dir, 'Person_Roles', ['movieId', 'category'])
+        return int(person_roles_df.loc[person_roles_df['category'].isin(['self', 'actor', 'actress']),
+                                       'movieId'].nunique())
 
-    for level in frequent_itemsets:
-        level_list = []
+    database = get_database(mongodb_connection_string)
 
-        for frequent_itemset in level:
-            level_list.extend(frequent_itemset)
+    if compact_schema.is_compact(database):
+        person_roles_collection = database[compact_schema.compact_collections['Person_Roles']]
+        query = compact_schema.get_actor_movies_query(compact_schema.load_encoder(database))
+    else:
+        person_roles_collection = database['Person_Roles']
+        query = actor_movies_query
 
-        unique_actors.append(level_list)
+    with profiling.stage('count movies of Person_Roles', 'aggregate', person_roles_collection, query) as record:
+        result = list(person_roles_collection.aggregate(query, allowDiskUse=True))
+        record['rows'] = len(result)
 
-    unique_actors = [list(set(level)) for level in unique_actors]
-    num_unique_actors = [len(level) for level in unique_actors]
+    return 0 if len(result) == 0 else result[0]['numMovies']
 
-    ax.bar(num_itemsets, num_unique_actors)
-    ax.set_title('Number of unique actors per level')
-    ax.set_xlabel('Level')
-    ax.set_ylabel('Number of unique actors')
 
-    return ax
+def get_frequent_itemsets(baskets, min_support, max_itemset_size, algorithm='apriori', workers=1):
+    return [level.tolist() for level, _ in
+            mining_engine.mine_baskets(baskets, min_support, max_itemset_size, algorithm, workers)]
 
 
 def main():
-    min_support, max_itemset_size, mongodb_connection_string = parse_argv(sys.argv)
-    movies_by_actors = get_movies_by_actors(mongodb_connection_string)
-    first_itemset = get_first_itemset(movies_by_actors, min_support)
+    min_support, max_itemset_size, mongodb_connection_string, options = parse_argv(sys.argv)
+    baskets = get_actor_baskets(mongodb_connection_string, min_support, options['parquet_dir'])
 
-    if len(first_itemset) == 0:
+    if len(baskets[0]) == 0:
         print("No frequent itemsets can be generated for the given minimum support")
         sys.exit(0)
 
-    frequent_itemsets = get_frequent_itemsets(first_itemset, min_support, max_itemset_size)
-    plot_graphs(frequent_itemsets)
-
+    # The lifts are relative to every movie with an actor, counted before the actors under min_support are dropped
+    num_movies = None if options['save_dir'] is None and options['rules_path'] is None else \
+        count_actor_movies(mongodb_connection_string, options['parquet_dir'])
+    levels = mining_engine.mine_baskets(baskets, min_support, max_itemset_size, options['algorithm'],
+                                        options['workers'])
+
+    if options['save_dir'] is not None:
+        # Every level is written as soon as it is mined, and read back memory-mapped for the rules and the plots
+        itemset_store.save_levels(options['save_dir'], levels, {
+            'minSupport': min_support,
+            'maxItemsetSize': 0 if max_itemset_size == float('inf') else max_itemset_size,
+            'algorithm': options['algorithm'],
+            'numMovies': num_movies
+        })
+        levels = itemset_store.load_levels(options['save_dir'])
+        print("Saved {} levels to {}".format(len(levels), options['save_dir']))
+    else:
+        levels = list(levels)
+
+    if options['rules_path'] is not None:
+        # The supports of the levels just mined are reused instead of being counted again
+        num_rules = association_rules.write_rules(options['rules_path'], association_rules.generate_rules(
+            levels, num_movies, options['min_confidence'], options['min_lift']))
+        print("Wrote {} rules to {}".format(num_rules, options['rules_path']))
+
+    analyze_frequent_itemsets.plot_graphs(range(1, len(levels) + 1), [itemsets for itemsets, _ in levels])
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,262 @@
+# Writes a synthetic IMDb and MovieLens dataset, in the format of the real dumps, that merge_datasets.py can load
+#
+# Only title.principals.tsv.gz and links.csv ship with the repository, so every other pipeline needs a full download
+# before it can be run or measured. The files written here have the columns and the conventions of the real ones
+# (tconst/nconst IDs, \N for missing values, comma separated genres, half-star ratings) and are sized from a single
+# number of rows, from thousands to the hundred million of the real title.principals. They are written in chunks, so
+# memory does not grow with the scale, and from a seed, so the same arguments always write the same files.
+#
+# As in the real dumps, no role is listed twice for the same movie, person and category, and no user rates the same
+# movie twice, so that a load and an incremental load of the files hold the same documents: duplicates are dropped,
+# which is why those files have somewhat fewer rows than asked for. Every chunk of them holds whole movies or users.
+#
+# Casts are drawn so that the mining has something to find: a few actors appear in many movies, and every movie takes
+# most of its cast from a troupe of actors who keep working together. Every movie has a quality that its ratings are
+# drawn around, so the average ratings of the movies spread out the way clustering.py expects.
+
+import gzip
+import sys
+from os import makedirs
+from os.path import join
+
+import numpy as np
+import pandas as pd
+
+import merge_datasets
+from data_access import pop_non_negative_int_option, pop_positive_int_option
+
+default_rows = 100000
+default_seed = 0
+default_chunk_size = 1000000
+# Part of the parameters of the datasets cached by benchmark_pipelines.py; raised whenever the same arguments write
+# different files
+generator_version = 2
+
+genre_names = ['Action', 'Adult', 'Adventure', 'Animation', 'Biography', 'Comedy', 'Crime', 'Documentary', 'Drama',
+               'Family', 'Fantasy', 'Film-Noir', 'Game-Show', 'History', 'Horror', 'Music', 'Musical', 'Mystery',
+               'News', 'Reality-TV', 'Romance', 'Sci-Fi', 'Short', 'Sport', 'Talk-Show', 'Thriller', 'War', 'Western']
+# Only the first four are kept by merge_datasets.py
+title_type_weights = {'movie': 0.6, 'short': 0.15, 'tvMovie': 0.05, 'tvShort': 0.02, 'tvEpisode': 0.13, 'video': 0.05}
+category_weights = {'actor': 0.35, 'actress': 0.25, 'self': 0.05, 'director': 0.1, 'writer': 0.1, 'producer': 0.1,
+                    'composer': 0.05}
+troupe_size = 4
+first_timestamp, last_timestamp = 789652009, 1700000000
+
+
+def parse_argv(argv):
+    argv = list(argv)
+    options = {
+        'rows': pop_positive_int_option(argv, '--rows', default_rows),
+        'seed': pop_non_negative_int_option(argv, '--seed', default_seed),
+        'chunk_size': pop_positive_int_option(argv, '--chunk-size', default_chunk_size)
+    }
+
+    if len(argv) != 3:
+        print("Usage: python3 generate_datasets.py <directory for the IMDb dataset>"
+              " <directory for the MovieLens dataset> [--rows <rows of title.principals and of ratings.csv>]"
+              " [--seed <seed>] [--chunk-size <rows>]")
+        sys.exit(1)
+
+    return argv[1], argv[2], options
+
+
+def get_sizes(rows):
+    # Roughly the proportions of the real dumps: six principals per title, every person in four of them, half the
+    # titles rated, and a hundred ratings per user
+    movies = max(1, rows // 6)
+
+    return {
+        'roles': rows,
+        'movies': movies,
+        'persons': max(troupe_size, rows // 4),
+        'links': max(1, movies // 2),
+        'ratings': rows,
+        'users': max(1, rows // 100)
+    }
+
+
+def get_hash_fractions(ids, salt):
+    # A fraction in [0, 1) fixed for every ID, so that a property of a movie does not depend on the chunk it is in
+    hashes = (np.asarray(ids, dtype=np.uint64) + np.uint64(salt)) * np.uint64(0x9E3779B97F4A7C15)
+    hashes ^= hashes >> np.uint64(29)
+    hashes *= np.uint64(0xBF58476D1CE4E5B9)
+    hashes ^= hashes >> np.uint64(32)
+
+    return (hashes >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+
+def get_chunks(num_rows, chunk_size, seed, file_number):
+    # (first row, number of rows, random generator) of every chunk; every chunk has its own stream of numbers
+    for chunk_number, start in enumerate(range(0, num_rows, chunk_size)):
+        yield start, min(chunk_size, num_rows - start), np.random.default_rng([seed, file_number, chunk_number])
+
+
+def get_first_row(group_number, num_groups, num_rows):
+    # The rows are spread evenly over the groups, row r being in group r * num_groups // num_rows
+    return -(-group_number * num_rows // num_groups)
+
+
+def get_group_chunks(num_rows, num_groups, chunk_size, seed, file_number):
+    # get_chunks, with chunks of whole groups (the movies of the roles, the users of the ratings), so that duplicates
+    # within a group can be dropped chunk by chunk
+    groups_per_chunk = max(1, chunk_size * num_groups // num_rows)
+
+    for start, size, rng in get_chunks(num_groups, groups_per_chunk, seed, file_number):
+        first_row = get_first_row(start, num_groups, num_rows)
+        yield first_row, get_first_row(start + size, num_groups, num_rows) - first_row, rng
+
+
+def to_imdb_ids(prefix, ids):
+    return prefix + pd.Series(ids).astype(str).str.zfill(7)
+
+
+def with_missing(rng, values, fraction):
+    # Nullable integers, missing for a fraction of the rows and wherever values is 0
+    values = np.asarray(values, dtype=np.int32)
+    return pd.arrays.IntegerArray(values, (rng.random(len(values)) < fraction) | (values == 0))
+
+
+def choose(rng, weights, size):
+    return np.array(list(weights))[rng.choice(len(weights), size, p=list(weights.values()))]
+
+
+def write_chunks(path, dfs, sep):
+    # The compression level matters more than anything else to the time it takes to write the real sizes
+    num_rows = 0
+
+    with gzip.open(path, 'wt', compresslevel=1, newline='') if path.endswith('.gz') else \
+            open(path, 'w', newline='') as file:
+        for chunk_number, df in enumerate(dfs):
+            df.to_csv(file, sep=sep, index=False, header=chunk_number == 0, na_rep='\\N')
+            num_rows += len(df)
+
+    return num_rows
+
+
+def generate_name_basics(sizes, seed, chunk_size):
+    for start, size, rng in get_chunks(sizes['persons'], chunk_size, seed, 0):
+        ids = np.arange(start + 1, start + size + 1)
+        birth_years = rng.integers(1880, 2010, size)
+        death_years = birth_years + rng.integers(30, 100, size)
+
+        yield pd.DataFrame({
+            'nconst': to_imdb_ids('nm', ids),
+            'primaryName': 'Person ' + pd.Series(ids).astype(str),
+            'birthYear': with_missing(rng, birth_years, 0.4),
+            'deathYear': with_missing(rng, np.where(death_years <= 2024, death_years, 0), 0.5),
+            'primaryProfession': 'actor',
+            'knownForTitles': '\\N'
+        })
+
+
+def get_genre_pool(seed):
+    # Movies draw their genres from a fixed set of combinations of one to three genres, the most common first
+    rng = np.random.default_rng([seed, 100])
+    genre_weights = 1 / np.arange(1, len(genre_names) + 1)
+    genre_weights /= genre_weights.sum()
+
+    return [','.join(sorted(rng.choice(genre_names, rng.integers(1, 4), replace=False, p=genre_weights)))
+            for _ in range(500)]
+
+
+def generate_title_basics(sizes, seed, chunk_size):
+    genre_pool = np.array(get_genre_pool(seed), dtype=object)
+
+    for start, size, rng in get_chunks(sizes['movies'], chunk_size, seed, 1):
+        ids = np.arange(start + 1, start + size + 1)
+        # More movies every year, as in the real data
+        start_years = (1900 + 125 * np.sqrt(rng.random(size))).astype(np.int64)
+        genres = genre_pool[(len(genre_pool) * rng.random(size) ** 3).astype(np.int64)]
+        genres[rng.random(size) < 0.02] = '\\N'
+
+        yield pd.DataFrame({
+            'tconst': to_imdb_ids('tt', ids),
+            'titleType': choose(rng, title_type_weights, size),
+            'primaryTitle': 'Title ' + pd.Series(ids).astype(str),
+            'originalTitle': 'Title ' + pd.Series(ids).astype(str),
+            'isAdult': 0,
+            'startYear': with_missing(rng, start_years, 0.03),
+            'endYear': pd.arrays.IntegerArray(np.zeros(size, dtype=np.int32), np.ones(size, dtype=bool)),
+            'runtimeMinutes': with_missing(rng, np.clip(rng.normal(90, 30, size), 1, 300).astype(np.int64), 0.1),
+            'genres': genres
+        })
+
+
+def generate_title_principals(sizes, seed, chunk_size):
+    roles, movies, persons = sizes['roles'], sizes['movies'], sizes['persons']
+    num_troupes = persons // troupe_size
+
+    for start, size, rng in get_group_chunks(roles, movies, chunk_size, seed, 2):
+        # Roles are sorted by movie, with the same number of principals in every movie, give or take one
+        movie_ids = 1 + np.arange(start, start + size) * movies // roles
+        troupes = (num_troupes * get_hash_fractions(movie_ids, seed) ** 2).astype(np.int64)
+        in_troupe = rng.random(size) < 0.75
+        person_ids = np.where(in_troupe, 1 + troupes * troupe_size + rng.integers(0, troupe_size, size),
+                              1 + (persons * rng.random(size) ** 2.5).astype(np.int64))
+        roles_df = pd.DataFrame({'movie_id': movie_ids, 'person_id': person_ids,
+                                 'category': choose(rng, category_weights, size)}).drop_duplicates(ignore_index=True)
+
+        yield pd.DataFrame({
+            'tconst': to_imdb_ids('tt', roles_df['movie_id']),
+            'ordering': roles_df.groupby('movie_id').cumcount().to_numpy() + 1,
+            'nconst': to_imdb_ids('nm', roles_df['person_id']),
+            'category': roles_df['category'].to_numpy(),
+            'job': '\\N',
+            'characters': '\\N'
+        })
+
+
+def get_links_df(sizes, seed):
+    rng = np.random.default_rng([seed, 3])
+    imdb_ids = np.sort(rng.choice(sizes['movies'], sizes['links'], replace=False) + 1)
+
+    return pd.DataFrame({'movieId': np.arange(1, sizes['links'] + 1), 'imdbId': to_imdb_ids('', imdb_ids),
+                         'tmdbId': imdb_ids})
+
+
+def generate_ratings(sizes, seed, chunk_size):
+    ratings, links, users = sizes['ratings'], sizes['links'], sizes['users']
+
+    for start, size, rng in get_group_chunks(ratings, users, chunk_size, seed, 4):
+        # Sorted by user as in MovieLens; a few movies get most of the ratings
+        user_ids = 1 + np.arange(start, start + size) * users // ratings
+        movie_ids = 1 + (links * rng.random(size) ** 2).astype(np.int64)
+        quality = 1 + 3.5 * get_hash_fractions(movie_ids, seed)
+        stars = np.clip(np.round(2 * (quality + rng.normal(0, 0.8, size))) / 2, 0.5, 5)
+
+        ratings_df = pd.DataFrame({'userId': user_ids, 'movieId': movie_ids, 'rating': stars,
+                                   'timestamp': rng.integers(first_timestamp, last_timestamp, size)})
+
+        yield ratings_df.drop_duplicates(['userId', 'movieId']).reset_index(drop=True)
+
+
+def generate_datasets(imdb_dir, ml_dir, rows=default_rows, seed=default_seed, chunk_size=default_chunk_size):
+    # Returns the number of rows written to every file
+    sizes = get_sizes(rows)
+    makedirs(imdb_dir, exist_ok=True)
+    makedirs(ml_dir, exist_ok=True)
+
+    return {
+        merge_datasets.name_basics: write_chunks(join(imdb_dir, merge_datasets.name_basics),
+                                                 generate_name_basics(sizes, seed, chunk_size), '\t'),
+        merge_datasets.title_basics: write_chunks(join(imdb_dir, merge_datasets.title_basics),
+                                                  generate_title_basics(sizes, seed, chunk_size), '\t'),
+        merge_datasets.title_principals: write_chunks(join(imdb_dir, merge_datasets.title_principals),
+                                                      generate_title_principals(sizes, seed, chunk_size), '\t'),
+        merge_datasets.ml_links: write_chunks(join(ml_dir, merge_datasets.ml_links), [get_links_df(sizes, seed)],
+                                              ','),
+        merge_datasets.ml_ratings: write_chunks(join(ml_dir, merge_datasets.ml_ratings),
+                                                generate_ratings(sizes, seed, chunk_size), ',')
+    }
+
+
+def main():
+    imdb_dir, ml_dir, options = parse_argv(sys.argv)
+
+    for file_name, num_rows in generate_datasets(imdb_dir, ml_dir, options['rows'], options['seed'],
+                                                 options['chunk_size']).items():
+        print("{}: {} rows".format(file_name, num_rows))
+
+
+if __name__ == '__main__':
+    main()
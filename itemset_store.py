@@ -0,0 +1,84 @@
+# Frequent itemsets saved level by level as NumPy arrays, one directory per mining run
+#
+# Level k is two .npy files: the itemsets as a (number of itemsets, k) array of actor IDs, one sorted row per
+# itemset, and their supports. A .npy file can be memory-mapped, so a reader only pages in the levels, and the parts
+# of them, that it touches: the number of itemsets of a level comes from the header of its file alone. metadata.json
+# records how the itemsets were mined.
+
+import json
+from glob import glob
+from os import makedirs, remove
+from os.path import basename, isdir, join
+
+import numpy as np
+
+int32_info = np.iinfo(np.int32)
+
+
+def get_level_path(directory, name, size):
+    return join(directory, '{}-{:04d}.npy'.format(name, size))
+
+
+def clear_levels(directory):
+    makedirs(directory, exist_ok=True)
+
+    for path in glob(join(directory, 'itemsets-*.npy')) + glob(join(directory, 'supports-*.npy')):
+        remove(path)
+
+
+def get_int_dtype(values):
+    # IMDb IDs and supports fit in 32 bits, which halves the size of the files
+    if len(values) == 0 or (values.min() >= int32_info.min and values.max() <= int32_info.max):
+        return np.int32
+
+    return np.int64
+
+
+def save_level(directory, itemsets, supports):
+    itemsets = np.asarray(itemsets)
+    supports = np.asarray(supports)
+    size = itemsets.shape[1]
+
+    np.save(get_level_path(directory, 'itemsets', size), itemsets.astype(get_int_dtype(itemsets), copy=False))
+    np.save(get_level_path(directory, 'supports', size), supports.astype(get_int_dtype(supports), copy=False))
+
+
+def save_levels(directory, levels, metadata):
+    # levels yields (itemsets, supports) one level at a time, so a level can be written as soon as it is mined
+    clear_levels(directory)
+
+    for itemsets, supports in levels:
+        save_level(directory, itemsets, supports)
+
+    save_metadata(directory, metadata)
+
+
+def get_level_sizes(directory):
+    if not isdir(directory):
+        return []
+
+    return sorted(int(basename(path)[len('itemsets-'):-len('.npy')])
+                  for path in glob(join(directory, 'itemsets-*.npy')))
+
+
+def load_level(directory, size):
+    return np.load(get_level_path(directory, 'itemsets', size), mmap_mode='r'), \
+        np.load(get_level_path(directory, 'supports', size), mmap_mode='r')
+
+
+def load_levels(directory, sizes=None):
+    # Memory-mapped (itemsets, supports) of every level, or of the given sizes only, in ascending size
+    saved_sizes = get_level_sizes(directory)
+    sizes = saved_sizes if sizes is None else [size for size in sorted(sizes) if size in saved_sizes]
+
+    return [load_level(directory, size) for size in sizes]
+
+
+def save_metadata(directory, metadata):
+    with open(join(directory, 'metadata.json'), 'w') as file:
+        json.dump(metadata, file)
+
+
+def load_metadata(directory):
+    with open(join(directory, 'metadata.json')) as file:
+        return json.load(file)
@@ -0,0 +1,280 @@
+# k-means over one-dimensional points (the normalized average rating of every movie), iterative and exact
+#
+# The points are sorted once. In one dimension every cluster is a contiguous run of the sorted points, bounded by the
+# midpoints between consecutive sorted centroids, so an iteration only binary searches k - 1 midpoints and reads the
+# sums of the clusters from prefix sums: its cost depends on k, not on the number of points. For the same reason the
+# optimal clustering can be found exactly by a dynamic program over the sorted points.
+
+import multiprocessing
+
+import numpy as np
+
+import profiling
+
+default_tolerance = 1e-9
+default_max_iterations = 300
+# The sweep being run by a pool of forked workers
+shared_sweep = {}
+
+
+def seed_centroids(sorted_points, k, rng, centroids=None):
+    # k-means++: the first centroid is a random point and every next one is a point picked with a probability
+    # proportional to its squared distance to the closest centroid picked so far. Given the centroids of a smaller
+    # k (a warm start), only the missing centroids are picked.
+    if centroids is None or len(centroids) == 0:
+        centroids = [sorted_points[rng.integers(len(sorted_points))]]
+    else:
+        centroids = list(centroids)
+
+    sorted_centroids = np.sort(np.array(centroids, dtype=np.float64))
+    squared_distances = (sorted_points - sorted_centroids[assign_labels(sorted_points, sorted_centroids)]) ** 2
+
+    for _ in range(len(centroids), k):
+        total = squared_distances.sum()
+
+        if total == 0:
+            break
+
+        index = min(int(np.searchsorted(np.cumsum(squared_distances), rng.random() * total, side='right')),
+                    len(sorted_points) - 1)
+        centroids.append(sorted_points[index])
+        squared_distances = np.minimum(squared_distances, (sorted_points - sorted_points[index]) ** 2)
+
+    return np.sort(np.array(centroids, dtype=np.float64))
+
+
+def get_boundaries(sorted_points, centroids):
+    # The clusters of centroids sorted in ascending order are the runs of sorted points split at their midpoints
+    midpoints = (centroids[1:] + centroids[:-1]) / 2
+    return np.concatenate([[0], np.searchsorted(sorted_points, midpoints, side='right'), [len(sorted_points)]])
+
+
+def relocate_empty_centroids(sorted_points, centroids, boundaries):
+    # An empty cluster takes the point that is the farthest from its centroid, which is always the first or the last
+    # point of a cluster
+    counts = np.diff(boundaries)
+    is_empty = counts == 0
+    non_empty = np.flatnonzero(~is_empty)
+    ends, end_clusters = np.unique(np.concatenate([boundaries[non_empty], boundaries[non_empty + 1] - 1]),
+                                   return_index=True)
+    end_centroids = np.concatenate([centroids[non_empty], centroids[non_empty]])[end_clusters]
+    distances = np.abs(sorted_points[ends] - end_centroids)
+    farthest = ends[np.argsort(-distances, kind='stable')[:is_empty.sum()]]
+
+    centroids = centroids.copy()
+    centroids[np.flatnonzero(is_empty)[:len(farthest)]] = sorted_points[farthest]
+
+    return np.sort(centroids)
+
+
+def run_iterations(sorted_points, prefix_sums, centroids, tolerance, max_iterations):
+    # An iteration takes microseconds, so the iterations of a run are profiled as one stage with their number
+    with profiling.stage('k-means k={}'.format(len(centroids)), 'k-means') as record:
+        record['rows'] = len(sorted_points)
+
+        for iteration in range(max_iterations):
+            boundaries = get_boundaries(sorted_points, centroids)
+
+            if np.any(boundaries[1:] == boundaries[:-1]):
+                centroids = relocate_empty_centroids(sorted_points, centroids, boundaries)
+                boundaries = get_boundaries(sorted_points, centroids)
+
+            counts = np.diff(boundaries)
+            new_centroids = (prefix_sums[boundaries[1:]] - prefix_sums[boundaries[:-1]]) / np.maximum(counts, 1)
+            new_centroids = np.where(counts > 0, new_centroids, centroids)
+            shift = np.abs(new_centroids - centroids).max()
+            centroids = new_centroids
+            record['iterations'] = iteration + 1
+
+            if shift <= tolerance:
+                break
+
+    return centroids
+
+
+def get_max_k(sorted_points, k):
+    # There cannot be more clusters than distinct points
+    return min(k, int(np.count_nonzero(np.diff(sorted_points))) + 1)
+
+
+def k_means(points, k, tolerance=default_tolerance, max_iterations=default_max_iterations, seed=None):
+    # Returns the label of every point and the centroids in ascending order, so that label i is centroids[i]
+    points = np.ascontiguousarray(points, dtype=np.float64)
+
+    if len(points) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    sorted_points = np.sort(points)
+    prefix_sums = np.concatenate([[0], np.cumsum(sorted_points)])
+    centroids = seed_centroids(sorted_points, get_max_k(sorted_points, k), np.random.default_rng(seed))
+    centroids = run_iterations(sorted_points, prefix_sums, centroids, tolerance, max_iterations)
+
+    return assign_labels(points, centroids), centroids
+
+
+def assign_labels(points, centroids):
+    return np.searchsorted((centroids[1:] + centroids[:-1]) / 2, points, side='left')
+
+
+def compute_sse(points, labels, centroids):
+    return float(((points - centroids[labels]) ** 2).sum())
+
+
+def run_restart(sorted_points, max_k, seed_sequence, warm_start, tolerance, max_iterations):
+    # One restart of the sweep: the SSE of k = 1 to max_k, each k either seeded from scratch or from the centroids
+    # found for k - 1
+    rng = np.random.default_rng(seed_sequence)
+    prefix_sums = np.concatenate([[0], np.cumsum(sorted_points)])
+    centroids = None
+    sse_list = []
+
+    for k in range(1, max_k + 1):
+        initial_centroids = seed_centroids(sorted_points, get_max_k(sorted_points, k), rng,
+                                           centroids if warm_start else None)
+        centroids = run_iterations(sorted_points, prefix_sums, initial_centroids, tolerance, max_iterations)
+        sse_list.append(compute_sse(sorted_points, assign_labels(sorted_points, centroids), centroids))
+
+    return sse_list
+
+
+def run_shared_restart(seed_sequence):
+    return run_restart(shared_sweep['sorted_points'], shared_sweep['max_k'], seed_sequence,
+                       shared_sweep['warm_start'], shared_sweep['tolerance'], shared_sweep['max_iterations'])
+
+
+def sse_sweep(points, max_k, restarts=1, seed=None, warm_start=False, workers=1, tolerance=default_tolerance,
+              max_iterations=default_max_iterations):
+    # The lowest SSE of every k over several restarts. Every restart draws from its own stream spawned from the
+    # seed, so the result depends on the seed alone and not on the number of workers.
+    sorted_points = np.sort(np.asarray(points, dtype=np.float64))
+
+    if len(sorted_points) == 0:
+        return [0.0] * max_k
+
+    seed_sequences = np.random.SeedSequence(seed).spawn(restarts)
+
+    if workers <= 1 or restarts <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        sse_lists = [run_restart(sorted_points, max_k, seed_sequence, warm_start, tolerance, max_iterations)
+                     for seed_sequence in seed_sequences]
+    else:
+        # Forked workers inherit the sorted points instead of receiving them pickled with every restart
+        shared_sweep.update({'sorted_points': sorted_points, 'max_k': max_k, 'warm_start': warm_start,
+                             'tolerance': tolerance, 'max_iterations': max_iterations})
+
+        try:
+            with multiprocessing.get_context('fork').Pool(min(workers, restarts)) as pool:
+                sse_lists = pool.map(run_shared_restart, seed_sequences)
+        finally:
+            shared_sweep.clear()
+
+    return np.min(np.array(sse_lists), axis=0).tolist()
+
+
+def get_cluster_costs(prefix_counts, prefix_sums, prefix_squares, starts, ends):
+    # Sum of squared errors of the clusters made of the distinct values starts to ends (both included)
+    counts = prefix_counts[ends + 1] - prefix_counts[starts]
+    sums = prefix_sums[ends + 1] - prefix_sums[starts]
+    squares = prefix_squares[ends + 1] - prefix_squares[starts]
+
+    return np.maximum(squares - sums * sums / counts, 0)
+
+
+def get_segment_minimums(values, segment_ids, segment_starts, candidates):
+    # Minimum of every contiguous segment of values, along with the first candidate that reaches it
+    minimums = np.minimum.reduceat(values, segment_starts)
+    is_minimum = values == minimums[segment_ids]
+    _, first = np.unique(segment_ids[is_minimum], return_index=True)
+
+    return minimums, candidates[np.flatnonzero(is_minimum)[first]]
+
+
+def add_cluster(previous_costs, k, prefixes):
+    # costs[i] is the lowest SSE of k clusters over the first i + 1 distinct values and starts[i] is where the last of
+    # those clusters starts. The best start never decreases as i grows, so the costs are filled by divide and
+    # conquer; all the subproblems of one depth are evaluated together, which is O(n) work per depth.
+    num_values = len(previous_costs)
+    costs = np.full(num_values, np.inf)
+    starts = np.zeros(num_values, dtype=np.int64)
+    low, high = np.array([k - 1]), np.array([num_values - 1])
+    start_low, start_high = np.array([k - 1]), np.array([num_values - 1])
+
+    while len(low) > 0:
+        middle = (low + high) // 2
+        first_start = start_low
+        last_start = np.minimum(start_high, middle)
+        num_candidates = last_start - first_start + 1
+        segment_starts = np.cumsum(num_candidates) - num_candidates
+        segment_ids = np.repeat(np.arange(len(middle)), num_candidates)
+        candidates = np.repeat(first_start - segment_starts, num_candidates) + np.arange(num_candidates.sum())
+
+        values = previous_costs[candidates - 1] + get_cluster_costs(*prefixes, candidates, middle[segment_ids])
+        costs[middle], starts[middle] = get_segment_minimums(values, segment_ids, segment_starts, candidates)
+
+        has_left = middle > low
+        has_right = middle < high
+        low, high, start_low, start_high = \
+            np.concatenate([low[has_left], middle[has_right] + 1]), \
+            np.concatenate([middle[has_left] - 1, high[has_right]]), \
+            np.concatenate([start_low[has_left], starts[middle][has_right]]), \
+            np.concatenate([starts[middle][has_left], start_high[has_right]])
+
+    return costs, starts
+
+
+def optimal_clusterings(points, max_k):
+    # Exact dynamic program in the spirit of Ckmeans.1d.dp over the distinct values of the points, weighted by how
+    # often they occur. Yields, for k = 1 to max_k, the optimal SSE and the index of the first distinct value of
+    # every cluster, along with the distinct values.
+    values, counts = np.unique(np.asarray(points, dtype=np.float64), return_counts=True)
+
+    if len(values) == 0:
+        return
+
+    # Centering keeps the prefix sums of squares small, so their differences lose less precision
+    centered_values = values - np.average(values, weights=counts)
+    prefixes = (np.concatenate([[0], np.cumsum(counts)]), np.concatenate([[0], np.cumsum(counts * centered_values)]),
+                np.concatenate([[0], np.cumsum(counts * centered_values ** 2)]))
+    costs = get_cluster_costs(*prefixes, np.zeros(len(values), dtype=np.int64), np.arange(len(values)))
+    starts_by_k = []
+
+    for k in range(1, max_k + 1):
+        if k > 1:
+            if k > len(values):
+                yield 0.0, np.arange(len(values)), values
+                continue
+
+            costs, starts = add_cluster(costs, k, prefixes)
+            starts_by_k.append(starts)
+
+        cluster_starts = [0] * k
+        end = len(values) - 1
+
+        for cluster in range(k - 1, 0, -1):
+            cluster_starts[cluster] = int(starts_by_k[cluster - 1][end])
+            end = cluster_starts[cluster] - 1
+
+        yield float(costs[-1]), np.array(cluster_starts), values
+
+
+def optimal_k_means(points, k):
+    # Returns the labels and the ascending centroids of the clustering with the lowest possible SSE
+    points = np.ascontiguousarray(points, dtype=np.float64)
+
+    if len(points) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    *_, (_, cluster_starts, values) = optimal_clusterings(points, k)
+    value_labels = np.repeat(np.arange(len(cluster_starts)), np.diff(np.append(cluster_starts, len(values))))
+    labels = value_labels[np.searchsorted(values, points)]
+    centroids = np.bincount(labels, weights=points) / np.bincount(labels)
+
+    return labels, centroids
+
+
+def optimal_sse_curve(points, max_k):
+    # The whole SSE curve comes out of a single run of the dynamic program. No points cost nothing for any k, as in
+    # sse_sweep.
+    if len(points) == 0:
+        return [0.0] * max_k
+
+    return [sse for sse, _, _ in optimal_clusterings(points, max_k)]
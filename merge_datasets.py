@@ -1,9 +1,16 @@
 import sys
-from os.path import isdir
+from itertools import count
+from os import stat
+from os.path import isdir, join
 
-import numpy as np
 import pandas as pd
-from pymongo import MongoClient
+from pymongo.errors import OperationFailure
+
+import compact_schema
+import profiling
+from bulk_writer import duplicate_key_error_code, load_collections, print_metrics, split_into_batches
+from data_access import client_settings, clear_parquet_collection, pop_flag, pop_parquet_dir, pop_positive_int_option, \
+    write_parquet_part
 
 name_basics = "name.basics.tsv.gz"
 title_basics = "title.basics.tsv.gz"
@@ -11,11 +18,59 @@ title_principals = "title.principals.tsv.gz"
 ml_links = "links.csv"
 ml_ratings = "ratings.csv"
 
+name_basics_columns = ['nconst', 'primaryName', 'birthYear', 'deathYear']
+title_basics_columns = ['tconst', 'titleType', 'primaryTitle', 'startYear', 'runtimeMinutes', 'genres']
+title_principals_columns = ['tconst', 'nconst', 'category']
+ml_links_columns = ['movieId', 'imdbId']
+ml_ratings_columns = ['userId', 'movieId', 'rating', 'timestamp']
+
+title_types = ['movie', 'short', 'tvMovie', 'tvShort']
+imdb_na_values = {'birthYear': '\\N', 'deathYear': '\\N', 'startYear': '\\N'}
+imdb_dtypes = {'nconst': str, 'tconst': str, 'runtimeMinutes': str, 'genres': str}
+
+default_batch_size = 10000
+default_workers = 4
+
+upsert_keys = {
+    'Person': ['id'],
+    'Movie': ['id'],
+    'Person_Roles': ['movieId', 'personId', 'category'],
+    'Ratings': ['userId', 'movieId']
+}
+watermarks_collection = 'Ingest_Watermarks'
+# The links of the last incremental run, by MovieLens movie ID
+links_collection = 'Ingest_Links'
+
 
 def parse_argv(argv):
+    argv = list(argv)
+    options = {
+        'batch_size': pop_positive_int_option(argv, '--batch-size', None),
+        'workers': pop_positive_int_option(argv, '--workers', default_workers),
+        'incremental': pop_flag(argv, '--incremental'),
+        'create_indexes': pop_flag(argv, '--create-indexes'),
+        'parquet_dir': pop_parquet_dir(argv),
+        'parquet_only': pop_flag(argv, '--parquet-only'),
+        'compact': pop_flag(argv, '--compact')
+    }
+
     if len(argv) != 3 and len(argv) != 4:
         print("Usage: python3 merge_datasets.py <directory containing the IMDb dataset>"
-              " <directory containing the MovieLens dataset> [MongoDB connection string]")
+              " <directory containing the MovieLens dataset> [MongoDB connection string]"
+              " [--batch-size <rows>] [--workers <threads>] [--incremental] [--compact] [--create-indexes]"
+              " [--parquet <directory> [--parquet-only]]")
+        sys.exit(1)
+
+    if options['parquet_only'] and options['parquet_dir'] is None:
+        print("--parquet-only needs the directory of the Parquet cache given with --parquet")
+        sys.exit(1)
+
+    if options['incremental'] and options['parquet_dir'] is not None:
+        print("The Parquet cache cannot be refreshed incrementally; rebuild it with --parquet-only instead")
+        sys.exit(1)
+
+    if options['compact'] and (options['incremental'] or options['parquet_only']):
+        print("--compact only applies to a full load into MongoDB")
         sys.exit(1)
 
     imdb_dir = argv[1]
@@ -26,100 +81,412 @@ def parse_argv(argv):
         print("Invalid directory/directories")
         sys.exit(1)
 
-    return imdb_dir, ml_dir, mongodb_connection_string
+    return imdb_dir, ml_dir, mongodb_connection_string, options
 
 
-def get_imdb_gz_df(imdb_dir, imdb_file, columns_to_read):
-    return pd.read_csv(imdb_dir + "\\" + imdb_file, sep="\t", usecols=columns_to_read, low_memory=False,
-                       compression='gzip')
+def read_stages(file_name, read_csv, chunk_size):
+    # The whole file as one stage, or every chunk as one
+    if chunk_size is None:
+        return profiling.run_stage('read ' + file_name, 'read', read_csv)
 
+    return profiling.iter_stages(read_csv(), 'read ' + file_name + ' chunk {}', 'read')
 
-def get_ml_csv_df(ml_dir, ml_file, columns_to_read):
-    return pd.read_csv(ml_dir + "\\" + ml_file, usecols=columns_to_read, low_memory=False)
 
+def get_imdb_gz_df(imdb_dir, imdb_file, columns_to_read, chunk_size=None):
+    return read_stages(imdb_file, lambda: pd.read_csv(join(imdb_dir, imdb_file), sep="\t", usecols=columns_to_read,
+                                                      low_memory=False, compression='gzip', chunksize=chunk_size,
+                                                      na_values=imdb_na_values, dtype=imdb_dtypes), chunk_size)
 
-def get_imdb_dfs(imdb_dir):
-    name_basics_columns = ['nconst', 'primaryName', 'birthYear', 'deathYear']
-    name_basics_df = get_imdb_gz_df(imdb_dir, name_basics, name_basics_columns)
-    nconst_list = [int(nconst[2:]) for nconst in name_basics_df['nconst']]
-    birth_year_list = [np.nan if birth_year == '\\N' else int(birth_year) for birth_year in name_basics_df['birthYear']]
-    death_year_list = [np.nan if death_year == '\\N' else int(death_year) for death_year in name_basics_df['deathYear']]
-    name_basics_df['nconst'] = nconst_list
-    name_basics_df['birthYear'] = birth_year_list
-    name_basics_df['deathYear'] = death_year_list
+
+def get_ml_csv_df(ml_dir, ml_file, columns_to_read, chunk_size=None):
+    return read_stages(ml_file, lambda: pd.read_csv(join(ml_dir, ml_file), usecols=columns_to_read, low_memory=False,
+                                                    chunksize=chunk_size), chunk_size)
+
+
+def parse_imdb_id(id_series):
+    return id_series.str.slice(2).astype('int32')
+
+
+def parse_nullable_int(series):
+    return series.astype('Int32')
+
+
+def clean_name_basics_df(name_basics_df):
+    name_basics_df['nconst'] = parse_imdb_id(name_basics_df['nconst'])
+    name_basics_df['birthYear'] = parse_nullable_int(name_basics_df['birthYear'])
+    name_basics_df['deathYear'] = parse_nullable_int(name_basics_df['deathYear'])
     name_basics_df.rename(columns={'nconst': 'id'}, inplace=True)
 
-    title_basics_columns = ['tconst', 'titleType', 'primaryTitle', 'startYear', 'runtimeMinutes', 'genres']
-    title_basics_df = get_imdb_gz_df(imdb_dir, title_basics, title_basics_columns)
-    titles_to_drop = title_basics_df[~(title_basics_df['titleType'] == 'movie')
-                                     & ~(title_basics_df['titleType'] == 'short')
-                                     & ~(title_basics_df['titleType'] == 'tvMovie')
-                                     & ~(title_basics_df['titleType'] == 'tvShort')].index
-    title_basics_df.drop(titles_to_drop, inplace=True)
-    title_basics_df.drop(['titleType'], axis=1, inplace=True)
-    tconst_list = [int(tconst[2:]) for tconst in title_basics_df['tconst']]
-    start_year_list = [np.nan if start_year == '\\N' else int(start_year)
-                       for start_year in title_basics_df['startYear']]
-    runtime_list = [np.nan if not str(runtime).isdigit() else int(runtime)
-                    for runtime in title_basics_df['runtimeMinutes']]
-    genres_list = [str(genres).split(',') for genres in title_basics_df['genres']]
-    title_basics_df['tconst'] = tconst_list
-    title_basics_df['startYear'] = start_year_list
-    title_basics_df['runtimeMinutes'] = runtime_list
-    title_basics_df['genres'] = genres_list
+    return name_basics_df
+
+
+def clean_title_basics_df(title_basics_df):
+    title_basics_df = title_basics_df[title_basics_df['titleType'].isin(title_types)].drop(columns=['titleType'])
+    runtime_series = title_basics_df['runtimeMinutes'].astype(str)
+    title_basics_df['tconst'] = parse_imdb_id(title_basics_df['tconst'])
+    title_basics_df['startYear'] = parse_nullable_int(title_basics_df['startYear'])
+    title_basics_df['runtimeMinutes'] = parse_nullable_int(runtime_series.where(runtime_series.str.isdigit()))
+    title_basics_df['genres'] = title_basics_df['genres'].fillna('\\N').str.split(',')
     title_basics_df.rename(columns={'tconst': 'id'}, inplace=True)
 
-    title_principals_columns = ['tconst', 'nconst', 'category']
-    title_principals_df = get_imdb_gz_df(imdb_dir, title_principals, title_principals_columns)
-    nconst_list = [int(nconst[2:]) for nconst in title_principals_df['nconst']]
-    tconst_list = [int(tconst[2:]) for tconst in title_principals_df['tconst']]
-    title_principals_df['nconst'] = nconst_list
-    title_principals_df['tconst'] = tconst_list
+    return title_basics_df
+
+
+def clean_title_principals_df(title_principals_df):
+    title_principals_df['nconst'] = parse_imdb_id(title_principals_df['nconst'])
+    title_principals_df['tconst'] = parse_imdb_id(title_principals_df['tconst'])
     title_principals_df.rename(columns={'tconst': 'movieId', 'nconst': 'personId'}, inplace=True)
 
+    return title_principals_df
+
+
+def get_imdb_dfs(imdb_dir):
+    name_basics_df = profiling.run_stage('transform Person', 'transform', clean_name_basics_df,
+                                         get_imdb_gz_df(imdb_dir, name_basics, name_basics_columns))
+    title_basics_df = profiling.run_stage('transform Movie', 'transform', clean_title_basics_df,
+                                          get_imdb_gz_df(imdb_dir, title_basics, title_basics_columns))
+    title_principals_df = profiling.run_stage('transform Person_Roles', 'transform', clean_title_principals_df,
+                                              get_imdb_gz_df(imdb_dir, title_principals, title_principals_columns))
+
     return name_basics_df, title_basics_df, title_principals_df
 
 
-def get_ml_dfs(ml_dir):
-    ml_links_columns = ['movieId', 'imdbId']
+def get_ml_links_map(ml_dir):
     ml_links_df = get_ml_csv_df(ml_dir, ml_links, ml_links_columns)
-    ml_links_map = dict((link['movieId'], link['imdbId']) for link in ml_links_df.to_dict('records'))
+    return ml_links_df.set_index('movieId')['imdbId']
 
-    ml_ratings_columns = ['userId', 'movieId', 'rating', 'timestamp']
-    ml_ratings_df = get_ml_csv_df(ml_dir, ml_ratings, ml_ratings_columns)
-    imdb_movie_id_list = [ml_links_map[movie_id] for movie_id in ml_ratings_df['movieId']]
-    ml_ratings_df['movieId'] = imdb_movie_id_list
 
-    return ml_ratings_df
+def clean_ml_ratings_df(ml_ratings_df, ml_links_map):
+    # Ratings of movies missing from links.csv have no IMDb ID to be stored under, so they are left out and counted
+    # rather than written with a NaN movieId
+    imdb_movie_ids = ml_ratings_df['movieId'].map(ml_links_map)
+    is_linked = imdb_movie_ids.notna()
 
+    if not is_linked.all():
+        print("{} ratings of movies missing from {} were left out".format(int((~is_linked).sum()), ml_links))
 
-def create_collections(imdb_dir, ml_dir, mongodb_connection_string):
-    name_basics_df, title_basics_df, title_principals_df = get_imdb_dfs(imdb_dir)
+    return ml_ratings_df[is_linked].assign(movieId=imdb_movie_ids[is_linked].astype('int32'))
 
-    client = MongoClient() if mongodb_connection_string is None else MongoClient(mongodb_connection_string)
-    database = client['MapReduce']
 
-    person_collection = database['Person']
-    person_list = [dict((key, value) for key, value in zip(name_basics_df.columns, row)
-                        if value is not np.nan and value == value) for row in name_basics_df.to_numpy()]
-    person_collection.insert_many(person_list)
+def get_ml_dfs(ml_dir):
+    ml_links_map = get_ml_links_map(ml_dir)
+    return profiling.run_stage('transform Ratings', 'transform', clean_ml_ratings_df,
+                               get_ml_csv_df(ml_dir, ml_ratings, ml_ratings_columns), ml_links_map)
+
+
+def df_to_documents(df):
+    return [dict((key, value) for key, value in zip(df.columns, row)
+                 if value is not pd.NA and value == value) for row in df.to_numpy()]
+
+
+def get_client(mongodb_connection_string, workers):
+    # The writes get their own client, with a pool sized to the number of writer threads, but connect to the server
+    # given to movie_analysis.py when there is no connection string of their own
+    if mongodb_connection_string is None:
+        mongodb_connection_string = client_settings['connection_string']
+
+    return client_settings['client_factory'](mongodb_connection_string, maxPoolSize=workers)
+
+
+def get_encoder(database, compact):
+    # None unless the documents are written in the layout of compact_schema.py. The collections of a compact load
+    # are views, which cannot be written to.
+    if compact:
+        return compact_schema.new_encoder(database)
+
+    if compact_schema.is_compact(database):
+        print("The database holds a compact load, whose collections are views; load it again with --compact")
+        sys.exit(1)
+
+    return None
+
+
+def get_target_collection(collection_name, encoder):
+    return collection_name if encoder is None else compact_schema.compact_collections[collection_name]
+
+
+def with_compact_encoding(to_documents, encoder, collection_name):
+    # The Parquet cache keeps the decoded columns; only the documents are encoded
+    if encoder is None:
+        return to_documents
 
-    movie_collection = database['Movie']
-    movie_list = [dict((key, value) for key, value in zip(title_basics_df.columns, row)
-                       if value is not np.nan and value == value) for row in title_basics_df.to_numpy()]
-    movie_collection.insert_many(movie_list)
+    return lambda df: to_documents(compact_schema.encode_df(encoder, collection_name, df))
 
-    person_role_collection = database['Person_Roles']
-    person_role_collection.insert_many(title_principals_df.to_dict('records'))
 
+def load_into(database, batches_by_collection, workers, encoder, verbose=True):
+    metrics_by_collection = load_collections(database, batches_by_collection, workers, verbose=verbose)
+
+    if encoder is not None:
+        compact_schema.create_views(database, encoder)
+
+    return metrics_by_collection
+
+
+def create_collections(imdb_dir, ml_dir, mongodb_connection_string, workers=default_workers, parquet_dir=None,
+                       compact=False):
+    name_basics_df, title_basics_df, title_principals_df = get_imdb_dfs(imdb_dir)
     ml_ratings_df = get_ml_dfs(ml_dir)
-    ratings_collection = database['Ratings']
-    ratings_collection.insert_many(ml_ratings_df.to_dict('records'))
+
+    if parquet_dir is not None:
+        for collection_name, df in [('Person', name_basics_df), ('Movie', title_basics_df),
+                                    ('Person_Roles', title_principals_df), ('Ratings', ml_ratings_df)]:
+            clear_parquet_collection(parquet_dir, collection_name)
+            write_parquet_part(parquet_dir, collection_name, 0, df)
+
+    database = get_client(mongodb_connection_string, workers)['MapReduce']
+    encoder = get_encoder(database, compact)
+    batches_by_collection = dict(
+        (get_target_collection(collection_name, encoder),
+         split_into_batches(profiling.run_stage('transform {} documents'.format(collection_name), 'transform',
+                                                with_compact_encoding(to_documents, encoder, collection_name), df),
+                            default_batch_size))
+        for collection_name, df, to_documents in [
+            ('Person', name_basics_df, df_to_documents),
+            ('Movie', title_basics_df, df_to_documents),
+            ('Person_Roles', title_principals_df, lambda df: df.to_dict('records')),
+            ('Ratings', ml_ratings_df, lambda df: df.to_dict('records'))
+        ])
+
+    return load_into(database, batches_by_collection, workers, encoder, verbose=False)
+
+
+def stream_documents(chunks, clean_chunk, to_documents, collection_name):
+    for chunk in chunks:
+        yield profiling.run_stage('transform ' + collection_name, 'transform', lambda: to_documents(clean_chunk(chunk)))
+
+
+def with_parquet_output(clean_df, parquet_dir, collection_name):
+    if parquet_dir is None:
+        return clean_df
+
+    clear_parquet_collection(parquet_dir, collection_name)
+    part_numbers = count()
+
+    def clean_and_write_df(df):
+        df = clean_df(df)
+        write_parquet_part(parquet_dir, collection_name, next(part_numbers), df)
+
+        return df
+
+    return clean_and_write_df
+
+
+def get_streaming_sources(imdb_dir, ml_dir, batch_size):
+    ml_links_map = get_ml_links_map(ml_dir)
+
+    return [
+        ('Person', get_imdb_gz_df(imdb_dir, name_basics, name_basics_columns, batch_size),
+         clean_name_basics_df, df_to_documents),
+        ('Movie', get_imdb_gz_df(imdb_dir, title_basics, title_basics_columns, batch_size),
+         clean_title_basics_df, df_to_documents),
+        ('Person_Roles', get_imdb_gz_df(imdb_dir, title_principals, title_principals_columns, batch_size),
+         clean_title_principals_df, lambda df: df.to_dict('records')),
+        ('Ratings', get_ml_csv_df(ml_dir, ml_ratings, ml_ratings_columns, batch_size),
+         lambda df: clean_ml_ratings_df(df, ml_links_map), lambda df: df.to_dict('records'))
+    ]
+
+
+def create_collections_streaming(imdb_dir, ml_dir, mongodb_connection_string, batch_size,
+                                 workers=default_workers, parquet_dir=None, compact=False):
+    database = get_client(mongodb_connection_string, workers)['MapReduce']
+    encoder = get_encoder(database, compact)
+    batches_by_collection = dict(
+        (get_target_collection(collection_name, encoder),
+         stream_documents(chunks, with_parquet_output(clean_df, parquet_dir, collection_name),
+                          with_compact_encoding(to_documents, encoder, collection_name), collection_name))
+        for collection_name, chunks, clean_df, to_documents in get_streaming_sources(imdb_dir, ml_dir, batch_size))
+
+    return load_into(database, batches_by_collection, workers, encoder)
+
+
+def create_parquet_cache(imdb_dir, ml_dir, parquet_dir, batch_size):
+    rows_by_collection = {}
+
+    for collection_name, chunks, clean_df, _ in get_streaming_sources(imdb_dir, ml_dir, batch_size):
+        clean_and_write_df = with_parquet_output(clean_df, parquet_dir, collection_name)
+        rows_by_collection[collection_name] = sum(len(clean_and_write_df(chunk)) for chunk in chunks)
+        print("{}: {} rows written to {}".format(collection_name, rows_by_collection[collection_name], parquet_dir))
+
+    return rows_by_collection
+
+
+def add_content_hashes(df):
+    hashable_df = df.assign(genres=df['genres'].str.join(',')) if 'genres' in df.columns else df
+    return df.assign(_hash=pd.util.hash_pandas_object(hashable_df, index=False).to_numpy().view('int64'))
+
+
+def with_content_hashes(clean_df):
+    return lambda df: add_content_hashes(clean_df(df))
+
+
+def get_file_fingerprint(path):
+    file_stat = stat(path)
+    return {'size': file_stat.st_size, 'mtime': file_stat.st_mtime_ns}
+
+
+def is_unchanged(watermark, fingerprint):
+    return watermark is not None and all(watermark.get(key) == value for key, value in fingerprint.items())
+
+
+def create_upsert_indexes(database):
+    # The keys are unique, so two writer threads upserting the same new key cannot both insert it. An index on the
+    # same fields without the constraint, left by an older run or by create_indexes.py, is replaced.
+    for collection_name, upsert_key in upsert_keys.items():
+        collection = database[collection_name]
+        index_key = [(key, 1) for key in upsert_key]
+
+        for index_name, index in collection.index_information().items():
+            if list(index['key']) == index_key and not index.get('unique', False):
+                collection.drop_index(index_name)
+
+        try:
+            collection.create_index(index_key, unique=True)
+        except OperationFailure as error:
+            if error.code != duplicate_key_error_code:
+                raise
+
+            print("{} holds several documents with the same {}, so it cannot be updated incrementally; load it again"
+                  " without --incremental".format(collection_name, ', '.join(upsert_key)))
+            sys.exit(1)
+
+        collection.create_index('_hash')
+
+
+def get_links(ml_links_map):
+    return dict(zip(ml_links_map.index.tolist(), ml_links_map.tolist()))
+
+
+def delete_remapped_ratings(database, links):
+    # Ratings are stored under the IMDb ID of their movie, so the ratings of a movie that links.csv now maps to
+    # another ID, or no longer lists, are deleted; every rating is read again and upserted under its new ID
+    old_links = dict((link['_id'], link['imdbId']) for link in database[links_collection].find())
+    remapped_ids = sorted(set(imdb_id for movie_id, imdb_id in old_links.items() if links.get(movie_id) != imdb_id))
+
+    if len(remapped_ids) > 0:
+        num_deleted = database['Ratings'].delete_many({'movieId': {'$in': remapped_ids}}).deleted_count
+        print("{} ratings of {} movies remapped by {} were deleted".format(num_deleted, len(remapped_ids), ml_links))
+
+
+def save_links(database, links):
+    database[links_collection].delete_many({})
+
+    if len(links) > 0:
+        database[links_collection].insert_many([{'_id': movie_id, 'imdbId': imdb_id}
+                                                for movie_id, imdb_id in links.items()])
+
+
+def get_ratings_batches(ml_dir, batch_size, watermark, fingerprint, ml_links_map):
+    # Ratings are only ever added at or after the newest timestamp of the last run, unless the links file changed and
+    # remapped old ratings. Ratings at that timestamp are read again, since more may have been added with it, and
+    # the ones already stored are skipped by their content hash.
+    min_timestamp = None if watermark is None or watermark['links'] != fingerprint['links'] \
+        else watermark['maxTimestamp']
+    fingerprint['maxTimestamp'] = 0 if watermark is None else watermark['maxTimestamp']
+
+    def clean_new_ratings_df(ml_ratings_df):
+        ml_ratings_df = clean_ml_ratings_df(ml_ratings_df, ml_links_map)
+
+        if len(ml_ratings_df) > 0:
+            fingerprint['maxTimestamp'] = max(fingerprint['maxTimestamp'], int(ml_ratings_df['timestamp'].max()))
+
+        if min_timestamp is not None:
+            ml_ratings_df = ml_ratings_df[ml_ratings_df['timestamp'] >= min_timestamp]
+
+        return add_content_hashes(ml_ratings_df)
+
+    return stream_documents(get_ml_csv_df(ml_dir, ml_ratings, ml_ratings_columns, batch_size),
+                            clean_new_ratings_df, lambda df: df.to_dict('records'), 'Ratings')
+
+
+def create_collections_incremental(imdb_dir, ml_dir, mongodb_connection_string, batch_size,
+                                   workers=default_workers):
+    database = get_client(mongodb_connection_string, workers)['MapReduce']
+    get_encoder(database, False)
+    create_upsert_indexes(database)
+    watermarks = dict((watermark['_id'], watermark) for watermark in database[watermarks_collection].find())
+    fingerprints = {}
+    batches_by_collection = {}
+
+    imdb_sources = [
+        ('Person', name_basics, name_basics_columns, clean_name_basics_df, df_to_documents),
+        ('Movie', title_basics, title_basics_columns, clean_title_basics_df, df_to_documents),
+        ('Person_Roles', title_principals, title_principals_columns, clean_title_principals_df,
+         lambda df: df.to_dict('records'))
+    ]
+
+    for collection_name, imdb_file, columns_to_read, clean_df, to_documents in imdb_sources:
+        fingerprint = get_file_fingerprint(join(imdb_dir, imdb_file))
+
+        if is_unchanged(watermarks.get(imdb_file), fingerprint):
+            print("{} is unchanged since the last run".format(imdb_file))
+            continue
+
+        fingerprints[imdb_file] = fingerprint
+        batches_by_collection[collection_name] = stream_documents(
+            get_imdb_gz_df(imdb_dir, imdb_file, columns_to_read, batch_size), with_content_hashes(clean_df),
+            to_documents, collection_name)
+
+    fingerprint = get_file_fingerprint(join(ml_dir, ml_ratings))
+    fingerprint['links'] = get_file_fingerprint(join(ml_dir, ml_links))
+    watermark = watermarks.get(ml_ratings)
+    links = None
+
+    if is_unchanged(watermark, fingerprint):
+        print("{} is unchanged since the last run".format(ml_ratings))
+    else:
+        fingerprints[ml_ratings] = fingerprint
+        ml_links_map = get_ml_links_map(ml_dir)
+
+        if watermark is None or watermark['links'] != fingerprint['links']:
+            links = get_links(ml_links_map)
+            delete_remapped_ratings(database, links)
+
+        batches_by_collection['Ratings'] = get_ratings_batches(ml_dir, batch_size, watermark, fingerprint,
+                                                               ml_links_map)
+
+    if len(batches_by_collection) == 0:
+        return {}
+
+    metrics_by_collection = load_collections(database, batches_by_collection, workers, upsert_keys=upsert_keys)
+
+    # Watermarks and links are only moved forward once every file has been written completely, so a run that fails
+    # deletes the remapped ratings again and reads every rating again
+    if links is not None:
+        save_links(database, links)
+
+    for file_name, fingerprint in fingerprints.items():
+        database[watermarks_collection].replace_one({'_id': file_name}, fingerprint, upsert=True)
+
+    return metrics_by_collection
 
 
 def main():
-    imdb_dir, ml_dir, mongodb_connection_string = parse_argv(sys.argv)
-    create_collections(imdb_dir, ml_dir, mongodb_connection_string)
+    imdb_dir, ml_dir, mongodb_connection_string, options = parse_argv(sys.argv)
+
+    if options['parquet_only']:
+        batch_size = default_batch_size if options['batch_size'] is None else options['batch_size']
+        create_parquet_cache(imdb_dir, ml_dir, options['parquet_dir'], batch_size)
+        return
+
+    if options['incremental']:
+        batch_size = default_batch_size if options['batch_size'] is None else options['batch_size']
+        metrics_by_collection = create_collections_incremental(imdb_dir, ml_dir, mongodb_connection_string,
+                                                               batch_size, options['workers'])
+    elif options['batch_size'] is None:
+        metrics_by_collection = create_collections(imdb_dir, ml_dir, mongodb_connection_string, options['workers'],
+                                                   options['parquet_dir'], options['compact'])
+    else:
+        metrics_by_collection = create_collections_streaming(imdb_dir, ml_dir, mongodb_connection_string,
+                                                             options['batch_size'], options['workers'],
+                                                             options['parquet_dir'], options['compact'])
+
+    print_metrics(metrics_by_collection)
+
+    # Imported only when asked for, since it imports the query of every analysis script
+    if options['create_indexes']:
+        from create_indexes import create_indexes
+
+        create_indexes(get_client(mongodb_connection_string, 1)['MapReduce'])
 
 
 if __name__ == '__main__':
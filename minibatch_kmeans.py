@@ -0,0 +1,115 @@
+# Mini-batch k-means over feature vectors that are read in batches and never held in memory all at once
+#
+# get_batches is a function returning a new iterator over float64 matrices (one row per point, NaN for a missing
+# value) every time it is called; every pass over the data calls it again, so memory is bounded by the batch size.
+# A first pass collects the mean and standard deviation of every feature, which standardize the batches and
+# stand in for missing values. The centroids are then updated batch by batch as in Sculley's mini-batch k-means
+# with a per-centroid learning rate of 1 / (points assigned so far), which makes every centroid the running mean
+# of the points assigned to it.
+
+import numpy as np
+
+import profiling
+
+
+def get_feature_statistics(get_batches):
+    counts, sums, squares = 0, 0, 0
+
+    for batch in get_batches():
+        is_present = ~np.isnan(batch)
+        present_values = np.where(is_present, batch, 0)
+        counts = counts + is_present.sum(axis=0)
+        sums = sums + present_values.sum(axis=0)
+        squares = squares + (present_values ** 2).sum(axis=0)
+
+    counts = np.maximum(counts, 1)
+    means = sums / counts
+    stds = np.sqrt(np.maximum(squares / counts - means ** 2, 0))
+
+    # A constant feature carries no information and is left at 0 after standardizing
+    return means, np.where(stds > 0, stds, 1)
+
+
+def standardize(batch, means, stds):
+    return np.nan_to_num((batch - means) / stds, nan=0.0)
+
+
+def get_squared_distances(points, centroids):
+    return np.maximum((points ** 2).sum(axis=1)[:, None] - 2 * points @ centroids.T +
+                      (centroids ** 2).sum(axis=1)[None, :], 0)
+
+
+def seed_centroids(points, k, rng):
+    # k-means++ over the first batch
+    centroids = [points[rng.integers(len(points))]]
+    squared_distances = ((points - centroids[0]) ** 2).sum(axis=1)
+
+    for _ in range(1, min(k, len(points))):
+        total = squared_distances.sum()
+
+        if total == 0:
+            break
+
+        index = min(int(np.searchsorted(np.cumsum(squared_distances), rng.random() * total, side='right')),
+                    len(points) - 1)
+        centroids.append(points[index])
+        squared_distances = np.minimum(squared_distances, ((points - points[index]) ** 2).sum(axis=1))
+
+    return np.array(centroids)
+
+
+def update_centroids(centroids, counts, points):
+    labels = get_squared_distances(points, centroids).argmin(axis=1)
+    batch_counts = np.bincount(labels, minlength=len(centroids))
+    batch_sums = np.zeros_like(centroids)
+    np.add.at(batch_sums, labels, points)
+
+    new_counts = counts + batch_counts
+    is_updated = batch_counts > 0
+    centroids = centroids.copy()
+    centroids[is_updated] = (counts[is_updated, None] * centroids[is_updated] + batch_sums[is_updated]) / \
+        new_counts[is_updated, None]
+
+    return centroids, new_counts
+
+
+def mini_batch_k_means(get_batches, k, epochs=1, seed=None):
+    # Returns the centroids in the original units of the features, the number of points assigned to every centroid
+    # during the last epoch and the statistics the batches were standardized with
+    means, stds = get_feature_statistics(get_batches)
+    rng = np.random.default_rng(seed)
+    centroids = None
+    counts = None
+
+    for epoch in range(epochs):
+        epoch_counts = None
+
+        with profiling.stage('mini-batch k-means epoch {}'.format(epoch + 1), 'k-means') as record:
+            for batch in get_batches():
+                points = standardize(batch, means, stds)
+
+                if len(points) == 0:
+                    continue
+
+                if centroids is None:
+                    centroids = seed_centroids(points, k, rng)
+                    counts = np.zeros(len(centroids), dtype=np.int64)
+
+                previous_counts = counts
+                centroids, counts = update_centroids(centroids, counts, points)
+                epoch_counts = counts - previous_counts if epoch_counts is None else \
+                    epoch_counts + counts - previous_counts
+
+            record['rows'] = None if epoch_counts is None else int(epoch_counts.sum())
+
+    if centroids is None:
+        return np.empty((0, len(means))), np.empty(0, dtype=np.int64), means, stds
+
+    return centroids * stds + means, epoch_counts, means, stds
+
+
+def compute_sse(get_batches, centroids, means, stds):
+    # SSE of the standardized points to their closest centroid, in one more pass over the batches
+    scaled_centroids = (centroids - means) / stds
+    return float(sum(get_squared_distances(standardize(batch, means, stds), scaled_centroids).min(axis=1).sum()
+                     for batch in get_batches()))
@@ -0,0 +1,484 @@
+# Frequent itemset miners (vertical Apriori, Eclat and FP-Growth) over actors and the movies they appeared in
+#
+# Actors are the items and movies are the transactions. Actor and movie IDs are remapped to dense integers, every
+# itemset is kept as a sorted row of actor indexes and the movies it appears in as a sorted TID array, so that
+# candidate generation and support counting are whole-array NumPy operations instead of per-candidate set work.
+# Every miner returns the itemsets level by level, each level sorted, along with their supports.
+
+import multiprocessing
+
+import numpy as np
+
+import profiling
+
+# Caps the number of (candidate, movie) pairs materialized at once while counting supports
+max_pairs_per_batch = 1 << 22
+# Levels with fewer lookups than this per shard are not worth forking workers for
+min_pairs_per_shard = 1 << 18
+shards_per_worker = 4
+# The level being counted by a pool of forked workers, and the function counting one shard of it
+shared_level = {}
+
+
+def encode_roles(role_actor_ids, role_movie_ids, min_support):
+    # Builds the baskets (actor_ids, movie_ids, tids, tid_offsets) from one (actor, movie) pair per role: actors
+    # with at least min_support distinct movies become the items 0 to n - 1 in the order of their IDs, movies become
+    # the transactions 0 to m - 1 in the same way, and the sorted TIDs of item i are tids[tid_offsets[i]:
+    # tid_offsets[i + 1]]
+    role_actor_ids = np.asarray(role_actor_ids, dtype=np.int64)
+    role_movie_ids = np.asarray(role_movie_ids, dtype=np.int64)
+    order = np.lexsort((role_movie_ids, role_actor_ids))
+    role_actor_ids = role_actor_ids[order]
+    role_movie_ids = role_movie_ids[order]
+
+    is_new_role = np.concatenate([np.ones(min(len(order), 1), dtype=bool),
+                                  (role_actor_ids[1:] != role_actor_ids[:-1]) |
+                                  (role_movie_ids[1:] != role_movie_ids[:-1])])
+    role_actor_ids = role_actor_ids[is_new_role]
+    role_movie_ids = role_movie_ids[is_new_role]
+
+    actor_ids, lengths = np.unique(role_actor_ids, return_counts=True)
+    is_frequent = lengths >= min_support
+    movie_ids, tids = np.unique(role_movie_ids[np.repeat(is_frequent, lengths)], return_inverse=True)
+
+    return actor_ids[is_frequent], movie_ids, tids.astype(np.int32), \
+        np.concatenate([[0], np.cumsum(lengths[is_frequent])])
+
+
+def encode_movies_by_actors(movies_by_actors, min_support):
+    role_actor_ids = []
+    role_movie_ids = []
+
+    for actor in movies_by_actors:
+        role_actor_ids.extend([actor['_id']] * len(actor['movies']))
+        role_movie_ids.extend(actor['movies'])
+
+    return encode_roles(role_actor_ids, role_movie_ids, min_support)
+
+
+def get_num_after(run_ids):
+    # The number of later positions in the same run of equal, contiguous run IDs, for every position
+    num_elements = len(run_ids)
+
+    if num_elements < 2:
+        return np.zeros(num_elements, dtype=np.int64)
+
+    run_starts = np.flatnonzero(np.concatenate([[True], run_ids[1:] != run_ids[:-1]]))
+    run_ends = np.concatenate([run_starts[1:], [num_elements]])
+
+    return np.repeat(run_ends, run_ends - run_starts) - np.arange(num_elements) - 1
+
+
+def get_run_pairs(run_ids, num_after=None):
+    # Returns every pair of positions (first < second) that lie in the same run of equal, contiguous run IDs; with
+    # num_after, only the pairs of the positions whose num_after was kept
+    if num_after is None:
+        num_after = get_num_after(run_ids)
+
+    positions = np.arange(len(run_ids))
+    first = np.repeat(positions, num_after)
+    pair_starts = np.repeat(np.cumsum(num_after) - num_after, num_after)
+    second = first + 1 + np.arange(len(first)) - pair_starts
+
+    return first, second
+
+
+def rows_in(queries, rows, num_items):
+    # Exact, vectorized membership test of the rows of queries among the unique, lexicographically sorted rows
+    if len(queries) == 0 or len(rows) == 0:
+        return np.zeros(len(queries), dtype=bool)
+
+    if num_items ** rows.shape[1] < 2 ** 63:
+        # Read as numbers in base num_items, sorted rows become sorted integers that can be binary searched
+        weights = num_items ** np.arange(rows.shape[1] - 1, -1, -1, dtype=np.int64)
+        row_keys = rows @ weights
+        query_keys = queries @ weights
+        found = np.minimum(np.searchsorted(row_keys, query_keys), len(row_keys) - 1)
+
+        return row_keys[found] == query_keys
+
+    combined = np.vstack([rows, queries])
+    tags = np.concatenate([np.zeros(len(rows), dtype=np.int8), np.ones(len(queries), dtype=np.int8)])
+    order = np.lexsort((tags,) + tuple(combined[:, column] for column in reversed(range(combined.shape[1]))))
+    sorted_rows = combined[order]
+    sorted_tags = tags[order]
+
+    new_run = np.concatenate([[True], np.any(sorted_rows[1:] != sorted_rows[:-1], axis=1)])
+    run_first_tags = sorted_tags[np.flatnonzero(new_run)][np.cumsum(new_run) - 1]
+    found = np.zeros(len(queries), dtype=bool)
+    is_query = sorted_tags == 1
+    found[order[is_query] - len(rows)] = run_first_tags[is_query] == 0
+
+    return found
+
+
+def get_frequent_pairs(num_items, tids, tid_offsets, min_support, workers=1):
+    # Level 2 is counted straight from the transactions: only actor pairs that share at least one movie are ever
+    # formed, instead of the num_items * (num_items - 1) / 2 candidates a prefix join would produce. The pairs are
+    # sharded by their first actor, so the shards find disjoint, ascending codes and are simply concatenated.
+    items = np.repeat(np.arange(num_items, dtype=np.int64), np.diff(tid_offsets))
+    order = np.lexsort((items, tids))
+    level = {
+        'sorted_tids': tids[order],
+        'sorted_items': items[order],
+        'num_items': num_items,
+        'min_support': min_support
+    }
+    level['num_after'] = get_num_after(level['sorted_tids'])
+    pairs_per_item = np.bincount(level['sorted_items'], weights=level['num_after'], minlength=num_items)
+    shard_bounds = get_shard_bounds(np.cumsum(pairs_per_item.astype(np.int64)), workers)
+
+    codes, supports, new_tids, new_tid_offsets = concatenate_shards(count_shards(level, count_pair_shard,
+                                                                                 shard_bounds, workers))
+
+    return codes // num_items, codes % num_items, supports, new_tids, new_tid_offsets
+
+
+def count_pair_shard(level, start, end):
+    # Counts the pairs whose first actor is one of start to end - 1
+    sorted_items, sorted_tids, num_items = level['sorted_items'], level['sorted_tids'], level['num_items']
+    is_first = (sorted_items >= start) & (sorted_items < end)
+    first, second = get_run_pairs(sorted_tids, np.where(is_first, level['num_after'], 0))
+
+    return select_frequent(sorted_items[first] * num_items + sorted_items[second], sorted_tids[first],
+                           level['min_support'])
+
+
+def select_frequent(codes, code_tids, min_support, is_sorted=False):
+    # Groups the (code, movie) pairs by code and keeps the codes seen in at least min_support movies, along with
+    # their TID lists
+    if not is_sorted:
+        order = np.lexsort((code_tids, codes))
+        codes = codes[order]
+        code_tids = code_tids[order]
+
+    unique_codes, supports = np.unique(codes, return_counts=True)
+    is_frequent = supports >= min_support
+    frequent_supports = supports[is_frequent]
+
+    return unique_codes[is_frequent], frequent_supports, code_tids[np.repeat(is_frequent, supports)], \
+        np.concatenate([[0], np.cumsum(frequent_supports)])
+
+
+def generate_candidates(itemsets, num_items):
+    # Prefix join: two itemsets of size k - 1 that share their first k - 2 items give one candidate of size k
+    prefix_size = itemsets.shape[1] - 1
+    prefixes = itemsets[:, :prefix_size]
+    group_ids = np.cumsum(np.concatenate([[True], np.any(prefixes[1:] != prefixes[:-1], axis=1)]))
+    first, second = get_run_pairs(group_ids)
+
+    candidates = np.hstack([itemsets[first], itemsets[second][:, -1:]])
+
+    # Subset pruning: the candidate already contains both joined itemsets, so only the subsets that drop one of
+    # the prefix items are left to check
+    keep = np.ones(len(candidates), dtype=bool)
+
+    for dropped in range(prefix_size):
+        kept = np.flatnonzero(keep)
+        keep[kept] = rows_in(np.delete(candidates[kept], dropped, axis=1), itemsets, num_items)
+
+    return first[keep], second[keep]
+
+
+def count_supports(first, second, tids, tid_offsets, min_support, workers=1):
+    # A movie is in the TID list of a candidate if it is in the lists of both joined itemsets. Every movie of the
+    # shorter list is looked up in the longer one with a binary search over the keys (itemset, movie) of all the
+    # lists of the level, which are already sorted, so no list is ever copied or merged.
+    lengths = np.diff(tid_offsets)
+    tid_base = int(tids.max()) + 1 if len(tids) > 0 else 1
+    row_keys = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths) * tid_base + tids
+
+    first_is_shorter = lengths[first] <= lengths[second]
+    level = {
+        'shorter': np.where(first_is_shorter, first, second),
+        'longer': np.where(first_is_shorter, second, first),
+        'tids': tids,
+        'tid_offsets': tid_offsets,
+        'row_keys': row_keys,
+        'tid_base': tid_base,
+        'min_support': min_support
+    }
+    level['cumulative_lengths'] = np.cumsum(lengths[level['shorter']])
+    shard_bounds = get_shard_bounds(level['cumulative_lengths'], workers)
+
+    return concatenate_shards(count_shards(level, count_shard_supports, shard_bounds, workers))
+
+
+def count_shards(level, count_shard_function, shard_bounds, workers):
+    # A single shard, or a level on a platform that cannot fork, is counted in the calling process. Otherwise
+    # forked workers inherit the arrays of the level, so only the bounds of every shard and the frequent codes it
+    # finds are pickled.
+    if len(shard_bounds) <= 2 or 'fork' not in multiprocessing.get_all_start_methods():
+        return [count_shard_function(level, 0, int(shard_bounds[-1]))]
+
+    shared_level.update(level)
+    shared_level['count_shard'] = count_shard_function
+
+    try:
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            return pool.map(count_shard, zip(shard_bounds[:-1].tolist(), shard_bounds[1:].tolist()))
+    finally:
+        shared_level.clear()
+
+
+def concatenate_shards(shards):
+    # The shards hold consecutive ranges of codes, so their (codes, supports, TIDs, TID offsets) are concatenated
+    if len(shards) == 1:
+        return shards[0]
+
+    supports = np.concatenate([shard_supports for _, shard_supports, _, _ in shards])
+
+    return np.concatenate([codes for codes, _, _, _ in shards]), supports, \
+        np.concatenate([shard_tids for _, _, shard_tids, _ in shards]), np.concatenate([[0], np.cumsum(supports)])
+
+
+def get_shard_bounds(cumulative_lengths, workers):
+    # Splits the candidates, or the first actors of the pairs, into contiguous shards of about the same number of
+    # lookups or pairs, a few per worker so that a slow shard does not hold up the level; a single shard means the
+    # level is counted in the calling process
+    num_pairs = int(cumulative_lengths[-1]) if len(cumulative_lengths) > 0 else 0
+    num_shards = min(shards_per_worker * workers, num_pairs // min_pairs_per_shard) if workers > 1 else 1
+
+    if num_shards < 2:
+        return np.array([0, len(cumulative_lengths)])
+
+    targets = num_pairs * np.arange(1, num_shards, dtype=np.int64) // num_shards
+    return np.unique(np.concatenate([[0], np.searchsorted(cumulative_lengths, targets, side='right'),
+                                     [len(cumulative_lengths)]]))
+
+
+def count_shard(bounds):
+    return shared_level['count_shard'](shared_level, *bounds)
+
+
+def count_shard_supports(level, start, end):
+    # Counts the candidates start to end - 1; the returned candidate IDs index the whole level
+    shorter, longer = level['shorter'], level['longer']
+    tids, tid_offsets, row_keys, tid_base = level['tids'], level['tid_offsets'], level['row_keys'], level['tid_base']
+    cumulative_lengths = level['cumulative_lengths']
+    lengths = np.diff(tid_offsets)
+    shared_candidates = [np.empty(0, dtype=np.int64)]
+    shared_tids = [np.empty(0, dtype=np.int32)]
+
+    while start < end:
+        batch_offset = cumulative_lengths[start - 1] if start > 0 else 0
+        batch_end = min(end, max(start + 1, int(np.searchsorted(cumulative_lengths,
+                                                                batch_offset + max_pairs_per_batch, side='right'))))
+        row_lengths = lengths[shorter[start:batch_end]]
+        row_starts = np.cumsum(row_lengths) - row_lengths
+        positions = np.repeat(tid_offsets[shorter[start:batch_end]] - row_starts, row_lengths) + \
+            np.arange(row_lengths.sum())
+
+        candidate_ids = np.repeat(np.arange(start, batch_end, dtype=np.int64), row_lengths)
+        query_tids = tids[positions]
+        query_keys = np.repeat(longer[start:batch_end], row_lengths) * tid_base + query_tids
+        found = np.minimum(np.searchsorted(row_keys, query_keys), len(row_keys) - 1)
+        is_shared = row_keys[found] == query_keys
+
+        shared_candidates.append(candidate_ids[is_shared])
+        shared_tids.append(query_tids[is_shared])
+        start = batch_end
+
+    return select_frequent(np.concatenate(shared_candidates), np.concatenate(shared_tids), level['min_support'],
+                           is_sorted=True)
+
+
+def apriori_levels(num_items, tids, tid_offsets, min_support, max_itemset_size, workers=1):
+    itemsets = np.arange(num_items, dtype=np.int64).reshape(-1, 1)
+    supports = np.diff(tid_offsets)
+
+    while len(itemsets) > 0:
+        yield itemsets, supports
+
+        if itemsets.shape[1] >= max_itemset_size:
+            break
+
+        if itemsets.shape[1] == 1:
+            first, second, supports, tids, tid_offsets = get_frequent_pairs(num_items, tids, tid_offsets,
+                                                                            min_support, workers)
+            itemsets = np.column_stack([first, second])
+        else:
+            first, second = generate_candidates(itemsets, num_items)
+            candidate_ids, supports, tids, tid_offsets = count_supports(first, second, tids, tid_offsets,
+                                                                        min_support, workers)
+            itemsets = np.hstack([itemsets[first[candidate_ids]], itemsets[second[candidate_ids]][:, -1:]])
+
+
+def sort_levels(itemsets_by_size, supports_by_size):
+    # Depth first miners find the itemsets of a level out of order, so every level is sorted before it is returned
+    for size in sorted(itemsets_by_size):
+        itemsets = np.vstack(itemsets_by_size[size])
+        supports = np.concatenate(supports_by_size[size])
+        order = np.lexsort(tuple(itemsets[:, column] for column in reversed(range(size))))
+
+        yield itemsets[order], supports[order]
+
+
+def add_itemsets(itemsets_by_size, supports_by_size, itemsets, supports):
+    if len(itemsets) > 0:
+        itemsets_by_size.setdefault(itemsets.shape[1], []).append(itemsets)
+        supports_by_size.setdefault(itemsets.shape[1], []).append(supports)
+
+
+def split_into_classes(itemsets, tids, tid_offsets):
+    # Yields the equivalence classes (itemsets sharing every item but their last one) that can still be extended,
+    # each with its own slice of the TID lists
+    prefixes = itemsets[:, :-1]
+    class_starts = np.flatnonzero(np.concatenate([[True], np.any(prefixes[1:] != prefixes[:-1], axis=1)]))
+    class_ends = np.concatenate([class_starts[1:], [len(itemsets)]])
+
+    for start, end in zip(class_starts.tolist(), class_ends.tolist()):
+        if end - start >= 2:
+            yield itemsets[start:end], tids[tid_offsets[start]:tid_offsets[end]], \
+                tid_offsets[start:end + 1] - tid_offsets[start]
+
+
+def eclat_levels(num_items, tids, tid_offsets, min_support, max_itemset_size):
+    # Depth first search over equivalence classes: every pair of itemsets of a class is joined by intersecting
+    # their TID lists, and each class found that way is explored completely before its siblings
+    itemsets_by_size = {}
+    supports_by_size = {}
+    add_itemsets(itemsets_by_size, supports_by_size, np.arange(num_items, dtype=np.int64).reshape(-1, 1),
+                 np.diff(tid_offsets))
+
+    if max_itemset_size < 2:
+        return sort_levels(itemsets_by_size, supports_by_size)
+
+    first, second, supports, tids, tid_offsets = get_frequent_pairs(num_items, tids, tid_offsets, min_support)
+    itemsets = np.column_stack([first, second])
+    add_itemsets(itemsets_by_size, supports_by_size, itemsets, supports)
+    classes = list(split_into_classes(itemsets, tids, tid_offsets))[::-1]
+
+    while len(classes) > 0:
+        itemsets, tids, tid_offsets = classes.pop()
+
+        if itemsets.shape[1] >= max_itemset_size:
+            continue
+
+        first, second = get_run_pairs(np.zeros(len(itemsets), dtype=np.int8))
+        candidate_ids, supports, tids, tid_offsets = count_supports(first, second, tids, tid_offsets, min_support)
+        itemsets = np.hstack([itemsets[first[candidate_ids]], itemsets[second[candidate_ids]][:, -1:]])
+        add_itemsets(itemsets_by_size, supports_by_size, itemsets, supports)
+        classes.extend(list(split_into_classes(itemsets, tids, tid_offsets))[::-1])
+
+    return sort_levels(itemsets_by_size, supports_by_size)
+
+
+def get_transactions(num_items, tids, tid_offsets):
+    # Turns the TID lists back into the (sorted) frequent actors of every movie, merging identical casts
+    items = np.repeat(np.arange(num_items, dtype=np.int64), np.diff(tid_offsets))
+    order = np.lexsort((items, tids))
+    sorted_tids = tids[order]
+    sorted_items = items[order].tolist()
+    boundaries = np.flatnonzero(np.diff(sorted_tids)) + 1
+    transactions = {}
+
+    for start, end in zip([0] + boundaries.tolist(), boundaries.tolist() + [len(sorted_items)]):
+        transaction = tuple(sorted_items[start:end])
+        transactions[transaction] = transactions.get(transaction, 0) + 1
+
+    return list(transactions.items())
+
+
+def build_fp_tree(transactions, min_support):
+    # Nodes are lists of [item, count, parent, children]; the header table links every node of an item
+    item_supports = {}
+
+    for transaction, count in transactions:
+        for item in transaction:
+            item_supports[item] = item_supports.get(item, 0) + count
+
+    item_supports = dict((item, support) for item, support in item_supports.items() if support >= min_support)
+    root = [None, 0, None, {}]
+    header = {}
+
+    for transaction, count in transactions:
+        node = root
+
+        for item in sorted((item for item in transaction if item in item_supports),
+                           key=lambda item: (-item_supports[item], item)):
+            child = node[3].get(item)
+
+            if child is None:
+                child = [item, 0, node, {}]
+                node[3][item] = child
+                header.setdefault(item, []).append(child)
+
+            child[1] += count
+            node = child
+
+    return header, item_supports
+
+
+def mine_fp_tree(header, item_supports, prefix, min_support, max_itemset_size, itemsets_by_size):
+    for item in sorted(item_supports, key=lambda item: (item_supports[item], item)):
+        itemset = prefix + [item]
+        itemsets_by_size.setdefault(len(itemset), []).append((sorted(itemset), item_supports[item]))
+
+        if len(itemset) >= max_itemset_size:
+            continue
+
+        conditional_transactions = []
+
+        for node in header[item]:
+            path = []
+            parent = node[2]
+
+            while parent[0] is not None:
+                path.append(parent[0])
+                parent = parent[2]
+
+            if len(path) > 0:
+                conditional_transactions.append((path, node[1]))
+
+        conditional_header, conditional_supports = build_fp_tree(conditional_transactions, min_support)
+
+        if len(conditional_supports) > 0:
+            mine_fp_tree(conditional_header, conditional_supports, itemset, min_support, max_itemset_size,
+                         itemsets_by_size)
+
+
+def fp_growth_levels(num_items, tids, tid_offsets, min_support, max_itemset_size):
+    header, item_supports = build_fp_tree(get_transactions(num_items, tids, tid_offsets), min_support)
+    found_by_size = {}
+    mine_fp_tree(header, item_supports, [], min_support, max_itemset_size, found_by_size)
+
+    itemsets_by_size = dict((size, [np.array([itemset for itemset, _ in found], dtype=np.int64)])
+                            for size, found in found_by_size.items())
+    supports_by_size = dict((size, [np.array([support for _, support in found], dtype=np.int64)])
+                            for size, found in found_by_size.items())
+
+    return sort_levels(itemsets_by_size, supports_by_size)
+
+
+algorithms = {
+    'apriori': apriori_levels,
+    'eclat': eclat_levels,
+    'fp-growth': fp_growth_levels
+}
+
+
+# Only the level-wise miner has levels large enough to be worth sharding across processes
+parallel_algorithms = {'apriori'}
+
+
+def mine_baskets(baskets, min_support, max_itemset_size, algorithm='apriori', workers=1):
+    actor_ids, _, tids, tid_offsets = baskets
+
+    if algorithm in parallel_algorithms:
+        levels = algorithms[algorithm](len(actor_ids), tids, tid_offsets, min_support, max_itemset_size, workers)
+    else:
+        levels = algorithms[algorithm](len(actor_ids), tids, tid_offsets, min_support, max_itemset_size)
+
+    for itemsets, supports in profiling.iter_stages(levels, 'mine level {}', 'mine', lambda level: len(level[1])):
+        yield actor_ids[itemsets], supports
+
+
+def mine_levels(movies_by_actors, min_support, max_itemset_size, algorithm='apriori', workers=1):
+    return mine_baskets(encode_movies_by_actors(movies_by_actors, min_support), min_support, max_itemset_size,
+                        algorithm, workers)
+
+
+def get_frequent_itemsets(movies_by_actors, min_support, max_itemset_size, algorithm='apriori', workers=1):
+    return [level.tolist() for level, _ in mine_levels(movies_by_actors, min_support, max_itemset_size, algorithm,
+                                                       workers)]
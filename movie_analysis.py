@@ -0,0 +1,103 @@
+# One entry point for all the analysis scripts: python3 movie_analysis.py [options] <subcommand> [arguments]
+#
+# The options before the subcommand configure the process once: the MongoDB client every subcommand shares (see
+# data_access.get_client), where the plots go, and the profiling of the run (see profiling.py). The module of a
+# subcommand is only imported once it is picked, so for instance rating-stats never loads matplotlib or pandas; the
+# arguments after the subcommand are parsed by the script itself, exactly as when it is run on its own.
+
+import importlib
+import sys
+
+import plots
+import profiling
+from data_access import client_settings, pop_flag, pop_positive_int_option, pop_string_option
+
+subcommands = {
+    'merge-datasets': 'merge_datasets',
+    'create-indexes': 'create_indexes',
+    'rating-stats': 'rating_stats',
+    'frequent-itemsets': 'frequent_itemset_mining',
+    'analyze-frequent-itemsets': 'analyze_frequent_itemsets',
+    'association-rules': 'association_rules',
+    'coactor-index': 'coactor_index',
+    'clustering': 'clustering',
+    'average-rating-per-user': 'average_rating_per_user',
+    'movies-per-genre': 'movies_per_genre',
+    'movies-per-year': 'movies_per_year',
+    'movie-overview': 'movie_overview',
+    'pairwise-comparison': 'pairwise_comparison',
+    'generate-datasets': 'generate_datasets'
+}
+value_options = ['--mongodb', '--max-pool-size', '--output', '--profile', '--trace', '--cprofile']
+flag_options = ['--explain']
+
+
+def print_usage():
+    print("Usage: python3 movie_analysis.py [--mongodb <MongoDB connection string>] [--max-pool-size <connections>]"
+          " [--output <directory>] [--profile <report file>] [--trace <trace file>] [--cprofile <directory>]"
+          " [--explain] <subcommand> [arguments of the subcommand]")
+    print("Subcommands: {}".format(', '.join(subcommands)))
+
+
+def get_subcommand_index(argv):
+    # The first argument after our options and their values, which can be named like a subcommand
+    index = 1
+
+    while index < len(argv) and argv[index] in value_options + flag_options:
+        index += 2 if argv[index] in value_options else 1
+
+    return index
+
+
+def parse_argv(argv):
+    subcommand_index = get_subcommand_index(argv)
+
+    if subcommand_index >= len(argv) or argv[subcommand_index] not in subcommands:
+        print_usage()
+        sys.exit(1)
+
+    # Only the options before the subcommand are ours; the rest belong to the subcommand, which may take options
+    # of the same name
+    argv, subcommand_argv = list(argv[:subcommand_index]), argv[subcommand_index:]
+    options = {
+        'connection_string': pop_string_option(argv, '--mongodb', None),
+        'max_pool_size': pop_positive_int_option(argv, '--max-pool-size', None),
+        'output_dir': pop_string_option(argv, '--output', None),
+        'report_path': pop_string_option(argv, '--profile', None),
+        'trace_path': pop_string_option(argv, '--trace', None),
+        'cprofile_dir': pop_string_option(argv, '--cprofile', None),
+        'explain': pop_flag(argv, '--explain')
+    }
+
+    if len(argv) != 1:
+        print_usage()
+        sys.exit(1)
+
+    if options['explain'] and options['report_path'] is None and options['trace_path'] is None:
+        print("--explain needs a report or a trace to record the execution times in, given with --profile or --trace")
+        sys.exit(1)
+
+    return subcommand_argv[0], subcommand_argv[1:], options
+
+
+def main():
+    subcommand, arguments, options = parse_argv(sys.argv)
+
+    client_settings['connection_string'] = options['connection_string']
+    client_settings['max_pool_size'] = options['max_pool_size']
+    plots.set_output_dir(options['output_dir'])
+
+    profiling.configure(options['report_path'], options['trace_path'], options['cprofile_dir'], options['explain'])
+
+    module = importlib.import_module(subcommands[subcommand])
+    sys.argv = [module.__name__ + '.py'] + arguments
+
+    # A run that fails or exits early still writes the stages it went through
+    try:
+        module.main()
+    finally:
+        profiling.write_report([subcommand] + arguments)
+
+
+if __name__ == '__main__':
+    main()
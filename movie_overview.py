@@ -0,0 +1,112 @@
+# Plots the movies per genre, the movies per year and the runtime of the movies against their year from a single
+# pass over the Movie collection
+#
+# movies_per_genre.py, movies_per_year.py and pairwise_comparison.py each scan the whole collection. Here the three
+# pipelines run as the branches of one $facet stage, so the server reads every movie once and sends back one document
+# holding all three results. The runtimes are counted in bins of years and minutes on the server, so the size of that
+# document depends on the number of bins, not on the number of movies.
+
+import sys
+
+import compact_schema
+from data_access import get_database, pop_parquet_dir, pop_positive_int_option, read_parquet_columns, run_aggregation
+from movies_per_genre import bar_graph_plot, movies_per_genre_query
+from movies_per_year import movies_per_year_query, time_series_plot
+from pairwise_comparison import count_grid_cells, get_grid_query, grid_plot, to_grid_documents
+
+default_runtime_bin_width = 10
+
+
+def parse_argv(argv):
+    argv = list(argv)
+    options = {
+        'parquet_dir': pop_parquet_dir(argv),
+        'runtime_bin_width': pop_positive_int_option(argv, '--runtime-bin-width', default_runtime_bin_width)
+    }
+
+    if len(argv) > 2:
+        print("Usage: python3 movie_overview.py [MongoDB connection string] [--parquet <directory>]"
+              " [--runtime-bin-width <minutes>]")
+        sys.exit(1)
+
+    return None if len(argv) == 1 else argv[1], options
+
+
+def get_movie_overview_query(runtime_bin_width):
+    # A $sort inside $facet cannot use the startYear index, and the groups come out unordered anyway
+    return [
+        {'$project': {'_id': 0, 'genres': 1, 'startYear': 1, 'runtimeMinutes': 1}},
+        {'$facet': {
+            'moviesPerGenre': movies_per_genre_query,
+            'moviesPerYear': [stage for stage in movies_per_year_query if '$sort' not in stage],
+            'runtimeByYear': get_grid_query('startYear', 'runtimeMinutes', 1, runtime_bin_width)
+        }}
+    ]
+
+
+def get_compact_movie_overview_query(runtime_bin_width):
+    # get_movie_overview_query on the compact collection: the genres are counted per mask, and the cells of the
+    # runtimes are keyed by the original field names
+    fields = compact_schema.compact_fields['Movie']
+    year_field, runtime_field = fields['startYear'], fields['runtimeMinutes']
+
+    return [
+        {'$project': {'_id': 0, fields['genres']: 1, year_field: 1, runtime_field: 1}},
+        {'$facet': {
+            'moviesPerMask': compact_schema.movies_per_mask_query,
+            'moviesPerYear': [stage for stage in compact_schema.movies_per_year_query if '$sort' not in stage],
+            'runtimeByYear': get_grid_query(year_field, runtime_field, 1, runtime_bin_width) + [
+                {'$project': {'_id': {'startYear': '$_id.' + year_field, 'runtimeMinutes': '$_id.' + runtime_field},
+                              'count': 1}}
+            ]
+        }}
+    ]
+
+
+def get_movie_overview(mongodb_connection_string, runtime_bin_width):
+    database = get_database(mongodb_connection_string)
+
+    # A compact load is read from the compact collection rather than through the view, which decodes every movie
+    if compact_schema.is_compact(database):
+        overview = run_aggregation(database[compact_schema.compact_collections['Movie']],
+                                   get_compact_movie_overview_query(runtime_bin_width), allowDiskUse=True)[0]
+        mask_counts = overview.pop('moviesPerMask')
+        overview['moviesPerGenre'] = compact_schema.count_movies_per_genre(compact_schema.load_encoder(database),
+                                                                           mask_counts)
+        return overview
+
+    return run_aggregation(database['Movie'], get_movie_overview_query(runtime_bin_width), allowDiskUse=True)[0]
+
+
+def get_movie_overview_from_parquet(parquet_dir, runtime_bin_width):
+    # The same document as the $facet query, from one read of the three columns
+    movies_df = read_parquet_columns(parquet_dir, 'Movie', ['genres', 'startYear', 'runtimeMinutes'])
+    genre_counts = movies_df['genres'].explode().value_counts()
+    year_counts = movies_df['startYear'].value_counts(dropna=False)
+    runtime_counts = count_grid_cells(movies_df, 'startYear', 'runtimeMinutes', 1, runtime_bin_width)
+
+    return {
+        'moviesPerGenre': [{'_id': genre, 'count': count} for genre, count in genre_counts.items()],
+        'moviesPerYear': [{'_id': None if year != year else int(year), 'count': count}
+                          for year, count in year_counts.items()],
+        'runtimeByYear': to_grid_documents(runtime_counts, 'startYear', 'runtimeMinutes')
+    }
+
+
+def main():
+    mongodb_connection_string, options = parse_argv(sys.argv)
+
+    if options['parquet_dir'] is None:
+        overview = get_movie_overview(mongodb_connection_string, options['runtime_bin_width'])
+    else:
+        overview = get_movie_overview_from_parquet(options['parquet_dir'], options['runtime_bin_width'])
+
+    bar_graph_plot(overview['moviesPerGenre'])
+    time_series_plot(overview['moviesPerYear'])
+    grid_plot(overview['runtimeByYear'], 'startYear', 'runtimeMinutes', 1, options['runtime_bin_width'],
+              "Runtime minutes w.r.t. Years released", "Year",
+              "Runtime minutes ({}-minute bins)".format(options['runtime_bin_width']), 'runtime_by_year_bins')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,85 @@
 # Plots a bar graph showing the total number of movies in each genre
 
-import matplotlib.pyplot as matplot
-from pymongo import MongoClient
+import sys
+
+import compact_schema
+import plots
+import sketches
+from data_access import get_database, iter_columns, pop_flag, pop_parquet_dir, read_parquet_columns, run_aggregation
+
+
+movies_per_genre_query = [
+    {"$unwind": "$genres"},
+    {"$group": {"_id": "$genres", "count": {"$sum": 1}}}
+]
+
+
+def parse_argv(argv):
+    argv = list(argv)
+    options = {
+        'parquet_dir': pop_parquet_dir(argv),
+        'sketch': pop_flag(argv, '--sketch')
+    }
+
+    if len(argv) > 2:
+        print("Usage: python3 movies_per_genre.py [MongoDB connection string] [--parquet <directory>] [--sketch]")
+        sys.exit(1)
+
+    return None if len(argv) == 1 else argv[1], options
 
 
 def main():
-    query = [
-        {"$unwind": "$genres"},
-        {"$group": {"_id": "$genres", "count": {"$sum": 1}}}
-    ]
-    result = list(movies.aggregate(query))
+    mongodb_connection_string, options = parse_argv(sys.argv)
+    parquet_dir = options['parquet_dir']
+
+    if options['sketch']:
+        result = get_result_from_sketch(mongodb_connection_string, parquet_dir)
+    elif parquet_dir is None:
+        result = get_result_from_mongodb(mongodb_connection_string)
+    else:
+        result = get_result_from_parquet(parquet_dir)
+
     bar_graph_plot(result)
 
 
+def get_result_from_mongodb(mongodb_connection_string):
+    database = get_database(mongodb_connection_string)
+
+    # A compact load is counted per combination of genres, instead of decoding the genres of every movie in the view
+    if compact_schema.is_compact(database):
+        movies = database[compact_schema.compact_collections['Movie']]
+        return compact_schema.count_movies_per_genre(compact_schema.load_encoder(database),
+                                                     run_aggregation(movies, compact_schema.movies_per_mask_query))
+
+    return run_aggregation(database['Movie'], movies_per_genre_query)
+
+
+def get_result_from_parquet(parquet_dir):
+    movies_df = read_parquet_columns(parquet_dir, 'Movie', ['genres'])
+    genre_counts = movies_df['genres'].explode().value_counts()
+
+    return [{'_id': genre, 'count': count} for genre, count in genre_counts.items()]
+
+
+def get_result_from_sketch(mongodb_connection_string, parquet_dir):
+    # The genres are counted in a count-min sketch while the movies stream by, so memory does not grow with the
+    # number of movies; only the handful of distinct genres is kept to look their counts up afterwards
+    sketch = sketches.new_count_min()
+    genres = set()
+
+    for movies_df in iter_columns('Movie', ['genres'], parquet_dir, mongodb_connection_string):
+        movie_genres = movies_df['genres'].explode().dropna().to_numpy()
+        sketches.update_count_min(sketch, movie_genres)
+        genres.update(movie_genres)
+
+    genres = sorted(genres)
+    counts = sketches.estimate_counts(sketch, genres)
+
+    return [{'_id': genre, 'count': int(count)} for genre, count in zip(genres, counts)]
+
+
 def bar_graph_plot(result):
+    matplot = plots.get_pyplot()
     genres = []
     total = []
     for r in result:
@@ -26,12 +92,9 @@ def bar_graph_plot(result):
     matplot.bar(genres, total)
     matplot.xlabel("Genre")
     matplot.ylabel("Total number of movies")
-    matplot.show()
+    plots.show('movies_per_genre', result)
     print("Finished plotting bar graph")
 
 
 if __name__ == '__main__':
-    client = MongoClient()
-    db = client['MapReduce']
-    movies = db['Movie']
     main()
@@ -1,18 +1,99 @@
 # plotting a time series graph showing the total number of movies released per year
 
-import matplotlib.pyplot as matplot
-from pymongo import MongoClient
+import sys
+
+import compact_schema
+import plots
+import sketches
+from data_access import get_database, iter_columns, pop_flag, pop_parquet_dir, read_parquet_columns, run_aggregation
+
+# One histogram bin per year; years outside the range are only counted as below or above it
+first_year, last_year = 1870, 2040
+
+
+movies_per_year_query = [
+    {"$sort": {"startYear": 1}},
+    {"$group": {"_id": "$startYear", "count": {"$sum": 1}}}
+]
+
+
+def parse_argv(argv):
+    argv = list(argv)
+    options = {
+        'parquet_dir': pop_parquet_dir(argv),
+        'sketch': pop_flag(argv, '--sketch')
+    }
+
+    if len(argv) > 2:
+        print("Usage: python3 movies_per_year.py [MongoDB connection string] [--parquet <directory>] [--sketch]")
+        sys.exit(1)
+
+    return None if len(argv) == 1 else argv[1], options
 
 
 def main():
-    query = [
-        {"$group": {"_id": "$startYear", "count": {"$sum": 1}}}
-    ]
-    result = list(movies.aggregate(query))
+    mongodb_connection_string, options = parse_argv(sys.argv)
+    parquet_dir = options['parquet_dir']
+
+    if options['sketch']:
+        result = get_result_from_sketch(mongodb_connection_string, parquet_dir)
+    elif parquet_dir is None:
+        result = get_result_from_mongodb(mongodb_connection_string)
+    else:
+        result = get_result_from_parquet(parquet_dir)
+
     time_series_plot(result)
 
 
+def get_result_from_mongodb(mongodb_connection_string):
+    database = get_database(mongodb_connection_string)
+
+    # A compact load is grouped on the years of the compact collection, with its index, rather than through the view
+    if compact_schema.is_compact(database):
+        return run_aggregation(database[compact_schema.compact_collections['Movie']],
+                               compact_schema.movies_per_year_query, allowDiskUse=True)
+
+    return run_aggregation(database['Movie'], movies_per_year_query, allowDiskUse=True)
+
+
+def iter_years(mongodb_connection_string, parquet_dir):
+    # DataFrames of startYear; a compact load is read on its year field rather than through the view
+    if parquet_dir is None and compact_schema.is_compact(get_database(mongodb_connection_string)):
+        year_field = compact_schema.compact_fields['Movie']['startYear']
+
+        for movies_df in iter_columns(compact_schema.compact_collections['Movie'], [year_field], None,
+                                      mongodb_connection_string):
+            yield movies_df.rename(columns={year_field: 'startYear'})
+
+        return
+
+    yield from iter_columns('Movie', ['startYear'], parquet_dir, mongodb_connection_string)
+
+
+def get_result_from_parquet(parquet_dir):
+    movies_df = read_parquet_columns(parquet_dir, 'Movie', ['startYear'])
+    year_counts = movies_df['startYear'].value_counts(dropna=False)
+
+    return [{'_id': None if year != year else int(year), 'count': count} for year, count in year_counts.items()]
+
+
+def get_result_from_sketch(mongodb_connection_string, parquet_dir):
+    # One bin per year; a year past last_year is not counted in the bin of last_year, but left out
+    histogram = sketches.new_histogram(first_year, last_year + 1, last_year + 1 - first_year, include_high=False)
+
+    for movies_df in iter_years(mongodb_connection_string, parquet_dir):
+        sketches.update_histogram(histogram, movies_df['startYear'].to_numpy(dtype=float, na_value=float('nan')))
+
+    if histogram['below'] + histogram['above'] > 0:
+        print("{} movies with a start year outside {}-{} left out".format(histogram['below'] + histogram['above'],
+                                                                          first_year, last_year))
+
+    return [{'_id': int(year), 'count': int(count)} for year, count in
+            zip(sketches.get_bin_edges(histogram)[:-1], histogram['counts']) if count > 0]
+
+
 def time_series_plot(result):
+    matplot = plots.get_pyplot()
     x = []
     y = []
     for r in result:
@@ -28,11 +109,8 @@ def time_series_plot(result):
     matplot.plot(x, y)
     matplot.xlabel("Start Year of the movie")
     matplot.ylabel("Total number of movies")
-    matplot.show()
+    plots.show('movies_per_year', new_list)
 
 
 if __name__ == '__main__':
-    client = MongoClient()
-    db = client['MapReduce']
-    movies = db['Movie']
     main()
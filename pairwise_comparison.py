@@ -1,40 +1,160 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-from pymongo import MongoClient
-
-connection = MongoClient()
-
-db = connection.MapReduce
-movies = db.Movie
-movies_df = pd.DataFrame(list(movies.find()))
-
-movies_df_subset = movies_df[["runtimeMinutes", "startYear"]]
-
-plt.figure(figsize=(10, 8))
-plt.scatter(movies_df_subset["startYear"], movies_df_subset["runtimeMinutes"])
-plt.title("Runtime minutes w.r.t. Years released")
-plt.ylabel("Runtime minutes")
-plt.xlabel("Year")
-plt.show()
-
-movies_df_subset = movies_df_subset.sample(n=1000, random_state=100)
-plt.figure(figsize=(10, 8))
-plt.scatter(movies_df_subset["startYear"], movies_df_subset["runtimeMinutes"], color="orange")
-plt.title("Runtime minutes w.r.t. Years released")
-plt.xlabel("Year")
-plt.ylabel("Runtime minutes")
-plt.show()
-
-db = connection.MapReduce
-persons = db.Person
-person_df = pd.DataFrame(list(persons.find()))
-person_df_subset = person_df[["birthYear", "deathYear"]]
-
-person_df_subset = person_df_subset.sample(n=1000, random_state=7)
-
-plt.figure(figsize=(10, 8))
-plt.scatter(person_df_subset["birthYear"], person_df_subset["deathYear"], color="green")
-plt.title("Birthyear v/s Deathyear of Persons")
-plt.xlabel("BirthYear")
-plt.ylabel("DeathYear")
-plt.show()
+import sys
+
+import numpy as np
+
+import plots
+from data_access import get_database, iter_parquet_parts, pop_flag, pop_parquet_dir, pop_positive_int_option, \
+    read_columns, run_aggregation, sample_columns
+
+default_runtime_bin_width = 5
+
+
+def parse_argv(argv):
+    argv = list(argv)
+    options = {
+        'parquet_dir': pop_parquet_dir(argv),
+        # With --sketch, only uniform samples are read, drawn on the server or by reservoir sampling over the
+        # cache, instead of every movie and person
+        'sketch': pop_flag(argv, '--sketch'),
+        # With --bins, the points are counted in cells of a grid where they are stored, and only the counts are read
+        'bins': pop_flag(argv, '--bins'),
+        'runtime_bin_width': pop_positive_int_option(argv, '--runtime-bin-width', default_runtime_bin_width)
+    }
+
+    if len(argv) > 2:
+        print("Usage: python3 pairwise_comparison.py [MongoDB connection string] [--parquet <directory>]"
+              " [--sketch | --bins [--runtime-bin-width <minutes>]]")
+        sys.exit(1)
+
+    if options['sketch'] and options['bins']:
+        print("--sketch and --bins cannot be used together")
+        sys.exit(1)
+
+    return None if len(argv) == 1 else argv[1], options
+
+
+def get_movies_df(mongodb_connection_string, parquet_dir, sketch):
+    if sketch:
+        return sample_columns("Movie", ["runtimeMinutes", "startYear"], 10000, parquet_dir, mongodb_connection_string,
+                              seed=100)
+
+    return read_columns("Movie", ["runtimeMinutes", "startYear"], parquet_dir, mongodb_connection_string)
+
+
+def get_person_df(mongodb_connection_string, parquet_dir, sketch):
+    if sketch:
+        return sample_columns("Person", ["birthYear", "deathYear"], 1000, parquet_dir, mongodb_connection_string,
+                              seed=7)
+
+    person_df_subset = read_columns("Person", ["birthYear", "deathYear"], parquet_dir, mongodb_connection_string)
+    return person_df_subset.sample(n=1000, random_state=7)
+
+
+def get_bin_expression(field, bin_width):
+    return {'$multiply': [{'$floor': {'$divide': ['$' + field, bin_width]}}, bin_width]}
+
+
+def get_grid_query(x_field, y_field, x_bin_width, y_bin_width):
+    # Counts the documents that have both fields in cells of x_bin_width by y_bin_width, keyed by the lower corner of
+    # their cell. The $project makes the server fetch the two fields only.
+    return [
+        {'$project': {'_id': 0, x_field: 1, y_field: 1}},
+        {'$match': {x_field: {'$ne': None}, y_field: {'$ne': None}}},
+        {'$group': {'_id': {x_field: get_bin_expression(x_field, x_bin_width),
+                            y_field: get_bin_expression(y_field, y_bin_width)},
+                    'count': {'$sum': 1}}}
+    ]
+
+
+def count_grid_cells(df, x_field, y_field, x_bin_width, y_bin_width):
+    df = df[[x_field, y_field]].dropna()
+    return df.groupby([(df[x_field] // x_bin_width) * x_bin_width, (df[y_field] // y_bin_width) * y_bin_width]).size()
+
+
+def to_grid_documents(cell_counts, x_field, y_field):
+    # The documents the grid query returns
+    return [{'_id': {x_field: int(x), y_field: int(y)}, 'count': int(count)} for (x, y), count in cell_counts.items()]
+
+
+def get_grid(collection_name, x_field, y_field, x_bin_width, y_bin_width, parquet_dir=None,
+             mongodb_connection_string=None):
+    if parquet_dir is None:
+        collection = get_database(mongodb_connection_string)[collection_name]
+        return run_aggregation(collection, get_grid_query(x_field, y_field, x_bin_width, y_bin_width),
+                               allowDiskUse=True)
+
+    import pandas as pd
+
+    # One part of the cache at a time; only the counts of the cells are kept from one part to the next
+    cell_counts = pd.concat([count_grid_cells(df, x_field, y_field, x_bin_width, y_bin_width)
+                             for df in iter_parquet_parts(parquet_dir, collection_name, [x_field, y_field])])
+
+    return to_grid_documents(cell_counts.groupby(level=[0, 1]).sum(), x_field, y_field)
+
+
+def scatter_plot(x, y, title, xlabel, ylabel, name, color=None):
+    plt = plots.get_pyplot()
+
+    plt.figure(figsize=(10, 8))
+    plt.scatter(x, y, color=color)
+    plt.title(title)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    plots.show(name, {xlabel: x, ylabel: y})
+
+
+def grid_plot(grid, x_field, y_field, x_bin_width, y_bin_width, title, xlabel, ylabel, name):
+    # A heatmap of the counts of the cells, on a log scale; drawing it costs as much as the number of cells
+    plt = plots.get_pyplot()
+
+    if len(grid) == 0:
+        print("Nothing to plot for {}: no document has both a {} and a {}".format(name, x_field, y_field))
+        return
+
+    from matplotlib.colors import LogNorm
+
+    x = np.array([document['_id'][x_field] for document in grid], dtype=np.float64)
+    y = np.array([document['_id'][y_field] for document in grid], dtype=np.float64)
+    counts = np.array([document['count'] for document in grid], dtype=np.float64)
+    x_edges = np.arange(x.min(), x.max() + 2 * x_bin_width, x_bin_width)
+    y_edges = np.arange(y.min(), y.max() + 2 * y_bin_width, y_bin_width)
+
+    plt.figure(figsize=(10, 8))
+    plt.hist2d(x, y, bins=[x_edges, y_edges], weights=counts, norm=LogNorm(), cmin=1)
+    plt.colorbar(label="Count")
+    plt.title(title)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    plots.show(name, grid)
+
+
+def main():
+    mongodb_connection_string, options = parse_argv(sys.argv)
+
+    if options['bins']:
+        runtime_bin_width = options['runtime_bin_width']
+        grid_plot(get_grid("Movie", "startYear", "runtimeMinutes", 1, runtime_bin_width, options['parquet_dir'],
+                           mongodb_connection_string), "startYear", "runtimeMinutes", 1, runtime_bin_width,
+                  "Runtime minutes w.r.t. Years released", "Year",
+                  "Runtime minutes ({}-minute bins)".format(runtime_bin_width), 'runtime_by_year_bins')
+        grid_plot(get_grid("Person", "birthYear", "deathYear", 1, 1, options['parquet_dir'],
+                           mongodb_connection_string), "birthYear", "deathYear", 1, 1,
+                  "Birthyear v/s Deathyear of Persons", "BirthYear", "DeathYear", 'death_year_by_birth_year_bins')
+        return
+
+    movies_df_subset = get_movies_df(mongodb_connection_string, options['parquet_dir'], options['sketch'])
+    scatter_plot(movies_df_subset["startYear"], movies_df_subset["runtimeMinutes"],
+                 "Runtime minutes w.r.t. Years released", "Year", "Runtime minutes", 'runtime_by_year')
+
+    movies_df_subset = movies_df_subset.sample(n=min(1000, len(movies_df_subset)), random_state=100)
+    scatter_plot(movies_df_subset["startYear"], movies_df_subset["runtimeMinutes"],
+                 "Runtime minutes w.r.t. Years released", "Year", "Runtime minutes", 'runtime_by_year_sample',
+                 color="orange")
+
+    person_df_subset = get_person_df(mongodb_connection_string, options['parquet_dir'], options['sketch'])
+    scatter_plot(person_df_subset["birthYear"], person_df_subset["deathYear"], "Birthyear v/s Deathyear of Persons",
+                 "BirthYear", "DeathYear", 'death_year_by_birth_year', color="green")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# Where the plots of the scripts go: a window by default or, once an output directory is set (movie_analysis.py
+# --output), a PNG file per plot along with the data it was drawn from as JSON, for headless and scheduled runs
+#
+# matplotlib is only imported when the first plot is drawn, so scripts and subcommands that plot nothing never load it.
+
+import json
+import math
+from os import makedirs
+from os.path import join
+
+import profiling
+
+output_settings = {'directory': None}
+
+
+def set_output_dir(output_dir):
+    output_settings['directory'] = output_dir
+
+
+def get_pyplot():
+    import matplotlib
+
+    # Without a display, and before pyplot picks an interactive backend
+    if output_settings['directory'] is not None:
+        matplotlib.use('Agg')
+
+    import matplotlib.pyplot as plt
+
+    return plt
+
+
+def to_json(value):
+    # NumPy arrays and scalars, and pandas series, as plain lists and numbers; NaN and infinite numbers, which JSON
+    # cannot represent, become null
+    if hasattr(value, 'tolist'):
+        value = value.tolist()
+
+    if isinstance(value, dict):
+        return dict((to_json(key), to_json(item)) for key, item in value.items())
+
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+
+    if value is None or isinstance(value, (str, int)):
+        return value
+
+    raise TypeError("Cannot write a {} as JSON".format(type(value).__name__))
+
+
+def show(name, data=None):
+    plt = get_pyplot()
+
+    if output_settings['directory'] is None:
+        plt.show()
+        return
+
+    makedirs(output_settings['directory'], exist_ok=True)
+
+    # matplotlib draws the figure when it is saved, so this is where the time of a plot goes
+    with profiling.stage('plot ' + name, 'plot'):
+        plt.savefig(join(output_settings['directory'], name + '.png'), bbox_inches='tight')
+        plt.close('all')
+
+    if data is not None:
+        with open(join(output_settings['directory'], name + '.json'), 'w') as file:
+            json.dump(to_json(data), file, allow_nan=False)
+
+    print("Saved {} to {}".format(name, output_settings['directory']))
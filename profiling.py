@@ -0,0 +1,254 @@
+# Stage-level profiling of a run: where the time, the rows and the memory went, stage by stage
+#
+# The scripts wrap their stages (reading, transforming, inserting, aggregating, mining a level, a k-means run,
+# plotting) in stage(), which records the wall time, the rows the stage handled and the peak resident memory of the
+# process when it ended. A stage that runs against a MongoDB collection also records the time the server spent on it,
+# from the difference of the top command before and after, and the size of the collection from $collStats; with
+# explain, an aggregation is run again under explain to record the execution time the planner reports. Stages nest,
+# and stages of the writer threads of bulk_writer.py are recorded per thread.
+#
+# Profiling is off unless movie_analysis.py is given --profile, --trace or --cprofile; then a stage costs a few
+# microseconds. The report is one JSON file per run, optionally with a Chrome trace (chrome://tracing or Perfetto),
+# and --cprofile saves a cProfile of every stage that starts while no other stage is being profiled: only one profiler
+# can run at a time, so the stages inside a profiled stage, or of other threads meanwhile, are part of its profile or
+# of none.
+
+import contextlib
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from os import makedirs
+from os.path import join
+
+profile_settings = {'report_path': None, 'trace_path': None, 'cprofile_dir': None, 'explain': False}
+run_state = {'stages': [], 'start_time': None, 'profiler_active': False, 'collection_stats': {}, 'threads': {}}
+run_lock = threading.Lock()
+thread_state = threading.local()
+
+
+def configure(report_path=None, trace_path=None, cprofile_dir=None, explain=False):
+    profile_settings.update({'report_path': report_path, 'trace_path': trace_path, 'cprofile_dir': cprofile_dir,
+                             'explain': explain})
+    run_state.update({'stages': [], 'start_time': time.perf_counter(), 'profiler_active': False,
+                      'collection_stats': {}, 'threads': {}})
+
+
+def is_enabled():
+    return run_state['start_time'] is not None and (profile_settings['report_path'] is not None or
+                                                    profile_settings['trace_path'] is not None or
+                                                    profile_settings['cprofile_dir'] is not None)
+
+
+def get_peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    # Kilobytes on Linux, bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / (1 << 20) if sys.platform == 'darwin' else peak_rss / 1024
+
+
+def get_thread_number():
+    # Small numbers instead of thread identifiers, in the order the threads first recorded a stage
+    with run_lock:
+        return run_state['threads'].setdefault(threading.get_ident(), len(run_state['threads']))
+
+
+def get_server_time_ms(collection):
+    # Milliseconds the server has spent on the collection since it started. top needs the clusterMonitor role and is
+    # not served by mongos or mongomock, in which case there is no server time.
+    try:
+        totals = collection.database.client.admin.command('top')['totals']
+        return totals[collection.full_name]['total']['time'] / 1000
+    except Exception:
+        return None
+
+
+def get_collection_stats(collection):
+    # Read once per collection and run, since the stages of a run mostly read collections they do not change
+    if collection.full_name not in run_state['collection_stats']:
+        try:
+            storage_stats = next(collection.aggregate([{'$collStats': {'storageStats': {}}}]))['storageStats']
+            run_state['collection_stats'][collection.full_name] = {
+                'documents': storage_stats['count'], 'sizeBytes': storage_stats['size'],
+                'storageBytes': storage_stats['storageSize']}
+        except Exception:
+            run_state['collection_stats'][collection.full_name] = {}
+
+    return run_state['collection_stats'][collection.full_name]
+
+
+def find_execution_times(explanation):
+    # The execution times of the stages of an explanation, wherever the server version puts them
+    if isinstance(explanation, dict):
+        for key, value in explanation.items():
+            if key in ['executionTimeMillis', 'executionTimeMillisEstimate'] and isinstance(value, (int, float)):
+                yield value
+            else:
+                yield from find_execution_times(value)
+    elif isinstance(explanation, list):
+        for value in explanation:
+            yield from find_execution_times(value)
+
+
+def explain_aggregation(collection, pipeline):
+    try:
+        explanation = collection.database.command('explain', {'aggregate': collection.name, 'pipeline': pipeline,
+                                                              'cursor': {}}, verbosity='executionStats')
+        return {'explainMs': max(find_execution_times(explanation), default=None)}
+    except Exception as error:
+        return {'explainError': str(error)}
+
+
+def get_profile_path(stage_number, name):
+    makedirs(profile_settings['cprofile_dir'], exist_ok=True)
+    return join(profile_settings['cprofile_dir'], '{:04d}-{}.prof'.format(stage_number, re.sub(r'\W+', '_', name)))
+
+
+@contextlib.contextmanager
+def stage(name, category, collection=None, pipeline=None):
+    # Yields the record of the stage, to which the stage adds the rows it handled as record['rows'] and anything else
+    # worth reporting
+    if not is_enabled():
+        yield {}
+        return
+
+    record = {'name': name, 'category': category, 'thread': get_thread_number(), 'rows': None}
+    depth = getattr(thread_state, 'depth', 0)
+    thread_state.depth = depth + 1
+    server_time_ms = None if collection is None else get_server_time_ms(collection)
+    profiler = None
+
+    with run_lock:
+        stage_number = len(run_state['stages'])
+        run_state['stages'].append(record)
+
+        if profile_settings['cprofile_dir'] is not None and not run_state['profiler_active']:
+            import cProfile
+
+            run_state['profiler_active'] = True
+            profiler = cProfile.Profile()
+
+    peak_rss_mb = get_peak_rss_mb()
+    start_time = time.perf_counter()
+
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        yield record
+    except BaseException as error:
+        record['error'] = '{}: {}'.format(type(error).__name__, error)
+        raise
+    finally:
+        end_time = time.perf_counter()
+
+        if profiler is not None:
+            profiler.disable()
+            record['profile'] = get_profile_path(stage_number, name)
+            profiler.dump_stats(record['profile'])
+            run_state['profiler_active'] = False
+
+        thread_state.depth = depth
+        record.update({'depth': depth, 'start': start_time - run_state['start_time'],
+                       'seconds': end_time - start_time, 'peakRssMb': get_peak_rss_mb()})
+
+        if peak_rss_mb is not None:
+            record['rssGrowthMb'] = record['peakRssMb'] - peak_rss_mb
+
+        if collection is not None:
+            record['collection'] = collection.name
+            record.update(get_collection_stats(collection))
+
+            if server_time_ms is not None:
+                end_server_time_ms = get_server_time_ms(collection)
+                record['serverMs'] = None if end_server_time_ms is None else end_server_time_ms - server_time_ms
+
+            if pipeline is not None and profile_settings['explain'] and 'error' not in record:
+                record.update(explain_aggregation(collection, pipeline))
+
+
+def run_stage(name, category, function, *args, count_rows=len):
+    # function(*args) as a stage, with the length of what it returns, or count_rows of it, as its rows
+    with stage(name, category) as record:
+        result = function(*args)
+        record['rows'] = count_rows(result)
+
+    return result
+
+
+def iter_stages(items, name, category, count_rows=len):
+    # Records the production of every item of an iterator as a stage of its own; name is formatted with the number of
+    # the item, from 1. The last stage is the call that found the iterator exhausted.
+    if not is_enabled():
+        return items
+
+    return generate_stages(iter(items), name, category, count_rows)
+
+
+def generate_stages(items, name, category, count_rows):
+    for number in itertools.count(1):
+        with stage(name.format(number), category) as record:
+            item = next(items, None)
+            record['rows'] = 0 if item is None else count_rows(item)
+
+        if item is None:
+            return
+
+        yield item
+
+
+def get_totals(stages, key):
+    totals = {}
+
+    for record in stages:
+        total = totals.setdefault(record[key], {'stages': 0, 'seconds': 0.0, 'rows': 0})
+        total['stages'] += 1
+        total['seconds'] += record.get('seconds', 0.0)
+        total['rows'] += record['rows'] or 0
+
+    return totals
+
+
+def get_trace_events(stages):
+    # Complete events of the Trace Event Format, in microseconds
+    pid = os.getpid()
+
+    return [{'name': record['name'], 'cat': record['category'], 'ph': 'X', 'pid': pid, 'tid': record['thread'],
+             'ts': record['start'] * 1e6, 'dur': record['seconds'] * 1e6,
+             'args': dict((key, value) for key, value in record.items()
+                          if key not in ['name', 'category', 'thread', 'start', 'seconds'])}
+            for record in stages if 'seconds' in record]
+
+
+def write_report(command):
+    if not is_enabled():
+        return
+
+    stages = run_state['stages']
+    report = {
+        'command': command,
+        'seconds': time.perf_counter() - run_state['start_time'],
+        'peakRssMb': get_peak_rss_mb(),
+        # Stages nest, so the totals of a category can include the time of the stages inside its stages
+        'totalsByCategory': get_totals(stages, 'category'),
+        'stages': stages
+    }
+
+    if profile_settings['report_path'] is not None:
+        with open(profile_settings['report_path'], 'w') as file:
+            json.dump(report, file, indent=2)
+
+        print("Saved the profile of {} stages to {}".format(len(stages), profile_settings['report_path']))
+
+    if profile_settings['trace_path'] is not None:
+        with open(profile_settings['trace_path'], 'w') as file:
+            json.dump({'traceEvents': get_trace_events(stages), 'displayTimeUnit': 'ms'}, file)
+
+        print("Saved the trace to {}".format(profile_settings['trace_path']))
@@ -0,0 +1,248 @@
+# Maintains the per-movie and per-user rating aggregates (sum, count and sum of squares of the ratings) that the
+# analysis scripts read instead of aggregating the whole Ratings collection on every run
+#
+# The aggregates are materialized with $merge. A watermark stores the newest rating timestamp folded into each of
+# them, so a refresh only aggregates the ratings added since and adds their sums and counts to the stored ones. That
+# only holds while the ratings already folded stay as they are, so the watermark also stores a fingerprint of them:
+# their number, the links.csv fingerprint of the last incremental ingest (which remaps old ratings) and the _id of
+# the oldest rating (which a reload replaces). A refresh that finds any of them changed rebuilds the aggregates from
+# every rating. Ratings inserted after a refresh with the very timestamp the watermark stopped at are still missed.
+#
+# Every script that reads the aggregates refreshes them first, so several refreshes can run at once. A refresh claims
+# its range of timestamps by moving the watermark atomically, marked as refreshing until the ratings are merged, and
+# a refresh that finds the watermark moved or marked leaves the aggregates to the one that claimed them. Readers wait
+# for the mark to go instead of reading half-merged aggregates. A refresh that died while merging leaves the mark
+# behind: readers then stop with an error, and the aggregates are only refreshed again by --rebuild.
+
+import sys
+import time
+
+import numpy as np
+from pymongo.errors import DuplicateKeyError
+
+import profiling
+from data_access import get_database, run_aggregation
+
+stats_collections = {
+    'movieId': 'Movie_Rating_Stats',
+    'userId': 'User_Rating_Stats'
+}
+watermarks_collection = 'Rating_Stats_Watermarks'
+# Written by the incremental ingest of merge_datasets.py
+ingest_watermarks_collection = 'Ingest_Watermarks'
+ratings_file = 'ratings.csv'
+# How long a reader waits for the refresh of another run to finish
+refresh_wait_seconds = 60
+refresh_poll_seconds = 0.5
+
+
+def parse_argv(argv):
+    argv = list(argv)
+    rebuild = '--rebuild' in argv
+
+    if rebuild:
+        argv.remove('--rebuild')
+
+    if len(argv) > 2:
+        print("Usage: python3 rating_stats.py [MongoDB connection string] [--rebuild]")
+        sys.exit(1)
+
+    return None if len(argv) == 1 else argv[1], rebuild
+
+
+def get_rating_stats_query(key, collection_name, min_timestamp, max_timestamp):
+    timestamp_range = {'$lte': max_timestamp}
+
+    if min_timestamp is not None:
+        timestamp_range['$gt'] = min_timestamp
+
+    return [
+        {'$match': {'timestamp': timestamp_range}},
+        {'$group': {'_id': '$' + key, 'sum': {'$sum': '$rating'}, 'count': {'$sum': 1},
+                    'sumSquares': {'$sum': {'$multiply': ['$rating', '$rating']}}}},
+        {'$merge': {'into': collection_name, 'on': '_id', 'whenNotMatched': 'insert',
+                    'whenMatched': [{'$set': {'sum': {'$add': ['$sum', '$$new.sum']},
+                                              'count': {'$add': ['$count', '$$new.count']},
+                                              'sumSquares': {'$add': ['$sumSquares', '$$new.sumSquares']}}}]}}
+    ]
+
+
+def get_max_timestamp(database):
+    newest_rating = database['Ratings'].find_one({}, {'_id': 0, 'timestamp': 1}, sort=[('timestamp', -1)])
+    return None if newest_rating is None else newest_rating['timestamp']
+
+
+def get_ratings_fingerprint(database):
+    ingest_watermark = database[ingest_watermarks_collection].find_one({'_id': ratings_file}, {'links': 1})
+    oldest_rating = database['Ratings'].find_one({}, {'_id': 1}, sort=[('timestamp', 1), ('movieId', 1),
+                                                                        ('userId', 1)])
+    return {'links': None if ingest_watermark is None else ingest_watermark.get('links'),
+            'oldestRatingId': None if oldest_rating is None else oldest_rating['_id']}
+
+
+def ratings_changed(database, watermark, fingerprint):
+    # Whether the ratings up to the watermark are no longer the ones folded into the aggregates
+    if 'numRatings' not in watermark or any(watermark.get(key) != value for key, value in fingerprint.items()):
+        return True
+
+    if watermark['maxTimestamp'] is None:
+        return False
+
+    # The estimated count comes from the collection metadata and the newer ratings from the timestamp index, so the
+    # ratings are only counted one by one when the two disagree, or ratings were inserted between the two counts
+    ratings = database['Ratings']
+    num_newer = ratings.count_documents({'timestamp': {'$gt': watermark['maxTimestamp']}})
+
+    if ratings.estimated_document_count() - num_newer == watermark['numRatings']:
+        return False
+
+    return ratings.count_documents({'timestamp': {'$lte': watermark['maxTimestamp']}}) != watermark['numRatings']
+
+
+def count_new_ratings(database, min_timestamp, max_timestamp):
+    if max_timestamp is None:
+        return 0
+
+    timestamp_range = {'$lte': max_timestamp}
+
+    if min_timestamp is not None:
+        timestamp_range['$gt'] = min_timestamp
+
+    return database['Ratings'].count_documents({'timestamp': timestamp_range})
+
+
+def claim_refresh(database, collection_name, watermark, claim, rebuild):
+    # Replaces the watermark with the claim, marked as refreshing, and returns whether this refresh did so; it fails
+    # when another refresh claimed the range first
+    watermarks = database[watermarks_collection]
+    claim = dict(claim, refreshing=True)
+
+    if rebuild:
+        watermarks.replace_one({'_id': collection_name}, claim, upsert=True)
+        return True
+
+    if watermark is None:
+        try:
+            watermarks.insert_one(dict(claim, _id=collection_name))
+            return True
+        except DuplicateKeyError:
+            return False
+
+    return watermarks.find_one_and_replace({'_id': collection_name, 'maxTimestamp': watermark['maxTimestamp'],
+                                            'numRatings': watermark.get('numRatings'),
+                                            'refreshing': {'$ne': True}}, claim) is not None
+
+
+def refresh_rating_stats(database, rebuild=False, verbose=False):
+    # The newest timestamp is read first, so ratings inserted while the aggregates are refreshed are left for the
+    # next refresh instead of being counted twice
+    max_timestamp = get_max_timestamp(database)
+    fingerprint = get_ratings_fingerprint(database)
+
+    for key, collection_name in stats_collections.items():
+        watermark = None if rebuild else database[watermarks_collection].find_one({'_id': collection_name})
+
+        if watermark is not None and watermark.get('refreshing', False):
+            if verbose:
+                print("{}: being refreshed by another run, or a refresh failed; run with --rebuild if this persists"
+                      .format(collection_name))
+
+            continue
+
+        changed = watermark is not None and ratings_changed(database, watermark, fingerprint)
+
+        if changed:
+            print("{}: the ratings up to timestamp {} changed since they were aggregated, rebuilding the aggregates"
+                  .format(collection_name, watermark['maxTimestamp']))
+        elif watermark is not None and watermark['maxTimestamp'] == max_timestamp:
+            if verbose:
+                print("{}: up to date".format(collection_name))
+
+            continue
+
+        min_timestamp = None if watermark is None or changed else watermark['maxTimestamp']
+        num_ratings = 0 if min_timestamp is None else watermark['numRatings']
+        claim = dict(fingerprint, maxTimestamp=max_timestamp,
+                     numRatings=num_ratings + count_new_ratings(database, min_timestamp, max_timestamp))
+
+        if not claim_refresh(database, collection_name, watermark, claim, rebuild):
+            if verbose:
+                print("{}: refreshed by another run".format(collection_name))
+
+            continue
+
+        if min_timestamp is None:
+            database[collection_name].drop()
+
+        if max_timestamp is not None:
+            run_aggregation(database['Ratings'], get_rating_stats_query(key, collection_name, min_timestamp,
+                                                                        max_timestamp), allowDiskUse=True)
+
+        database[watermarks_collection].update_one({'_id': collection_name}, {'$unset': {'refreshing': ''}})
+
+        if verbose and min_timestamp is None:
+            print("{}: rebuilt from the ratings up to timestamp {}".format(collection_name, max_timestamp))
+        elif verbose:
+            print("{}: ratings from timestamp {} to {} added".format(collection_name, min_timestamp, max_timestamp))
+
+
+def wait_for_refresh(database, collection_name):
+    # Waits for the refresh of another run to merge its ratings, and stops when the mark outlives it
+    deadline = time.monotonic() + refresh_wait_seconds
+
+    while True:
+        watermark = database[watermarks_collection].find_one({'_id': collection_name})
+
+        if watermark is not None and not watermark.get('refreshing', False):
+            return
+
+        if time.monotonic() >= deadline:
+            print("{} is still being refreshed after {} s, or a refresh failed; run rating_stats.py --rebuild"
+                  .format(collection_name, refresh_wait_seconds))
+            sys.exit(1)
+
+        time.sleep(refresh_poll_seconds)
+
+
+def get_stats_collection(database, key):
+    # The aggregates of key, refreshed and with no refresh in progress
+    refresh_rating_stats(database)
+    collection_name = stats_collections[key]
+    wait_for_refresh(database, collection_name)
+    return database[collection_name]
+
+
+def get_average_ratings(database, key):
+    # Same documents as grouping the ratings by key with $avg, read from the refreshed aggregates
+    stats_collection = get_stats_collection(database, key)
+
+    with profiling.stage('read ' + stats_collection.name, 'read', stats_collection) as record:
+        average_ratings = [{'_id': stats['_id'], 'avgRating': stats['sum'] / stats['count']}
+                           for stats in stats_collection.find({}, {'sum': 1, 'count': 1})]
+        record['rows'] = len(average_ratings)
+
+    return average_ratings
+
+
+def iter_average_ratings(database, key, batch_size):
+    # The averages of the refreshed aggregates in arrays of at most batch_size values
+    averages = []
+
+    for stats in get_stats_collection(database, key).find({}, {'sum': 1, 'count': 1}, batch_size=batch_size):
+        averages.append(stats['sum'] / stats['count'])
+
+        if len(averages) == batch_size:
+            yield np.array(averages)
+            averages = []
+
+    if len(averages) > 0:
+        yield np.array(averages)
+
+
+def main():
+    mongodb_connection_string, rebuild = parse_argv(sys.argv)
+    refresh_rating_stats(get_database(mongodb_connection_string), rebuild, verbose=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+# Fixed-size summaries built in one pass over batches of values, for plots that only need a distribution
+#
+# Every summary is a dict of NumPy arrays and counters. Updating it with a batch and merging two of them give the
+# same result as building one over both inputs, so summaries of separate cursors or Parquet parts can be combined,
+# and the memory they take does not depend on the number of values. pandas is imported by the sketches that use it,
+# so that the histograms of movies_per_year.py do not load it.
+
+import numpy as np
+
+default_count_min_width = 2048
+default_count_min_depth = 4
+
+
+def new_histogram(low, high, num_bins, include_high=True):
+    # The bins are [low, low + width), ... and the last one is [high - width, high], or [high - width, high) without
+    # include_high, as for bins of whole years. Values outside are not binned, only counted in below and above.
+    return {'low': low, 'high': high, 'include_high': include_high, 'counts': np.zeros(num_bins, dtype=np.int64),
+            'below': 0, 'above': 0, 'missing': 0}
+
+
+def update_histogram(histogram, values):
+    values = np.asarray(values, dtype=np.float64)
+    is_missing = np.isnan(values)
+    values = values[~is_missing]
+    low, high, num_bins = histogram['low'], histogram['high'], len(histogram['counts'])
+    is_below = values < low
+    is_above = values > high if histogram['include_high'] else values >= high
+    is_inside = ~is_below & ~is_above
+    # Only a value equal to an included high edge would fall past the last bin
+    bins = np.minimum(((values[is_inside] - low) / (high - low) * num_bins).astype(np.int64), num_bins - 1)
+
+    histogram['counts'] += np.bincount(bins, minlength=num_bins)
+    histogram['below'] += int(is_below.sum())
+    histogram['above'] += int(is_above.sum())
+    histogram['missing'] += int(is_missing.sum())
+
+    return histogram
+
+
+def merge_histograms(histogram, other_histogram):
+    return {'low': histogram['low'], 'high': histogram['high'], 'include_high': histogram['include_high'],
+            'counts': histogram['counts'] + other_histogram['counts'],
+            'below': histogram['below'] + other_histogram['below'],
+            'above': histogram['above'] + other_histogram['above'],
+            'missing': histogram['missing'] + other_histogram['missing']}
+
+
+def get_bin_edges(histogram):
+    return np.linspace(histogram['low'], histogram['high'], len(histogram['counts']) + 1)
+
+
+def get_histogram_quantile(histogram, quantile):
+    # Quantile of the values inside the range, interpolated linearly within its bin
+    cumulative_counts = np.cumsum(histogram['counts'])
+
+    if len(cumulative_counts) == 0 or cumulative_counts[-1] == 0:
+        return float('nan')
+
+    rank = quantile * cumulative_counts[-1]
+    bin_index = min(int(np.searchsorted(cumulative_counts, rank, side='left')), len(cumulative_counts) - 1)
+    previous_count = cumulative_counts[bin_index - 1] if bin_index > 0 else 0
+    fraction = (rank - previous_count) / max(histogram['counts'][bin_index], 1)
+    edges = get_bin_edges(histogram)
+
+    return float(edges[bin_index] + fraction * (edges[bin_index + 1] - edges[bin_index]))
+
+
+def new_count_min(width=default_count_min_width, depth=default_count_min_depth):
+    return {'counts': np.zeros((depth, width), dtype=np.int64), 'total': 0}
+
+
+def get_count_min_columns(keys, width, depth):
+    # One independent hash per row of the sketch; hash_array is stable across processes, unlike hash()
+    import pandas as pd
+
+    keys = np.asarray(keys, dtype=object)
+    return np.stack([pd.util.hash_array(keys, hash_key='count-min-{:06d}'.format(row)) % np.uint64(width)
+                     for row in range(depth)]).astype(np.int64)
+
+
+def update_count_min(sketch, keys):
+    depth, width = sketch['counts'].shape
+    columns = get_count_min_columns(keys, width, depth)
+
+    for row in range(depth):
+        sketch['counts'][row] += np.bincount(columns[row], minlength=width)
+
+    sketch['total'] += len(keys)
+
+    return sketch
+
+
+def merge_count_min(sketch, other_sketch):
+    return {'counts': sketch['counts'] + other_sketch['counts'], 'total': sketch['total'] + other_sketch['total']}
+
+
+def estimate_counts(sketch, keys):
+    # Never below the true count, and above it by at most e / width of the total with high probability
+    depth, width = sketch['counts'].shape
+    columns = get_count_min_columns(keys, width, depth)
+
+    return sketch['counts'][np.arange(depth)[:, None], columns].min(axis=0)
+
+
+def new_reservoir(size, seed=None):
+    return {'size': size, 'seen': 0, 'sample': None, 'rng': np.random.default_rng(seed)}
+
+
+def update_reservoir(reservoir, df):
+    # Algorithm R over a batch of rows: row i of the stream takes slot j, drawn uniformly from 0 to i, if j falls in
+    # the reservoir; when several rows of the batch take the same slot, the last one wins as it would one row at a time
+    import pandas as pd
+
+    positions = reservoir['seen'] + np.arange(len(df))
+    slots = reservoir['rng'].integers(0, positions + 1)
+    slots = np.where(positions < reservoir['size'], positions, slots)
+    is_kept = slots < reservoir['size']
+
+    kept_df = df[is_kept].assign(_slot=slots[is_kept])
+    sample = kept_df if reservoir['sample'] is None else pd.concat([reservoir['sample'], kept_df])
+    reservoir['sample'] = sample.drop_duplicates('_slot', keep='last')
+    reservoir['seen'] += len(df)
+
+    return reservoir
+
+
+def get_reservoir_sample(reservoir):
+    import pandas as pd
+
+    if reservoir['sample'] is None:
+        return pd.DataFrame()
+
+    return reservoir['sample'].sort_values('_slot').drop(columns=['_slot']).reset_index(drop=True)
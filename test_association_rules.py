@@ -0,0 +1,60 @@
+# Checks the rules of association_rules.py against every split of every frequent itemset into an antecedent and a
+# consequent, with the confidence and the lift computed from the supports directly
+
+import itertools
+
+import numpy as np
+import pytest
+
+import association_rules
+import mining_engine
+
+
+def get_levels(seed, min_support=2):
+    # The levels mined from random roles dense enough to have frequent itemsets of several sizes, and the number of
+    # movies
+    rng = np.random.default_rng(seed)
+    baskets = mining_engine.encode_roles(rng.integers(0, 10, 150), rng.integers(0, 25, 150), min_support)
+    return list(mining_engine.mine_baskets(baskets, min_support, float('inf'))), len(baskets[1])
+
+
+def get_brute_force_rules(levels, num_movies, min_confidence, min_lift):
+    supports = dict((tuple(itemset), int(support)) for itemsets, level_supports in levels
+                    for itemset, support in zip(itemsets.tolist(), level_supports))
+    rules = {}
+
+    for itemset, support in supports.items():
+        for consequent_size in range(1, len(itemset)):
+            for consequent in itertools.combinations(itemset, consequent_size):
+                antecedent = tuple(actor_id for actor_id in itemset if actor_id not in consequent)
+                confidence = support / supports[antecedent]
+                lift = confidence * num_movies / supports[consequent]
+
+                if confidence >= min_confidence and lift >= min_lift:
+                    rules[antecedent, consequent] = (support, confidence, lift)
+
+    return rules
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('min_confidence', [0.0, 0.5, 0.8])
+@pytest.mark.parametrize('min_lift', [0.0, 1.5])
+def test_rules_match_brute_force(seed, min_confidence, min_lift):
+    levels, num_movies = get_levels(seed)
+    rules = {}
+
+    # A small batch size splits the itemsets of every level into several batches
+    for antecedents, consequents, supports, confidences, lifts in association_rules.generate_rules(
+            levels, num_movies, min_confidence, min_lift, batch_size=7):
+        for antecedent, consequent, support, confidence, lift in zip(antecedents.tolist(), consequents.tolist(),
+                                                                     supports.tolist(), confidences, lifts):
+            assert (tuple(antecedent), tuple(consequent)) not in rules
+            rules[tuple(antecedent), tuple(consequent)] = (support, confidence, lift)
+
+    brute_force_rules = get_brute_force_rules(levels, num_movies, min_confidence, min_lift)
+
+    assert len(brute_force_rules) > 0
+    assert rules.keys() == brute_force_rules.keys()
+
+    for key, (support, confidence, lift) in brute_force_rules.items():
+        assert rules[key] == (support, pytest.approx(confidence), pytest.approx(lift))
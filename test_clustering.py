@@ -0,0 +1,66 @@
+# Checks clustering.py: the number of clusters it reports, and that the features of the movies come out the same
+# from MongoDB (mongomock's in-memory server) and from the Parquet cache
+
+import json
+from os.path import join
+
+import numpy as np
+
+import clustering
+import plots
+
+
+def test_clusters_report_the_k_formed(tmp_path, monkeypatch, capsys):
+    # Two distinct ratings can only form two clusters, whatever k is asked for
+    monkeypatch.setitem(plots.output_settings, 'directory', str(tmp_path))
+    ratings = np.array([0.0, 0.0, 1.0, 1.0, 1.0])
+
+    for exact in [False, True]:
+        labels, centroids = clustering.k_means(ratings, 5, exact, seed=0)
+        clustering.print_capped_k(5, centroids)
+        clustering.plot_clusters(ratings, labels, centroids)
+
+        with open(join(str(tmp_path), 'clusters.json')) as file:
+            data = json.load(file)
+
+        assert "Only 2 clusters could be formed, not enough distinct points for k = 5" in capsys.readouterr().out
+        assert data['k'] == 2
+        assert data['centroids'] == [0.0, 1.0]
+        assert data['counts'] == [2, 3]
+
+
+def sort_rows(matrix):
+    return matrix[np.lexsort(matrix.T[::-1])]
+
+
+def test_features_match_between_mongodb_and_parquet(tmp_path, monkeypatch):
+    import mongomock
+
+    import benchmark_pipelines
+    import data_access
+    import generate_datasets
+    import merge_datasets
+
+    imdb_dir, ml_dir, parquet_dir = [join(str(tmp_path), name) for name in ['imdb', 'ml', 'parquet']]
+    generate_datasets.generate_datasets(imdb_dir, ml_dir, rows=3000, chunk_size=1000)
+    # Parts of 500 rows, so that the ratings of a movie are spread over several parts
+    merge_datasets.create_parquet_cache(imdb_dir, ml_dir, parquet_dir, 500)
+
+    # rating_stats.py aggregates the ratings with a $merge, which mongomock does not implement
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(mongomock.collection.Collection, 'aggregate',
+                        benchmark_pipelines.with_merge_emulation(mongomock.collection.Collection.aggregate))
+    monkeypatch.setitem(data_access.client_settings, 'client_factory', lambda *args, **kwargs: client)
+    monkeypatch.setattr(data_access, 'clients', {})
+    merge_datasets.create_collections(imdb_dir, ml_dir, None, workers=2)
+
+    mongodb_genres, get_mongodb_batches = clustering.get_feature_batches(None, batch_size=100)
+    parquet_genres, get_parquet_batches = clustering.get_feature_batches(None, parquet_dir, batch_size=100)
+    mongodb_batches = list(get_mongodb_batches())
+    parquet_batches = list(get_parquet_batches())
+
+    assert parquet_genres == mongodb_genres
+    assert [len(batch) for batch in parquet_batches] == [len(batch) for batch in mongodb_batches]
+    assert all(len(batch) == 100 for batch in parquet_batches[:-1])
+    np.testing.assert_allclose(sort_rows(np.vstack(parquet_batches)), sort_rows(np.vstack(mongodb_batches)),
+                               rtol=1e-9, atol=1e-12)
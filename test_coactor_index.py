@@ -0,0 +1,60 @@
+# Checks that refreshing a co-actor index after the roles change gives the counts of an index built from scratch,
+# with and without pruned pairs
+
+import numpy as np
+import pytest
+
+import coactor_index
+import mining_engine
+
+
+def get_random_roles(rng, num_actors=30, num_movies=40, num_roles=300):
+    return np.unique(np.stack([rng.integers(0, num_actors, num_roles), rng.integers(0, num_movies, num_roles)],
+                              axis=1), axis=0)
+
+
+def change_roles(rng, roles):
+    # Drops some roles and adds others, including actors and movies the index has never seen
+    kept_roles = roles[rng.random(len(roles)) > 0.2]
+    new_roles = np.stack([rng.integers(0, 40, 60), rng.integers(0, 50, 60)], axis=1)
+
+    return np.unique(np.concatenate([kept_roles, new_roles]), axis=0)
+
+
+def get_baskets(roles):
+    return mining_engine.encode_roles(roles[:, 0], roles[:, 1], 1)
+
+
+def to_dicts(actor_ids, movie_ids, incidence, coactors):
+    # The roles and the shared movies of every pair by ID, leaving out the actors and movies left with none
+    incidence, coactors = incidence.tocoo(), coactors.tocoo()
+
+    return set(zip(actor_ids[incidence.row].tolist(), movie_ids[incidence.col].tolist())), \
+        dict(zip(zip(actor_ids[coactors.row].tolist(), actor_ids[coactors.col].tolist()), coactors.data.tolist()))
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('min_support', [1, 2, 3])
+def test_refresh_matches_build(tmp_path, seed, min_support):
+    rng = np.random.default_rng(seed)
+    old_roles = get_random_roles(rng)
+    new_roles = change_roles(rng, old_roles)
+
+    coactor_index.save_index(str(tmp_path), *coactor_index.build_index(get_baskets(old_roles), min_support),
+                             min_support)
+    *refreshed, num_changed = coactor_index.refresh_index(coactor_index.load_index(str(tmp_path)),
+                                                          get_baskets(new_roles), min_support)
+
+    assert num_changed > 0
+    assert to_dicts(*refreshed) == to_dicts(*coactor_index.build_index(get_baskets(new_roles), min_support))
+
+
+def test_refresh_without_changes_keeps_the_index(tmp_path):
+    roles = get_random_roles(np.random.default_rng(0))
+    built = coactor_index.build_index(get_baskets(roles), 2)
+    coactor_index.save_index(str(tmp_path), *built, 2)
+    *refreshed, num_changed = coactor_index.refresh_index(coactor_index.load_index(str(tmp_path)),
+                                                          get_baskets(roles), 2)
+
+    assert num_changed == 0
+    assert to_dicts(*refreshed) == to_dicts(*built)
@@ -0,0 +1,95 @@
+# Checks the compact layout of compact_schema.py: that the decoding pipeline of the views gives back the documents of
+# a load in the original layout, and that the compact queries of the scripts return what they return on the original
+# collections. mongomock has no views, so the decoding pipeline is run on the compact collections directly.
+
+from os.path import join
+
+import mongomock
+import numpy as np
+import pandas as pd
+import pytest
+
+import compact_schema
+import data_access
+import generate_datasets
+import merge_datasets
+import movie_overview
+import movies_per_genre
+import movies_per_year
+
+
+@pytest.fixture(scope='module')
+def clients(tmp_path_factory):
+    # The same dataset loaded in the original layout and in the compact one, each on its own server
+    directory = str(tmp_path_factory.mktemp('compact'))
+    imdb_dir, ml_dir = join(directory, 'imdb'), join(directory, 'ml')
+    generate_datasets.generate_datasets(imdb_dir, ml_dir, rows=3000, chunk_size=1000)
+    clients = {'original': mongomock.MongoClient(), 'compact': mongomock.MongoClient()}
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setitem(data_access.client_settings, 'client_factory', lambda name, **kwargs: clients[name])
+        monkeypatch.setattr(data_access, 'clients', {})
+        monkeypatch.setattr(compact_schema, 'create_views', compact_schema.save_encoder)
+        merge_datasets.create_collections(imdb_dir, ml_dir, 'original', workers=2)
+        merge_datasets.create_collections(imdb_dir, ml_dir, 'compact', workers=2, compact=True)
+
+    return clients
+
+
+@pytest.fixture
+def use_clients(clients, monkeypatch):
+    monkeypatch.setitem(data_access.client_settings, 'client_factory', lambda name, **kwargs: clients[name])
+    monkeypatch.setattr(data_access, 'clients', {})
+
+
+def to_sorted_rows(documents):
+    return sorted(repr(sorted((key, value) for key, value in document.items() if key != '_id'))
+                  for document in documents)
+
+
+@pytest.mark.parametrize('collection_name', sorted(compact_schema.compact_fields))
+def test_decoding_gives_back_the_original_documents(clients, collection_name):
+    compact_database = clients['compact']['MapReduce']
+    decode_pipeline = compact_schema.get_decode_pipeline(compact_schema.load_encoder(compact_database),
+                                                         collection_name)
+    decoded_documents = list(compact_database[compact_schema.compact_collections[collection_name]]
+                             .aggregate(decode_pipeline))
+    original_documents = list(clients['original']['MapReduce'][collection_name].find())
+
+    assert len(decoded_documents) > 0
+    assert to_sorted_rows(decoded_documents) == to_sorted_rows(original_documents)
+
+
+def test_genre_masks_decode_every_bit():
+    database = mongomock.MongoClient()['MapReduce']
+    encoder = {'genres': [], 'categories': []}
+    genre_names = ['Genre{:02d}'.format(code) for code in range(compact_schema.max_genres)]
+    genres = pd.Series([genre_names, genre_names[-1:], genre_names[:1], genre_names[::7]])
+
+    movies_df = compact_schema.encode_df(encoder, 'Movie', pd.DataFrame({'id': np.arange(len(genres)),
+                                                                          'genres': genres}))
+    database['Movie_Compact'].insert_many(movies_df.to_dict('records'))
+    decoded_documents = database['Movie_Compact'].aggregate(compact_schema.get_decode_pipeline(encoder, 'Movie'))
+
+    assert [document['genres'] for document in decoded_documents] == [sorted(names) for names in genres]
+
+    with pytest.raises(SystemExit):
+        compact_schema.get_genre_masks(encoder, pd.Series([['One more genre']]))
+
+
+def sort_by_id(documents):
+    return sorted(documents, key=lambda document: repr(document['_id']))
+
+
+def test_compact_queries_match_the_original_ones(use_clients):
+    for get_result in [movies_per_genre.get_result_from_mongodb, movies_per_year.get_result_from_mongodb,
+                       lambda name: movies_per_year.get_result_from_sketch(name, None)]:
+        assert sort_by_id(get_result('compact')) == sort_by_id(get_result('original'))
+
+    compact_overview = movie_overview.get_movie_overview('compact', 5)
+    original_overview = movie_overview.get_movie_overview('original', 5)
+
+    assert sorted(compact_overview) == sorted(original_overview)
+
+    for name in original_overview:
+        assert sort_by_id(compact_overview[name]) == sort_by_id(original_overview[name])
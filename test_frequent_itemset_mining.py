@@ -0,0 +1,49 @@
+# Checks that the number of movies the lifts are relative to does not depend on the minimum support, and comes out
+# the same from MongoDB (mongomock's in-memory server) and from the Parquet cache
+
+import sys
+from os.path import join
+
+import mongomock
+import pandas as pd
+
+import data_access
+import frequent_itemset_mining
+import generate_datasets
+import itemset_store
+import merge_datasets
+import plots
+
+
+def test_num_movies_is_the_same_for_every_support(tmp_path, monkeypatch):
+    imdb_dir, ml_dir, parquet_dir = [join(str(tmp_path), name) for name in ['imdb', 'ml', 'parquet']]
+    generate_datasets.generate_datasets(imdb_dir, ml_dir, rows=3000, chunk_size=1000)
+    merge_datasets.create_parquet_cache(imdb_dir, ml_dir, parquet_dir, 1000)
+    monkeypatch.setitem(plots.output_settings, 'directory', str(tmp_path))
+
+    client = mongomock.MongoClient()
+    monkeypatch.setitem(data_access.client_settings, 'client_factory', lambda *args, **kwargs: client)
+    monkeypatch.setattr(data_access, 'clients', {})
+    merge_datasets.create_collections(imdb_dir, ml_dir, None, workers=2)
+
+    person_roles_df = data_access.read_parquet_columns(parquet_dir, 'Person_Roles', ['movieId', 'category'])
+    num_actor_movies = person_roles_df.loc[person_roles_df['category'].isin(['self', 'actor', 'actress']),
+                                           'movieId'].nunique()
+    num_movies = []
+    num_basket_movies = []
+
+    for min_support in [1, 2, 3]:
+        save_dir = join(str(tmp_path), 'itemsets-{}'.format(min_support))
+        rules_path = join(str(tmp_path), 'rules-{}.csv'.format(min_support))
+        monkeypatch.setattr(sys, 'argv', ['frequent_itemset_mining.py', str(min_support), '2', '--parquet',
+                                          parquet_dir, '--save', save_dir, '--rules', rules_path])
+        frequent_itemset_mining.main()
+        num_movies.append(itemset_store.load_metadata(save_dir)['numMovies'])
+
+        num_basket_movies.append(len(frequent_itemset_mining.get_actor_baskets(None, min_support, parquet_dir)[1]))
+        assert len(pd.read_csv(rules_path)) > 0
+
+    # Fewer movies have an actor with min_support movies than an actor at all
+    assert num_basket_movies[-1] < num_actor_movies
+    assert num_movies == [num_actor_movies] * 3
+    assert frequent_itemset_mining.count_actor_movies(None) == num_actor_movies
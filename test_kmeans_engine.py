@@ -0,0 +1,53 @@
+# Checks the exact dynamic program of kmeans_engine.py against an exhaustive search over every split of small sorted
+# inputs into contiguous clusters, which is where the optimal one-dimensional clustering always lies
+
+import itertools
+
+import numpy as np
+import pytest
+
+import kmeans_engine
+
+
+def get_random_points(seed, num_points):
+    # Half stars on a small range, so that many points repeat
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 10, num_points) / 2
+
+
+def get_brute_force_sse(points, k):
+    sorted_points = np.sort(points)
+    best_sse = float('inf')
+
+    for cuts in itertools.combinations(range(1, len(sorted_points)), min(k, len(sorted_points)) - 1):
+        clusters = np.split(sorted_points, cuts)
+        best_sse = min(best_sse, sum(float(((cluster - cluster.mean()) ** 2).sum()) for cluster in clusters))
+
+    return best_sse
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('num_points', [1, 2, 5, 9])
+def test_optimal_sse_curve_matches_brute_force(seed, num_points):
+    points = get_random_points(seed, num_points)
+    max_k = 6
+
+    assert kmeans_engine.optimal_sse_curve(points, max_k) == pytest.approx(
+        [get_brute_force_sse(points, k) for k in range(1, max_k + 1)], abs=1e-9)
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('k', [1, 2, 3, 4])
+def test_optimal_k_means_matches_brute_force(seed, k):
+    points = np.random.default_rng(seed).normal(size=9)
+    labels, centroids = kmeans_engine.optimal_k_means(points, k)
+
+    assert len(centroids) == k
+    assert np.all(np.diff(centroids) > 0)
+    assert kmeans_engine.compute_sse(points, labels, centroids) == pytest.approx(get_brute_force_sse(points, k))
+
+
+def test_empty_points_give_the_curve_of_the_sweep():
+    points = np.empty(0, dtype=np.float64)
+
+    assert kmeans_engine.optimal_sse_curve(points, 4) == kmeans_engine.sse_sweep(points, 4) == [0.0] * 4
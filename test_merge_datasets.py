@@ -0,0 +1,238 @@
+# Checks the ingest of merge_datasets.py on a handful of rows written in the format of the IMDb and MovieLens dumps,
+# loaded into mongomock's in-memory server
+
+import gzip
+from os import makedirs
+from os.path import join
+
+import mongomock
+import pytest
+
+import data_access
+import merge_datasets
+
+name_basics_rows = [
+    "nconst\tprimaryName\tbirthYear\tdeathYear\tprimaryProfession\tknownForTitles",
+    "nm0000001\tFred Astaire\t1899\t1987\tactor\ttt0000001",
+    "nm0000002\tLauren Bacall\t1924\t\\N\tactress\ttt0000003",
+    "nm0000003\tBrigitte Bardot\t\\N\t\\N\tactress\t\\N"
+]
+title_basics_rows = [
+    "tconst\ttitleType\tprimaryTitle\toriginalTitle\tisAdult\tstartYear\tendYear\truntimeMinutes\tgenres",
+    "tt0000001\tmovie\tCarmencita\tCarmencita\t0\t1894\t\\N\t1\tDocumentary,Short",
+    "tt0000002\ttvSeries\tA Series\tA Series\t0\t1950\t1960\t30\tComedy",
+    "tt0000003\tshort\tPauvre Pierrot\tPauvre Pierrot\t0\t1892\t\\N\t\\N\tAnimation,Comedy",
+    "tt0000004\ttvMovie\tNo Genres\tNo Genres\t0\t\\N\t\\N\tabc\t\\N",
+    "tt0000005\tmovie\tEmpty Genres\tEmpty Genres\t0\t2000\t\\N\t90\t"
+]
+title_principals_rows = [
+    "tconst\tordering\tnconst\tcategory\tjob\tcharacters",
+    "tt0000001\t1\tnm0000001\tactor\t\\N\t\\N",
+    "tt0000001\t2\tnm0000002\tactress\t\\N\t\\N",
+    "tt0000003\t1\tnm0000002\tself\t\\N\t\\N",
+    "tt0000003\t2\tnm0000002\tdirector\t\\N\t\\N",
+    "tt0000005\t1\tnm0000003\tactress\t\\N\t\\N"
+]
+links_rows = [
+    "movieId,imdbId,tmdbId",
+    "1,0000001,",
+    "2,0000003,16",
+    "3,0000005,"
+]
+ratings_rows = [
+    "userId,movieId,rating,timestamp",
+    "1,1,4.0,100",
+    "1,2,3.5,110",
+    "2,1,5.0,120",
+    "2,3,0.5,130",
+    "3,2,2.0,140"
+]
+
+
+def write_lines(path, rows):
+    opener = gzip.open if path.endswith('.gz') else open
+
+    with opener(path, 'wt') as file:
+        file.write('\n'.join(rows) + '\n')
+
+
+def write_dataset(directory, ratings=None, links=None):
+    imdb_dir, ml_dir = join(str(directory), 'imdb'), join(str(directory), 'ml')
+    makedirs(imdb_dir, exist_ok=True)
+    makedirs(ml_dir, exist_ok=True)
+
+    write_lines(join(imdb_dir, merge_datasets.name_basics), name_basics_rows)
+    write_lines(join(imdb_dir, merge_datasets.title_basics), title_basics_rows)
+    write_lines(join(imdb_dir, merge_datasets.title_principals), title_principals_rows)
+    write_lines(join(ml_dir, merge_datasets.ml_links), links_rows if links is None else links)
+    write_lines(join(ml_dir, merge_datasets.ml_ratings), ratings_rows if ratings is None else ratings)
+
+    return imdb_dir, ml_dir
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Every client of the ingest connects to the same in-memory server
+    client = mongomock.MongoClient()
+    monkeypatch.setitem(data_access.client_settings, 'client_factory', lambda *args, **kwargs: client)
+
+    return client
+
+
+def get_documents(database, collection_name):
+    # The documents without their _id, in a stable order
+    return sorted((dict((key, value) for key, value in document.items() if key != '_id')
+                   for document in database[collection_name].find()), key=repr)
+
+
+def get_all_documents(database):
+    return dict((collection_name, get_documents(database, collection_name))
+                for collection_name in merge_datasets.upsert_keys)
+
+
+def test_streaming_matches_whole_files(tmp_path, client):
+    imdb_dir, ml_dir = write_dataset(tmp_path)
+
+    merge_datasets.create_collections(imdb_dir, ml_dir, None, workers=2)
+    whole_documents = get_all_documents(client['MapReduce'])
+    client.drop_database('MapReduce')
+    # Batches of two rows split every file into several chunks
+    metrics_by_collection = merge_datasets.create_collections_streaming(imdb_dir, ml_dir, None, 2, workers=2)
+
+    assert get_all_documents(client['MapReduce']) == whole_documents
+    assert dict((collection_name, metrics['rows']) for collection_name, metrics in metrics_by_collection.items()) == \
+        dict((collection_name, len(documents)) for collection_name, documents in whole_documents.items())
+    assert metrics_by_collection['Ratings']['batches'] == 3
+
+
+def test_documents_are_pinned(tmp_path, client):
+    # Unlike the list comprehensions this module used to run, missing years and runtimes are nullable integers, so
+    # the years that are present are stored as integers rather than doubles, and a title with no genres at all gets
+    # ['\N'], as a title whose genres are \N in the dump always did, rather than ['nan']
+    imdb_dir, ml_dir = write_dataset(tmp_path)
+    merge_datasets.create_collections(imdb_dir, ml_dir, None, workers=2)
+    documents = get_all_documents(client['MapReduce'])
+
+    assert documents['Person'] == [
+        {'id': 1, 'primaryName': 'Fred Astaire', 'birthYear': 1899, 'deathYear': 1987},
+        {'id': 2, 'primaryName': 'Lauren Bacall', 'birthYear': 1924},
+        {'id': 3, 'primaryName': 'Brigitte Bardot'}
+    ]
+    assert documents['Movie'] == [
+        {'id': 1, 'primaryTitle': 'Carmencita', 'startYear': 1894, 'runtimeMinutes': 1,
+         'genres': ['Documentary', 'Short']},
+        {'id': 3, 'primaryTitle': 'Pauvre Pierrot', 'startYear': 1892, 'genres': ['Animation', 'Comedy']},
+        {'id': 4, 'primaryTitle': 'No Genres', 'genres': ['\\N']},
+        {'id': 5, 'primaryTitle': 'Empty Genres', 'startYear': 2000, 'runtimeMinutes': 90, 'genres': ['\\N']}
+    ]
+    assert documents['Person_Roles'] == [
+        {'movieId': 1, 'personId': 1, 'category': 'actor'},
+        {'movieId': 1, 'personId': 2, 'category': 'actress'},
+        {'movieId': 3, 'personId': 2, 'category': 'director'},
+        {'movieId': 3, 'personId': 2, 'category': 'self'},
+        {'movieId': 5, 'personId': 3, 'category': 'actress'}
+    ]
+    assert documents['Ratings'] == [
+        {'userId': 1, 'movieId': 1, 'rating': 4.0, 'timestamp': 100},
+        {'userId': 1, 'movieId': 3, 'rating': 3.5, 'timestamp': 110},
+        {'userId': 2, 'movieId': 1, 'rating': 5.0, 'timestamp': 120},
+        {'userId': 2, 'movieId': 5, 'rating': 0.5, 'timestamp': 130},
+        {'userId': 3, 'movieId': 3, 'rating': 2.0, 'timestamp': 140}
+    ]
+    assert all(type(value) is int for collection_documents in documents.values()
+               for document in collection_documents for key, value in document.items()
+               if key in ['id', 'movieId', 'personId', 'userId', 'birthYear', 'deathYear', 'startYear',
+                          'runtimeMinutes', 'timestamp'])
+
+
+def test_unlinked_ratings_are_left_out(tmp_path, client, capsys):
+    imdb_dir, ml_dir = write_dataset(tmp_path, ratings=ratings_rows + ["4,9,3.0,150"])
+    ml_ratings_df = merge_datasets.get_ml_dfs(ml_dir)
+
+    assert "1 ratings of movies missing from links.csv were left out" in capsys.readouterr().out
+    assert str(ml_ratings_df['movieId'].dtype) == 'int32'
+    assert ml_ratings_df['movieId'].tolist() == [1, 3, 1, 5, 3]
+
+    # Every chunk of a streaming load keeps an integer movieId too
+    merge_datasets.create_collections_streaming(imdb_dir, ml_dir, None, 2, workers=2)
+
+    assert [document['movieId'] for document in get_documents(client['MapReduce'], 'Ratings')] == [1, 3, 1, 5, 3]
+
+
+def get_keyed_documents(database, collection_name):
+    # {upsert key: document without its _id and _hash}, checking that no key is stored twice
+    documents = [dict((key, value) for key, value in document.items() if key not in ['_id', '_hash'])
+                 for document in database[collection_name].find()]
+    keyed_documents = dict((tuple(document[key] for key in merge_datasets.upsert_keys[collection_name]), document)
+                           for document in documents)
+    assert len(keyed_documents) == len(documents)
+
+    return keyed_documents
+
+
+def test_incremental_load_matches_full_load(tmp_path, client):
+    imdb_dir, ml_dir = write_dataset(tmp_path)
+    merge_datasets.create_collections(imdb_dir, ml_dir, None, workers=2)
+    full_documents = dict((collection_name, get_keyed_documents(client['MapReduce'], collection_name))
+                          for collection_name in merge_datasets.upsert_keys)
+    client.drop_database('MapReduce')
+
+    merge_datasets.create_collections_incremental(imdb_dir, ml_dir, None, 2, workers=2)
+
+    for collection_name, documents in full_documents.items():
+        assert get_keyed_documents(client['MapReduce'], collection_name) == documents
+        assert any(index.get('unique', False) and [key for key, _ in index['key']] ==
+                   merge_datasets.upsert_keys[collection_name]
+                   for index in client['MapReduce'][collection_name].index_information().values())
+
+    # Nothing changed, so no file is read again
+    assert merge_datasets.create_collections_incremental(imdb_dir, ml_dir, None, 2, workers=2) == {}
+
+
+def test_incremental_load_reads_ratings_from_the_last_timestamp(tmp_path, client):
+    imdb_dir, ml_dir = write_dataset(tmp_path)
+    merge_datasets.create_collections_incremental(imdb_dir, ml_dir, None, 2, workers=2)
+
+    # A rating with the newest timestamp of the last run, a new one, and a re-rating that replaces an older one
+    write_lines(join(ml_dir, merge_datasets.ml_ratings), ratings_rows + ["4,1,3.0,140", "1,3,1.5,150", "1,1,2.5,160"])
+    metrics_by_collection = merge_datasets.create_collections_incremental(imdb_dir, ml_dir, None, 2, workers=2)
+    ratings = get_keyed_documents(client['MapReduce'], 'Ratings')
+
+    assert list(metrics_by_collection) == ['Ratings']
+    # Only the rating read again at timestamp 140 is skipped, by its content hash
+    assert (metrics_by_collection['Ratings']['rows'], metrics_by_collection['Ratings']['skipped']) == (3, 1)
+    assert len(ratings) == 7
+    assert ratings[4, 1] == {'userId': 4, 'movieId': 1, 'rating': 3.0, 'timestamp': 140}
+    assert ratings[1, 5] == {'userId': 1, 'movieId': 5, 'rating': 1.5, 'timestamp': 150}
+    assert ratings[1, 1] == {'userId': 1, 'movieId': 1, 'rating': 2.5, 'timestamp': 160}
+
+
+def test_incremental_load_deletes_remapped_ratings(tmp_path, client):
+    imdb_dir, ml_dir = write_dataset(tmp_path)
+    merge_datasets.create_collections_incremental(imdb_dir, ml_dir, None, 2, workers=2)
+
+    # MovieLens movie 2 now stands for tt0000004 instead of tt0000003
+    write_lines(join(ml_dir, merge_datasets.ml_links),
+                ["movieId,imdbId,tmdbId", "1,0000001,", "2,0000004,16", "3,0000005,"])
+    merge_datasets.create_collections_incremental(imdb_dir, ml_dir, None, 2, workers=2)
+    ratings = get_keyed_documents(client['MapReduce'], 'Ratings')
+
+    assert sorted(ratings) == [(1, 1), (1, 4), (2, 1), (2, 5), (3, 4)]
+    assert client['MapReduce'][merge_datasets.links_collection].count_documents({}) == 3
+
+
+def test_parquet_parts_share_one_schema(tmp_path):
+    import pyarrow.parquet as pq
+
+    imdb_dir, ml_dir = write_dataset(tmp_path)
+    parquet_dir = join(str(tmp_path), 'parquet')
+    # One row per part, so that every part has the dtypes pandas infers for a single row
+    rows_by_collection = merge_datasets.create_parquet_cache(imdb_dir, ml_dir, parquet_dir, 1)
+
+    for collection_name in data_access.parquet_columns:
+        parts = data_access.get_parquet_parts(parquet_dir, collection_name)
+        schema = data_access.get_parquet_schema(collection_name)
+
+        assert len(parts) > 1
+        assert all(pq.read_schema(part).remove_metadata() == schema for part in parts)
+        assert pq.read_table(join(parquet_dir, collection_name)).num_rows == rows_by_collection[collection_name]
@@ -0,0 +1,96 @@
+# Checks the miners of mining_engine.py against a brute-force count of every combination of actors, on small random
+# roles dense enough to have frequent itemsets of several sizes
+
+import itertools
+
+import numpy as np
+import pytest
+
+import mining_engine
+
+
+def get_random_roles(seed, num_actors=10, num_movies=25, num_roles=150):
+    # (actor IDs, movie IDs) of random roles; IDs are sparse and a role can be listed twice, as in Person_Roles
+    rng = np.random.default_rng(seed)
+    return 100 + 7 * rng.integers(0, num_actors, num_roles), 1000 + 3 * rng.integers(0, num_movies, num_roles)
+
+
+def get_brute_force_levels(role_actor_ids, role_movie_ids, min_support):
+    # {sorted actor IDs: support} of every level, counting every combination of the actors in min_support movies
+    movies_by_actor = {}
+
+    for actor_id, movie_id in zip(role_actor_ids.tolist(), role_movie_ids.tolist()):
+        movies_by_actor.setdefault(actor_id, set()).add(movie_id)
+
+    actor_ids = sorted(actor_id for actor_id, movies in movies_by_actor.items() if len(movies) >= min_support)
+    levels = []
+
+    for size in itertools.count(1):
+        level = {}
+
+        for itemset in itertools.combinations(actor_ids, size):
+            support = len(set.intersection(*[movies_by_actor[actor_id] for actor_id in itemset]))
+
+            if support >= min_support:
+                level[itemset] = support
+
+        if len(level) == 0:
+            return levels
+
+        levels.append(level)
+
+
+def to_dicts(levels):
+    return [dict((tuple(itemset), int(support)) for itemset, support in zip(itemsets.tolist(), supports))
+            for itemsets, supports in levels]
+
+
+@pytest.mark.parametrize('algorithm', sorted(mining_engine.algorithms))
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('min_support', [2, 4])
+def test_miners_match_brute_force(algorithm, seed, min_support):
+    role_actor_ids, role_movie_ids = get_random_roles(seed)
+    baskets = mining_engine.encode_roles(role_actor_ids, role_movie_ids, min_support)
+    levels = list(mining_engine.mine_baskets(baskets, min_support, float('inf'), algorithm))
+
+    assert to_dicts(levels) == get_brute_force_levels(role_actor_ids, role_movie_ids, min_support)
+
+
+@pytest.mark.parametrize('algorithm', sorted(mining_engine.algorithms))
+def test_max_itemset_size_stops_the_levels(algorithm):
+    role_actor_ids, role_movie_ids = get_random_roles(0)
+    baskets = mining_engine.encode_roles(role_actor_ids, role_movie_ids, 2)
+    levels = list(mining_engine.mine_baskets(baskets, 2, 2, algorithm))
+
+    assert to_dicts(levels) == get_brute_force_levels(role_actor_ids, role_movie_ids, 2)[:2]
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_parallel_apriori_matches_serial(monkeypatch, seed):
+    # Tiny shards and batches, so that every level is split among the forked workers and counted in several batches
+    role_actor_ids, role_movie_ids = get_random_roles(seed)
+    baskets = mining_engine.encode_roles(role_actor_ids, role_movie_ids, 2)
+    serial_levels = list(mining_engine.mine_baskets(baskets, 2, float('inf'), 'apriori'))
+
+    num_shards = []
+    get_shard_bounds = mining_engine.get_shard_bounds
+
+    def count_shards(cumulative_lengths, workers):
+        shard_bounds = get_shard_bounds(cumulative_lengths, workers)
+        num_shards.append(len(shard_bounds) - 1)
+        return shard_bounds
+
+    monkeypatch.setattr(mining_engine, 'min_pairs_per_shard', 1)
+    monkeypatch.setattr(mining_engine, 'max_pairs_per_batch', 3)
+    monkeypatch.setattr(mining_engine, 'get_shard_bounds', count_shards)
+    parallel_levels = list(mining_engine.mine_baskets(baskets, 2, float('inf'), 'apriori', workers=3))
+
+    # The pairs are the first level split, then the candidates of the larger levels
+    assert num_shards[0] > 1 and max(num_shards[1:]) > 1
+    assert len(parallel_levels) == len(serial_levels)
+
+    for (parallel_itemsets, parallel_supports), (serial_itemsets, serial_supports) in zip(parallel_levels,
+                                                                                          serial_levels):
+        assert parallel_itemsets.dtype == serial_itemsets.dtype and parallel_supports.dtype == serial_supports.dtype
+        assert parallel_itemsets.tobytes() == serial_itemsets.tobytes()
+        assert parallel_supports.tobytes() == serial_supports.tobytes()
@@ -0,0 +1,33 @@
+# Checks how movie_analysis.py splits the command line between its own options, the subcommand and its arguments
+
+import pytest
+
+import movie_analysis
+
+
+def test_options_before_the_subcommand_are_ours():
+    subcommand, arguments, options = movie_analysis.parse_argv(
+        ['movie_analysis.py', '--mongodb', 'mongodb://host', '--output', 'plots', 'clustering', '--k', '3',
+         '--output', 'x'])
+
+    assert subcommand == 'clustering' and arguments == ['--k', '3', '--output', 'x']
+    assert options['connection_string'] == 'mongodb://host' and options['output_dir'] == 'plots'
+
+
+def test_option_values_named_like_a_subcommand():
+    subcommand, arguments, options = movie_analysis.parse_argv(
+        ['clustering', '--output', 'clustering', '--explain', '--profile', 'report.json', 'movies-per-genre',
+         '--sketch'])
+
+    assert subcommand == 'movies-per-genre' and arguments == ['--sketch']
+    assert options['output_dir'] == 'clustering' and options['explain']
+
+
+@pytest.mark.parametrize('argv', [['movie_analysis.py'], ['movie_analysis.py', '--output'],
+                                  ['movie_analysis.py', '--output', 'plots'],
+                                  ['movie_analysis.py', 'plots', 'clustering']])
+def test_missing_subcommand_prints_the_usage(argv, capsys):
+    with pytest.raises(SystemExit):
+        movie_analysis.parse_argv(argv)
+
+    assert capsys.readouterr().out.startswith("Usage:")
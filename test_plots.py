@@ -0,0 +1,34 @@
+# Checks that the data written along with a plot is valid JSON, whatever NumPy and pandas values it holds
+
+import json
+from os.path import join
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import plots
+
+
+def test_to_json_writes_missing_numbers_as_null():
+    data = {'x': np.array([1.5, np.nan]), 'y': pd.Series([np.inf, 2.0]), np.int64(3): [np.float64('nan'), (1, 'a')],
+            'k': np.int32(4), 'none': None}
+
+    assert plots.to_json(data) == {'x': [1.5, None], 'y': [None, 2.0], 3: [None, [1, 'a']], 'k': 4, 'none': None}
+
+
+def test_to_json_rejects_other_types():
+    with pytest.raises(TypeError):
+        plots.to_json({'values': {1, 2}})
+
+
+def test_show_writes_valid_json(tmp_path, monkeypatch):
+    monkeypatch.setitem(plots.output_settings, 'directory', str(tmp_path))
+    plots.get_pyplot().plot([1, 2])
+    plots.show('runtime_by_year', {'year': np.array([2000, 2001]), 'runtime': np.array([90.0, np.nan])})
+
+    with open(join(str(tmp_path), 'runtime_by_year.json')) as file:
+        text = file.read()
+
+    assert 'NaN' not in text
+    assert json.loads(text) == {'year': [2000, 2001], 'runtime': [90.0, None]}
@@ -0,0 +1,91 @@
+# Checks the rating aggregates of rating_stats.py against averages computed directly from the ratings, on mongomock
+# with the $merge emulated as in benchmark_pipelines.py, as ratings are added, changed and reloaded
+
+import mongomock
+import pytest
+
+import benchmark_pipelines
+import rating_stats
+
+
+@pytest.fixture
+def database(monkeypatch):
+    monkeypatch.setattr(mongomock.collection.Collection, 'aggregate',
+                        benchmark_pipelines.with_merge_emulation(mongomock.collection.Collection.aggregate))
+    return mongomock.MongoClient()['MapReduce']
+
+
+def get_ratings(first_timestamp, num_ratings):
+    return [{'userId': timestamp % 7, 'movieId': timestamp % 5, 'rating': float(timestamp % 10) / 2 + 0.5,
+             'timestamp': timestamp} for timestamp in range(first_timestamp, first_timestamp + num_ratings)]
+
+
+def get_direct_averages(database, key):
+    ratings_by_key = {}
+
+    for rating in database['Ratings'].find():
+        ratings_by_key.setdefault(rating[key], []).append(rating['rating'])
+
+    return dict((value, sum(ratings) / len(ratings)) for value, ratings in ratings_by_key.items())
+
+
+def assert_averages_match(database):
+    for key in rating_stats.stats_collections:
+        averages = dict((document['_id'], document['avgRating'])
+                        for document in rating_stats.get_average_ratings(database, key))
+        assert averages == pytest.approx(get_direct_averages(database, key))
+
+
+def test_refreshes_match_direct_averages(database, capsys):
+    for first_timestamp in [0, 40, 100]:
+        database['Ratings'].insert_many(get_ratings(first_timestamp, 30))
+        assert_averages_match(database)
+
+    assert "rebuilding" not in capsys.readouterr().out
+    watermark = database[rating_stats.watermarks_collection].find_one({'_id': 'Movie_Rating_Stats'})
+    assert watermark['maxTimestamp'] == 129 and watermark['numRatings'] == 90
+
+
+def test_changed_ratings_rebuild_the_aggregates(database, capsys):
+    database['Ratings'].insert_many(get_ratings(0, 30))
+    assert_averages_match(database)
+
+    # A re-rated movie replaces its rating with a newer one, as the incremental ingest does
+    database['Ratings'].replace_one({'timestamp': 3}, {'userId': 3, 'movieId': 3, 'rating': 5.0, 'timestamp': 50})
+    assert_averages_match(database)
+    assert "changed since they were aggregated" in capsys.readouterr().out
+
+    # New links remap old ratings without changing their number or timestamps
+    database['Ratings'].update_many({'movieId': 1}, {'$set': {'movieId': 2}})
+    database[rating_stats.ingest_watermarks_collection].insert_one({'_id': rating_stats.ratings_file,
+                                                                   'links': [10, 100.0]})
+    assert_averages_match(database)
+    assert "changed since they were aggregated" in capsys.readouterr().out
+
+    # A reload with as many ratings and the same timestamps
+    database['Ratings'].drop()
+    database['Ratings'].insert_many([dict(rating, rating=1.0) for rating in get_ratings(21, 30)])
+    assert_averages_match(database)
+    assert "changed since they were aggregated" in capsys.readouterr().out
+
+    assert_averages_match(database)
+    assert capsys.readouterr().out == ""
+
+
+def test_readers_stop_on_a_failed_refresh(database, monkeypatch, capsys):
+    database['Ratings'].insert_many(get_ratings(0, 30))
+    rating_stats.refresh_rating_stats(database)
+    database[rating_stats.watermarks_collection].update_many({}, {'$set': {'refreshing': True}})
+    database['Ratings'].insert_many(get_ratings(30, 10))
+    monkeypatch.setattr(rating_stats, 'refresh_wait_seconds', 0)
+
+    with pytest.raises(SystemExit):
+        rating_stats.get_average_ratings(database, 'movieId')
+
+    with pytest.raises(SystemExit):
+        next(rating_stats.iter_average_ratings(database, 'userId', 10))
+
+    assert "a refresh failed; run rating_stats.py --rebuild" in capsys.readouterr().out
+
+    rating_stats.refresh_rating_stats(database, rebuild=True)
+    assert_averages_match(database)
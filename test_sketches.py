@@ -0,0 +1,117 @@
+# Checks the sketches of sketches.py against exact counts of the same values, and that updating a sketch batch by batch
+# and merging sketches give the same summary as building one over every value
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import sketches
+
+
+def build_histogram(values, batch_size, low=0.0, high=10.0, num_bins=20, include_high=True):
+    histogram = sketches.new_histogram(low, high, num_bins, include_high)
+
+    for start in range(0, len(values), batch_size):
+        sketches.update_histogram(histogram, values[start:start + batch_size])
+
+    return histogram
+
+
+@pytest.mark.parametrize('include_high', [True, False])
+def test_histogram_matches_exact_counts(include_high):
+    rng = np.random.default_rng(0)
+    values = np.concatenate([rng.uniform(-2, 12, 1000), [0.0, 10.0, 10.0, np.nan, np.nan]])
+    histogram = build_histogram(values, 64, include_high=include_high)
+
+    inside = values[(values >= 0) & ((values <= 10) if include_high else (values < 10))]
+    expected_counts, _ = np.histogram(inside, bins=sketches.get_bin_edges(histogram))
+    # np.histogram always includes the high edge in the last bin
+    expected_counts[-1] -= 0 if include_high else np.sum(inside == 10)
+
+    assert histogram['counts'].tolist() == expected_counts.tolist()
+    assert histogram['below'] == np.sum(values < 0)
+    assert histogram['above'] == np.sum(values > 10) + (0 if include_high else 2)
+    assert histogram['missing'] == 2
+
+
+def test_merged_histograms_match_one_pass():
+    values = np.random.default_rng(1).normal(5, 3, 2000)
+    merged = sketches.merge_histograms(build_histogram(values[:700], 100), build_histogram(values[700:], 300))
+    whole = build_histogram(values, len(values))
+
+    assert merged['counts'].tolist() == whole['counts'].tolist()
+
+    for key in ['below', 'above', 'missing']:
+        assert merged[key] == whole[key]
+
+
+def test_histogram_quantile_is_within_a_bin():
+    values = np.random.default_rng(2).uniform(0, 10, 5000)
+    histogram = build_histogram(values, 500, num_bins=100)
+
+    for quantile in [0.1, 0.5, 0.9]:
+        assert abs(sketches.get_histogram_quantile(histogram, quantile) - np.quantile(values, quantile)) <= 0.1
+
+    assert np.isnan(sketches.get_histogram_quantile(sketches.new_histogram(0, 1, 10), 0.5))
+
+
+def test_count_min_is_never_below_the_true_counts():
+    rng = np.random.default_rng(3)
+    keys = ['genre-{}'.format(value) for value in rng.zipf(1.5, 5000) % 300]
+    sketch = sketches.new_count_min(width=64, depth=4)
+
+    for start in range(0, len(keys), 1000):
+        sketches.update_count_min(sketch, keys[start:start + 1000])
+
+    true_counts = pd.Series(keys).value_counts()
+    estimates = sketches.estimate_counts(sketch, true_counts.index.tolist())
+
+    assert sketch['total'] == len(keys)
+    assert np.all(estimates >= true_counts.to_numpy())
+    # With few distinct keys and a wide sketch, the estimates are the counts
+    wide_sketch = sketches.update_count_min(sketches.new_count_min(), keys[:50])
+    wide_counts = pd.Series(keys[:50]).value_counts()
+    assert sketches.estimate_counts(wide_sketch, wide_counts.index.tolist()).tolist() == wide_counts.tolist()
+
+
+def test_merged_count_min_matches_one_pass():
+    keys = [str(value) for value in np.random.default_rng(4).integers(0, 100, 3000)]
+    merged = sketches.merge_count_min(sketches.update_count_min(sketches.new_count_min(32, 3), keys[:1200]),
+                                      sketches.update_count_min(sketches.new_count_min(32, 3), keys[1200:]))
+    whole = sketches.update_count_min(sketches.new_count_min(32, 3), keys)
+
+    assert merged['counts'].tolist() == whole['counts'].tolist() and merged['total'] == whole['total']
+
+
+def build_reservoir(df, size, batch_size, seed):
+    reservoir = sketches.new_reservoir(size, seed)
+
+    for start in range(0, len(df), batch_size):
+        sketches.update_reservoir(reservoir, df.iloc[start:start + batch_size])
+
+    return reservoir
+
+
+def test_reservoir_keeps_every_row_until_full():
+    df = pd.DataFrame({'id': range(30)})
+
+    assert sketches.get_reservoir_sample(sketches.new_reservoir(5)).empty
+    assert sketches.get_reservoir_sample(build_reservoir(df, 50, 7, 0))['id'].tolist() == list(range(30))
+
+
+def test_reservoir_sample_is_uniform():
+    # Every row is kept with probability size / rows, whatever its position in the stream and batch
+    df = pd.DataFrame({'id': range(100)})
+    times_kept = np.zeros(len(df))
+
+    for seed in range(200):
+        reservoir = build_reservoir(df, 10, 30, seed)
+        sample = sketches.get_reservoir_sample(reservoir)
+
+        assert reservoir['seen'] == len(df)
+        assert len(sample) == 10 and sample['id'].is_unique
+        times_kept[sample['id'].to_numpy()] += 1
+
+    # 20 expected per row, with a standard deviation of 4
+    assert np.all(np.abs(times_kept - 20) < 16)
+    assert abs(times_kept[:50].sum() - times_kept[50:].sum()) < 200